@@ -0,0 +1,63 @@
+import asyncio
+import logging
+
+from clock import AsyncioClock
+from outbound import SEND_RATE, SEND_BURST
+from peerbase import PeerBase
+
+log = logging.getLogger(__name__)
+
+
+class AsyncioTransport(object):
+    """
+    An asyncio datagram transport behind the write() and stopListening()
+    the peer calls on Twisted's.
+    """
+    def __init__(self, transport):
+        self.transport = transport
+
+    def write(self, data, addr):
+        self.transport.sendto(data, addr)
+
+    def stopListening(self):
+        self.transport.close()
+
+
+class AsyncioPeer(PeerBase, asyncio.DatagramProtocol):
+    """
+    A peer on an asyncio datagram endpoint. It only uses the loop's public
+    API, so it runs on uvloop as well. Handlers are registered and messages
+    handled exactly as on the Twisted Peer.
+    """
+    def __init__(self, reliable=False, probe_interval=1.0, probe_timeout=0.5, timeout=10,
+                 hello_rate=50, send_rate=SEND_RATE, send_burst=SEND_BURST, addr=None, port=None, loop=None):
+        """
+        Initialize the client as PeerBase does, on 'loop', by default the
+        running one. Nothing is sent or received until listen is awaited.
+        """
+        PeerBase.__init__(self, reliable=reliable, probe_interval=probe_interval, probe_timeout=probe_timeout, timeout=timeout,
+                          hello_rate=hello_rate, send_rate=send_rate, send_burst=send_burst, addr=addr, port=port, clock=AsyncioClock(loop))
+        self.closed = None
+
+    async def listen(self, interface="0.0.0.0"):
+        """
+        Method to bind the peer's port on 'interface' and start the periodic
+        tasks.
+        """
+        loop = self.clock.loop
+        self.closed = loop.create_future()
+        await loop.create_datagram_endpoint(lambda: self, local_addr=(interface, self.port))
+        self.start_loops(now=True)
+
+    def connection_made(self, transport):
+        self.transport = AsyncioTransport(transport)
+
+    def datagram_received(self, data, addr):
+        self.datagramReceived(data, addr[:2])
+
+    def error_received(self, exc):
+        log.debug("Socket error: %s", exc)
+
+    def connection_lost(self, exc):
+        if self.closed is not None and not self.closed.done():
+            self.closed.set_result(exc)
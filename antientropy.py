@@ -0,0 +1,150 @@
+import random
+from clock import LoopingCall
+
+# Feature peers advertise in their hello to say they take part in anti-entropy
+FEATURE = "digest/1"
+
+
+class AntiEntropy(object):
+    """
+    Periodically compares the board with one random peer and repairs any
+    difference, so boards that drifted apart after lost moves converge again
+    without asking for the whole game.
+
+    Every tick sends a digest with one hash per row to a single peer. The
+    peer answers only if some rows differ: it sends its entered cells in
+    those rows and asks for ours in return, which it gets in a second repair
+    message. The repair traffic is proportional to the rows that differ and
+    matching boards cost one 42-byte datagram per tick.
+
+    'get_game' returns the game currently played, as it is replaced when a
+    new one arrives, and 'on_change' is called after a repair changed cells.
+    With 'session' set, digests only go to the peers in that session and
+    every message carries its id.
+    """
+    def __init__(self, peer, get_game, on_change, interval=5.0, clock=None):
+        self.peer = peer
+        self.get_game = get_game
+        self.on_change = on_change
+        self.interval = interval
+        self.random = random.Random()
+        self.peer.add_handler("digest", self.handle_digest)
+        self.peer.add_handler("repair", self.handle_repair)
+        if FEATURE not in self.peer.features:
+            self.peer.features.append(FEATURE)
+        self.session = None
+        self.lc_digest = LoopingCall(self.send_digest)
+        if clock is not None:
+            self.lc_digest.clock = clock
+        self.digests_sent = 0
+        self.digests_matched = 0
+        self.rows_pulled = 0
+        self.cells_repaired = 0
+
+    def start(self):
+        """
+        Start gossiping digests, if it is not running yet.
+        """
+        if self.interval > 0 and not self.lc_digest.running:
+            self.lc_digest.start(self.interval, now=False)
+
+    def stop(self):
+        """
+        Stop gossiping digests.
+        """
+        if self.lc_digest.running:
+            self.lc_digest.stop()
+
+    def send_digest(self, addr=None):
+        """
+        Send the digest of the board to the given peer, or to one random peer
+        that takes part and is not still waiting for earlier datagrams.
+        """
+        game = self.get_game()
+        if game.puzzle is None:
+            return
+        if addr is not None:
+            candidates = [addr]
+        elif self.session is None:
+            candidates = self.peer.peers
+        else:
+            candidates = self.peer.sessions.members_of(self.session)
+        peers = [peer for peer in candidates if FEATURE in self.peer.peer_features.get(peer, ()) and not self.peer.congested(peer)]
+        if not peers:
+            return
+        self.digests_sent += 1
+        self.send({'msgtype': 'digest', 'seed': game.seed - 1, 'rows': game.digest()}, self.random.choice(peers))
+
+    def handle_digest(self, digest):
+        """
+        Compare a peer's digest with the board and start a repair of the rows
+        that differ. Digests of another round are left to the game data
+        exchange.
+        """
+        game = self.game_for(digest.sender)
+        if game is None or game.puzzle is None or digest['seed'] != game.seed - 1:
+            return
+        mask = 0
+        for row, (ours, theirs) in enumerate(zip(game.digest(), digest['rows'])):
+            if ours != theirs:
+                mask |= 1 << row
+        if not mask:
+            self.digests_matched += 1
+            return
+        self.rows_pulled += bin(mask).count("1")
+        self.send_repair(digest.sender, game, mask, mask)
+
+    def send_repair(self, addr, game, rows, want):
+        """
+        Send the entered cells of the given rows, asking for the peer's cells
+        in the rows of 'want' in return.
+        """
+        self.send({'msgtype': 'repair', 'seed': game.seed - 1, 'want': want, 'cells': game.rows(rows)}, addr)
+
+    def send(self, message, addr):
+        """
+        Send a digest or repair to a peer, in our session if we are in one.
+        """
+        if self.session is not None:
+            message['session'] = self.session
+        self.peer.send_message(message, addr)
+
+    def handle_repair(self, repair):
+        """
+        Merge the cells of a repair and send back the rows asked for.
+        """
+        game = self.game_for(repair.sender)
+        if game is None or game.puzzle is None or repair['seed'] != game.seed - 1:
+            return
+        changed = 0
+        for cell, number, ts, node in repair['cells']:
+            changed += game.merge_cell(cell // 9, cell % 9, number, (ts, node))
+        if repair['want']:
+            self.send_repair(repair.sender, game, repair['want'], 0)
+        if changed:
+            self.cells_repaired += changed
+            self.changed(repair.sender)
+
+    def game_for(self, addr):
+        """
+        The game a peer's digests and repairs are compared with, or None if
+        there is none to compare.
+        """
+        return self.get_game()
+
+    def changed(self, addr):
+        """
+        Report that a repair from a peer changed cells.
+        """
+        self.on_change()
+
+    def stats(self):
+        """
+        Digests sent and found matching, rows pulled and cells repaired.
+        """
+        return {
+            'digests_sent': self.digests_sent,
+            'digests_matched': self.digests_matched,
+            'rows_pulled': self.rows_pulled,
+            'cells_repaired': self.cells_repaired,
+        }
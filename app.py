@@ -1,14 +1,72 @@
 from tkinter import Entry, Label, Tk, Button
+import argparse
+import logging
+import os
+import sys
+import threading
 from twisted.internet import reactor
 from twisted.internet import tksupport
 from random import randint
 from peer import Peer
-from game import Game
+from outbound import SEND_RATE
+from game import Game, DIFFICULTIES, DEFAULT_DIFFICULTY
+from pool import PuzzlePool, DEFAULT_CACHE_PATH
+from journal import Journal
 from ui import UI
+from uiqueue import SWITCH_INTERVAL
+from metrics import MetricsExporter
+from metricsserver import MetricsFactory
+from profiling import Profiler, CAPTURE_SECONDS
 
 if __name__ == '__main__':
-    peer = Peer()
+    parser = argparse.ArgumentParser(description="P2P Sudoku")
+    parser.add_argument("--difficulty", choices=DIFFICULTIES, default=DEFAULT_DIFFICULTY, help="difficulty of new games")
+    parser.add_argument("--clues", type=int, help="carve new games down to this many clues, overrides --difficulty")
+    parser.add_argument("--pool-size", type=int, default=4, help="ready puzzles to keep per difficulty, 0 disables the pool")
+    parser.add_argument("--puzzle-cache", default=DEFAULT_CACHE_PATH, help="file the puzzle pool is persisted to")
+    parser.add_argument("--journal", help="file the moves are journaled to, so a restarted peer resumes its last round from it")
+    parser.add_argument("--unreliable", action="store_true", help="send moves and game data without acks and retransmission")
+    parser.add_argument("--flush-window", type=float, default=10, help="milliseconds moves are held back to be sent together, 0 sends every move at once")
+    parser.add_argument("--anti-entropy", type=float, default=5, help="seconds between board digests swapped with a random peer to repair lost moves, 0 turns it off")
+    parser.add_argument("--probe-interval", type=float, default=1, help="seconds between membership probes, each to a single peer")
+    parser.add_argument("--peer-timeout", type=float, default=10, help="seconds without a pong before a peer without membership probing is dropped")
+    parser.add_argument("--send-rate", type=float, default=SEND_RATE, help="datagrams per second sent to any one peer, more wait with moves first")
+    parser.add_argument("--threaded", action="store_true", help="run the network on a thread of its own instead of inside the Tk loop, so a busy UI does not delay messages")
+    parser.add_argument("--metrics-file", help="file a metrics snapshot is written to every --metrics-interval seconds, in the Prometheus text format if it ends in .prom and as JSON otherwise")
+    parser.add_argument("--metrics-interval", type=float, default=5, help="seconds between metrics snapshots written to --metrics-file")
+    parser.add_argument("--metrics-port", type=int, help="local TCP port serving metrics over HTTP, as JSON for paths ending in .json and in the Prometheus text format otherwise")
+    parser.add_argument("--profile", metavar="DIR", help="time every message handler and periodic task and the reactor lag; SIGUSR1 captures a cProfile and SIGUSR2 a sampled profile into DIR, and the timings are written there on exit")
+    parser.add_argument("--profile-seconds", type=float, default=CAPTURE_SECONDS, help="seconds a profile captured on a signal runs for")
+    parser.add_argument("--log-level", default="WARNING", choices=["DEBUG", "INFO", "WARNING", "ERROR"], help="DEBUG logs every message received")
+    args = parser.parse_args()
+    logging.basicConfig(level=args.log_level, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+
+    pool = None
+    if args.pool_size > 0:
+        levels = list(DIFFICULTIES.values()) + ([args.clues] if args.clues else [])
+        pool = PuzzlePool(size=args.pool_size, levels=levels, cache_path=args.puzzle_cache)
+        reactor.addSystemEventTrigger('before', 'shutdown', pool.close)
+
+    journal = recovered = None
+    if args.journal:
+        journal = Journal(args.journal)
+        recovered = journal.load(pool=pool, debug=True)
+        reactor.addSystemEventTrigger('before', 'shutdown', journal.close)
+
+    peer = Peer(reliable=not args.unreliable, send_rate=args.send_rate, probe_interval=args.probe_interval, timeout=args.peer_timeout)
     reactor.listenUDP(peer.port, peer)
+    profiler = None
+    if args.profile:
+        profiler = Profiler(reactor)
+        profiler.install(peer)
+        profiler.on_signals(args.profile, reactor.callFromThread, args.profile_seconds)
+        reactor.addSystemEventTrigger('before', 'shutdown', profiler.dump, os.path.join(args.profile, f"profile-{os.getpid()}.json"))
+    if args.metrics_file:
+        exporter = MetricsExporter(peer.metrics, args.metrics_file, args.metrics_interval)
+        reactor.callWhenRunning(exporter.start)
+        reactor.addSystemEventTrigger('before', 'shutdown', exporter.stop)
+    if args.metrics_port:
+        reactor.listenTCP(args.metrics_port, MetricsFactory(peer.metrics, profiler), interface="127.0.0.1")
     host, port = None, None
     def create_initial_dialog():
         """
@@ -70,20 +128,40 @@ if __name__ == '__main__':
     
     create_initial_dialog()
     root = Tk()
-    game = Game(randint(0,9999), debug=True)
-    ui = UI(root, peer, game)
+    if recovered is not None:
+        game = recovered
+    elif pool:
+        game = pool.new_game(args.difficulty, args.clues, debug=True, journal=journal)
+    else:
+        game = Game(randint(0,9999), debug=True, difficulty=args.difficulty, clues=args.clues, journal=journal)
+    ui = UI(root, peer, game, flush_window=args.flush_window / 1000, anti_entropy=args.anti_entropy, threaded=args.threaded)
     root.geometry("%dx%d" % (ui.width, ui.height+40))
     root.resizable(False,False)
-    root.protocol("WM_DELETE_WINDOW", peer.stop)
+    if args.threaded:
+        root.protocol("WM_DELETE_WINDOW", root.destroy)
+    else:
+        root.protocol("WM_DELETE_WINDOW", peer.stop)
 
     if host and port: # We either create a new game or join an existing game
-        reactor.callWhenRunning(peer.send_hello, (host, port))
-        reactor.callWhenRunning(reactor.callLater, 0.05, ui.ask_for_gamedata, (host, port))
+        # The game is asked for once the host's hello says how to talk to it
+        reactor.callWhenRunning(peer.join, (host, port), ui.sync.ask_for_gamedata)
     else:
-        game.start()
+        if recovered is None:
+            game.start()
         ui.init_ui()
-    tksupport.install(root)
-    reactor.run()
+    if args.threaded:
+        sys.setswitchinterval(SWITCH_INTERVAL)
+        network = threading.Thread(target=reactor.run, kwargs={'installSignalHandlers': False}, name="reactor", daemon=True)
+        network.start()
+        root.mainloop()
+        # The peer says bye and stops the reactor, which runs the shutdown
+        # triggers; the process waits for that before it exits and takes
+        # the daemon thread with it
+        reactor.callFromThread(peer.stop)
+        network.join()
+    else:
+        tksupport.install(root)
+        reactor.run()
 
 
 
@@ -0,0 +1,83 @@
+from collections import OrderedDict
+
+# Feature peers advertise in their hello to say they accept batched moves
+FEATURE = "moves/1"
+
+
+class MoveBatcher(object):
+    """
+    Collects outgoing moves for a short flush window and sends them together.
+    Writes to a cell that is still waiting replace the earlier value, so a
+    player retyping a cell costs one move on the wire instead of several.
+
+    'send' is called with the list of (row, col, number, ts) moves to put on
+    the wire and returns the number of datagrams it wrote.
+    """
+    def __init__(self, send, window=0.01, max_moves=64, clock=None):
+        if clock is None:
+            from twisted.internet import reactor as clock
+        self.send = send
+        self.window = window
+        self.max_moves = max_moves
+        self.clock = clock
+        self.pending = OrderedDict()
+        self.first_at = None
+        self.call = None
+        self.moves = 0
+        self.coalesced = 0
+        self.flushes = 0
+        self.packets = 0
+        self.delay_sum = 0
+        self.delay_max = 0
+
+    def add(self, row, col, number, ts=0):
+        """
+        Queue a move, flushing right away if the window is zero or the batch
+        is full. 'ts' is the Lamport counter the move was stamped with.
+        """
+        self.moves += 1
+        key = (row, col)
+        if key in self.pending:
+            self.coalesced += 1
+            del self.pending[key]
+        self.pending[key] = (number, ts)
+        if self.first_at is None:
+            self.first_at = self.clock.seconds()
+        if self.window <= 0 or len(self.pending) >= self.max_moves:
+            self.flush()
+        elif self.call is None:
+            self.call = self.clock.callLater(self.window, self.flush)
+
+    def flush(self):
+        """
+        Send every queued move now.
+        """
+        if self.call is not None:
+            if self.call.active():
+                self.call.cancel()
+            self.call = None
+        if not self.pending:
+            return
+        moves = [(row, col, number, ts) for (row, col), (number, ts) in self.pending.items()]
+        self.pending.clear()
+        delay = self.clock.seconds() - self.first_at
+        self.first_at = None
+        self.flushes += 1
+        self.delay_sum += delay
+        self.delay_max = max(self.delay_max, delay)
+        self.packets += self.send(moves) or 0
+
+    def stats(self):
+        """
+        Moves queued and coalesced, flushes and datagrams sent, and how long
+        moves waited before being flushed, in seconds.
+        """
+        return {
+            'moves': self.moves,
+            'coalesced': self.coalesced,
+            'flushes': self.flushes,
+            'packets': self.packets,
+            'moves_per_flush': (self.moves - self.coalesced) / self.flushes if self.flushes else 0,
+            'delay_avg': self.delay_sum / self.flushes if self.flushes else 0,
+            'delay_max': self.delay_max,
+        }
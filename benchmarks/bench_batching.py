@@ -0,0 +1,64 @@
+"""
+Benchmark: datagrams per second and added latency of move batching, for a
+range of flush windows, replaying a fast player on a simulated clock.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_batching [--rate MOVES_PER_S] [--overwrite P]
+"""
+import argparse
+import random
+
+from twisted.internet.task import Clock
+
+from batching import MoveBatcher
+
+WINDOWS_MS = [0, 5, 10, 20]
+
+
+def advance_to(clock, when):
+    # Clock.advance runs due calls at the end of the step, so stop at each
+    # scheduled call to keep the flush times exact
+    while True:
+        calls = [call.getTime() for call in clock.getDelayedCalls()]
+        if not calls or min(calls) > when:
+            break
+        clock.advance(max(0, min(calls) - clock.seconds()))
+    clock.advance(when - clock.seconds())
+
+
+def replay(window, rate, overwrite, seconds, seed):
+    clock = Clock()
+    batcher = MoveBatcher(lambda moves: 1, window / 1000, clock=clock)
+    rng = random.Random(seed)
+    cell = (0, 0)
+    t = 0.0
+    while t < seconds:
+        t += rng.expovariate(rate)
+        advance_to(clock, t)
+        if rng.random() >= overwrite:
+            cell = (rng.randrange(9), rng.randrange(9))
+        batcher.add(cell[0], cell[1], rng.randrange(10))
+    advance_to(clock, t + 1)
+    return batcher.stats()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rate", type=float, default=50, help="moves per second")
+    parser.add_argument("--overwrite", type=float, default=0.3, help="chance a move rewrites the previous cell")
+    parser.add_argument("--seconds", type=float, default=60)
+    args = parser.parse_args()
+
+    print(f"{args.rate:.0f} moves/s, {args.overwrite:.0%} rewrites of the same cell, one peer")
+    for window in WINDOWS_MS:
+        stats = replay(window, args.rate, args.overwrite, args.seconds, seed=1)
+        print(
+            f"window {window:3} ms: {stats['packets'] / args.seconds:6.1f} datagrams/s, "
+            f"{stats['moves_per_flush']:.2f} moves/datagram, {stats['coalesced']} coalesced, "
+            f"oldest move held avg {stats['delay_avg'] * 1000:5.2f} ms max {stats['delay_max'] * 1000:5.2f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+"""
+Benchmark: time to carve a uniquely solvable puzzle, per difficulty level.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_carve [--puzzles N]
+"""
+import argparse
+import statistics
+import time
+
+from board import Board
+from game import Game, DIFFICULTIES
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--puzzles", type=int, default=50)
+    args = parser.parse_args()
+
+    for difficulty in DIFFICULTIES:
+        timings, clues = [], []
+        for seed in range(args.puzzles):
+            game = Game(seed, difficulty=difficulty)
+            board = Board()
+            game.seed += 1
+            game.solve_sudoku(board)
+            start = time.perf_counter()
+            game.remove_cells(board)
+            timings.append((time.perf_counter() - start) * 1000)
+            clues.append(board.filled())
+            assert game.solver.count_solutions(board, 2) == 1
+        print(
+            f"{difficulty:>7} (target {DIFFICULTIES[difficulty]:2} clues): "
+            f"median {statistics.median(timings):6.2f} ms, "
+            f"max {max(timings):6.2f} ms, "
+            f"clues {min(clues)}-{max(clues)} (mean {statistics.mean(clues):.1f})"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Benchmark: bytes on the wire and encode/decode time per message, JSON
+versus the binary protocol.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_codec [--rounds N]
+"""
+import argparse
+import json
+import time
+
+import protocol
+from game import Game
+
+ADDR, PORT = "192.168.100.200", 54321
+
+
+def sample_messages():
+    game = Game(1234, difficulty="medium", node=f"{ADDR}:{PORT}")
+    game.start()
+    # A game a dozen moves in, the state a joining peer has to catch up on
+    empty = [cell for cell in range(81) if game.board[cell // 9][cell % 9] == 0]
+    for cell in empty[:12]:
+        game.set_cell(cell // 9, cell % 9, game.solution[cell // 9][cell % 9])
+    return [
+        {'msgtype': 'ping', 'timestamp': time.time()},
+        {'msgtype': 'pong', 'timestamp': time.time()},
+        {'msgtype': 'move', 'row': 4, 'col': 7, 'number': 9, 'ts': 42},
+        {'msgtype': 'ask_gamedata'},
+        {'msgtype': 'ask_gamedata', 'seed': game.seed - 1, 'versions': {f"{ADDR}:{PORT + 1}": 17}},
+        {'msgtype': 'bye'},
+        {
+            'msgtype': 'gamedata',
+            'seed': game.seed - 1,
+            'difficulty': game.difficulty,
+            'clues': game.clues,
+            'puzzle': game.puzzle,
+        },
+        {
+            'msgtype': 'gamedata',
+            'seed': game.seed - 1,
+            'difficulty': game.difficulty,
+            'clues': game.clues,
+            'cells': game.deltas({}),
+        },
+    ]
+
+
+def per_call(func, arg, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        func(arg)
+    return (time.perf_counter() - start) / rounds * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rounds", type=int, default=20000)
+    args = parser.parse_args()
+
+    print(f"{'message':>13} | {'JSON':>5} B {'enc':>6} {'dec':>6} us | {'binary':>6} B {'enc':>6} {'dec':>6} us | saved")
+    for message in sample_messages():
+        as_json = dict(message, addr=ADDR, port=PORT)
+        json_encode = lambda m: json.dumps(m, default=protocol.jsonable).encode('utf-8')
+        json_data = json_encode(as_json)
+        json_decode = lambda d: json.loads(d.decode('utf-8'))
+        binary_data = protocol.encode(message)
+        assert protocol.decode(binary_data)[0] == message['msgtype']
+
+        json_enc = per_call(json_encode, as_json, args.rounds)
+        json_dec = per_call(json_decode, json_data, args.rounds)
+        bin_enc = per_call(protocol.encode, message, args.rounds)
+        bin_dec = per_call(protocol.decode, binary_data, args.rounds)
+        label = message['msgtype'] + ("*" if 'cells' in message or 'versions' in message else "")
+        print(
+            f"{label:>13} | {len(json_data):5} B {json_enc:6.2f} {json_dec:6.2f} us | "
+            f"{len(binary_data):6} B {bin_enc:6.2f} {bin_dec:6.2f} us | "
+            f"{len(json_data) - len(binary_data):4} B, {json_enc + json_dec - bin_enc - bin_dec:6.2f} us"
+        )
+    print("* delta form: version vector / entered cells only")
+
+
+if __name__ == "__main__":
+    main()
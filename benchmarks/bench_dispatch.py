@@ -0,0 +1,105 @@
+"""
+Benchmark: datagrams per second through Peer.datagramReceived.
+
+The 'legacy' path replays how dispatch used to work: json.loads to find the
+message type, the raw line handed to the handler which parses it again (the
+move handler three times), and every line printed. The current path decodes
+each datagram once into a Message, with debug logging switched off. The
+'profiled' path is the binary one with a profiling.Profiler installed,
+which times every handler call.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_dispatch [--datagrams N]
+"""
+import argparse
+import io
+import json
+import logging
+import time
+from contextlib import redirect_stdout
+
+import protocol
+from peer import Peer
+from profiling import Profiler
+
+SENDER = ("192.168.100.200", 54321)
+
+
+class NullTransport(object):
+    def write(self, data, addr):
+        pass
+
+
+def legacy_datagram_received(handlers, data):
+    data = data.decode('utf-8')
+    for line in data.splitlines():
+        line = line.strip()
+        print(line)
+        msgtype = json.loads(line)['msgtype']
+        if msgtype in handlers:
+            handlers[msgtype](line)
+
+
+def legacy_handle_move(board):
+    def handle_move(line):
+        peer, port = json.loads(line)['addr'], int(json.loads(line)['port'])
+        move = json.loads(line)
+        board[move['row']][move['col']] = move['number']
+    return handle_move
+
+
+def handle_move(board):
+    def handle_move(move):
+        board[move['row']][move['col']] = move['number']
+    return handle_move
+
+
+def datagrams(count):
+    moves = []
+    for i in range(count):
+        moves.append({'msgtype': 'move', 'row': i % 9, 'col': i // 9 % 9, 'number': i % 10})
+    return moves
+
+
+def run(receive, data, count):
+    start = time.perf_counter()
+    for i in range(count):
+        receive(data[i % len(data)])
+    return count / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--datagrams", type=int, default=100000)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    moves = datagrams(810)
+    as_json = [json.dumps(dict(m, addr=SENDER[0], port=str(SENDER[1]))).encode('utf-8') for m in moves]
+    as_binary = [protocol.encode(m) for m in moves]
+
+    board = [[0] * 9 for _ in range(9)]
+    legacy_handlers = {'move': legacy_handle_move(board)}
+    with redirect_stdout(io.StringIO()) as out:
+        legacy = run(lambda d: (legacy_datagram_received(legacy_handlers, d), out.seek(0), out.truncate()), as_json, args.datagrams)
+
+    peer = Peer()
+    peer.transport = NullTransport()
+    peer.add_handler('move', handle_move(board))
+    peer.aliases[SENDER] = SENDER
+    current = run(lambda d: peer.datagramReceived(d, SENDER), as_json, args.datagrams)
+    binary = run(lambda d: peer.datagramReceived(d, SENDER), as_binary, args.datagrams)
+    profiler = Profiler(peer.clock)
+    profiler.install(peer)
+    profiled = run(lambda d: peer.datagramReceived(d, SENDER), as_binary, args.datagrams)
+    profiler.uninstall()
+
+    for label, rate in (("legacy JSON", legacy), ("single-parse JSON", current), ("single-parse binary", binary), ("profiled binary", profiled)):
+        print(f"{label:>20}: {rate:10.0f} datagrams/s")
+    print(f"speed-up: {current / legacy:.1f}x (JSON), {binary / legacy:.1f}x (binary)")
+    print(f"profiler: {(1 / profiled - 1 / binary) * 1e9:.0f} ns per datagram")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Benchmark: grading puzzles by the hardest solving technique they need.
+Generates --puzzles puzzles per difficulty, shows how their grades spread
+over the techniques, and times grading them one by one in this process
+against grade_many's pool of worker processes, startup included.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_grade [--puzzles N] [--workers W]
+"""
+import argparse
+import os
+import random
+import time
+from collections import Counter
+
+from game import Game, DIFFICULTIES
+from grader import Grader, grade_many, grade_name, TECHNIQUES, UNSOLVED
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--puzzles", type=int, default=200, help="puzzles per difficulty")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="worker processes for the batch")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    puzzles = {}
+    for difficulty in DIFFICULTIES:
+        puzzles[difficulty] = []
+        for _ in range(args.puzzles):
+            game = Game(rng.randint(1, 2**31 - 2), difficulty=difficulty)
+            game.start()
+            puzzles[difficulty].append(game.board)
+    boards = [board for level in puzzles.values() for board in level]
+
+    grader = Grader()
+    if [step.__name__ for step in grader.steps] != [name.replace(" ", "_").replace("-", "_") for name in TECHNIQUES]:
+        raise SystemExit("Grader.steps are not in the order of TECHNIQUES")
+    start = time.perf_counter()
+    grades = [grader.grade(board) for board in boards]
+    serial = time.perf_counter() - start
+    start = time.perf_counter()
+    batch = grade_many(boards, args.workers)
+    pooled = time.perf_counter() - start
+    if batch != grades:
+        raise SystemExit("grade_many disagrees with Grader")
+
+    print(f"{args.puzzles} puzzles per difficulty, share of each grade:")
+    names = [grade_name(grade) for grade in range(1, UNSOLVED + 1)]
+    width = max(len(name) for name in names)
+    print(" " * width + "".join(f"{difficulty:>9}" for difficulty in DIFFICULTIES))
+    counts = {}
+    for i, difficulty in enumerate(DIFFICULTIES):
+        counts[difficulty] = Counter(grades[i * args.puzzles:(i + 1) * args.puzzles])
+    for grade, name in zip(range(1, len(TECHNIQUES) + 2), names):
+        print(f"{name:>{width}}" + "".join(f"{counts[difficulty][grade] / args.puzzles:9.0%}" for difficulty in DIFFICULTIES))
+    print(f"one by one: {len(boards) / serial:8.0f} puzzles/s")
+    print(f"grade_many: {len(boards) / pooled:8.0f} puzzles/s on {args.workers} worker(s), {os.cpu_count()} CPU(s)")
+
+
+if __name__ == "__main__":
+    main()
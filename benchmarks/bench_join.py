@@ -0,0 +1,95 @@
+"""
+Benchmark: a join storm, many peers joining a game through the same peer at
+once, with the paged, rate-limited introductions against the old hello that
+carries the full peer list and is answered by everyone on it.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_join [--peers N] [--legacy-peers N]
+"""
+import argparse
+import json
+import time
+
+from peer import Peer
+from simulation import SimulatedNetwork
+
+
+class LegacyPeer(Peer):
+    """
+    A peer introducing others the way hello used to: a new peer gets the
+    whole peer list and says hello to every peer on it, known or not.
+    """
+    def handle_hello(self, hello):
+        peer = hello.sender
+        self.peer_features[peer] = set(hello.get('features', ()))
+        if peer not in self.peers:
+            self.peers.add(peer)
+            self.send_hello(peer, include_peers=True)
+        if 'peers' in hello:
+            for peer in hello['peers']:
+                if (peer['addr'], peer['port']) != (self.addr, self.port):
+                    self.send_hello((peer['addr'], peer['port']))
+
+    def send_hello(self, addr, include_peers=False, join=None):
+        if addr == (self.addr, self.port):
+            return
+        hello = {'addr': self.addr, 'port': self.port, 'msgtype': 'hello', 'features': self.features}
+        if include_peers:
+            hello['peers'] = [{'addr': peer[0], 'port': peer[1]} for peer in self.peers if peer != addr]
+        self.write(json.dumps(hello).encode('utf-8'), addr)
+
+    def join(self, addr):
+        self.send_hello(addr)
+
+
+def storm(peer_class, count, latency, limit):
+    network = SimulatedNetwork(latency=latency)
+    clock = network.clock
+    contact = peer_class(addr="10.0.0.1", port=50000, clock=clock)
+    network.attach(contact)
+    joiners = []
+    for i in range(count):
+        peer = peer_class(addr=f"10.1.{i // 250}.{i % 250 + 1}", port=50000, clock=clock)
+        network.attach(peer)
+        joiners.append(peer)
+    everyone = [contact] + joiners
+    start = time.process_time()
+    for peer in joiners:
+        peer.join((contact.addr, contact.port))
+    converged = None
+    while clock.seconds() < limit:
+        clock.advance(0.01)
+        if converged is None and all(len(peer.peers) == count for peer in everyone):
+            converged = clock.seconds()
+        if converged is not None and not clock.getDelayedCalls():
+            break
+    return network, converged, time.process_time() - start
+
+
+def report(name, count, network, converged, cpu):
+    print(f"{name}, {count} peers joining at once:")
+    settled = f"{converged:.2f}s" if converged is not None else "never"
+    print(f"  full view after {settled}, {cpu:.2f}s CPU")
+    print(
+        f"  {network.datagrams} datagrams ({network.datagrams / count:.1f} per joiner), "
+        f"{network.bytes / 1024:.0f} KiB, largest {network.largest} B, {network.oversized} over {network.mtu} B"
+    )
+    print("  " + ", ".join(f"{msgtype} {n}" for msgtype, (n, _) in sorted(network.by_type.items())))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--peers", type=int, default=200)
+    parser.add_argument("--legacy-peers", type=int, default=50, help="peers for the old hello, whose cost grows with the cube of the swarm; 0 skips it")
+    parser.add_argument("--latency", type=float, default=0.005, help="one-way latency in seconds")
+    parser.add_argument("--limit", type=float, default=60, help="simulated seconds to give up after")
+    args = parser.parse_args()
+
+    report("paged introductions", args.peers, *storm(Peer, args.peers, args.latency, args.limit))
+    if args.legacy_peers:
+        report("full peer list in hello", args.legacy_peers, *storm(LegacyPeer, args.legacy_peers, args.latency, args.limit))
+
+
+if __name__ == "__main__":
+    main()
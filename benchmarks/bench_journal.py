@@ -0,0 +1,87 @@
+"""
+Benchmark: the move journal. Appends --moves moves to a journal through a
+game, then times reading them back through the memory map, recovering the
+game from it, asking for the last 1000 moves and compacting the journal
+into a snapshot.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_journal [--moves N]
+"""
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from game import Game
+from journal import Journal
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--moves", type=int, default=200000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix="bench_journal")
+    try:
+        path = os.path.join(directory, "journal.bin")
+        journal = Journal(path, snapshot_every=args.moves + 1)
+        journal.load()
+        game = Game(args.seed, node="10.0.0.1:50000", journal=journal)
+        game.start()
+        empty = [cell for cell in range(81) if game.board.cells[cell] == 0]
+        rng = random.Random(args.seed)
+        nodes = [f"10.0.0.{i}:50000" for i in range(2, 6)]
+        moves = [(rng.choice(empty), rng.randint(1, 9), rng.choice(nodes)) for _ in range(args.moves)]
+
+        start = time.perf_counter()
+        for counter, (cell, number, node) in enumerate(moves, 1):
+            game.merge_cell(cell // 9, cell % 9, number, (counter, node))
+        append = time.perf_counter() - start
+        journal.close()
+        size = os.path.getsize(path)
+
+        reader = Journal(path)
+        start = time.perf_counter()
+        replayed = reader.replay()
+        replay = time.perf_counter() - start
+        assert len(replayed) == args.moves
+
+        start = time.perf_counter()
+        tail = reader.since(args.moves - 1000)
+        since = time.perf_counter() - start
+        assert len(tail) == 1000
+
+        start = time.perf_counter()
+        generate = Game(args.seed)
+        generate.start()
+        generated = time.perf_counter() - start
+
+        start = time.perf_counter()
+        recovered = Journal(path, snapshot_every=args.moves + 1)
+        restored = recovered.load(node="10.0.0.1:50001")
+        recover = time.perf_counter() - start
+        recovered.close()
+        assert bytes(restored.puzzle) == bytes(game.puzzle) and restored.registers.stamps == game.registers.stamps
+
+        start = time.perf_counter()
+        journal.open()
+        journal.snapshot()
+        compact = time.perf_counter() - start
+        journal.close()
+    finally:
+        shutil.rmtree(directory)
+
+    print(f"{args.moves} moves, {size / args.moves:.1f} bytes per move")
+    print(f"  append:    {args.moves / append:10.0f} moves/s (merged into the game and written)")
+    print(f"  replay:    {args.moves / replay:10.0f} moves/s (read through the memory map)")
+    print(f"  recover:   {args.moves / recover:10.0f} moves/s ({recover * 1000:.0f} ms, of which {generated * 1000:.1f} ms regenerating the puzzle)")
+    print(f"  since:     {since * 1000:10.2f} ms for the last 1000 moves")
+    print(f"  snapshot:  {compact * 1000:10.2f} ms to compact the journal")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""
+Benchmark: per-peer message load and failure detection time of the SWIM
+membership protocol, against the old full-mesh ping, for swarms of in-process
+peers on a simulated clock and network.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_membership [--sizes 10,100,1000] [--loss P]
+"""
+import argparse
+import random
+import time
+
+from twisted.internet.task import LoopingCall
+
+import protocol
+from protocol import Message
+from membership import Membership, Member
+from simulation import HeapClock
+
+STEP = 0.01
+
+
+class Swarm(object):
+    """
+    In-process peers wired together through a simulated network with a fixed
+    latency and random loss. Peers in 'down' neither send nor receive.
+    """
+    def __init__(self, size, loss, latency, seed):
+        self.clock = HeapClock()
+        self.random = random.Random(seed)
+        self.loss = loss
+        self.latency = latency
+        self.down = set()
+        self.sent = 0
+        self.bytes = 0
+        addrs = [(f"10.{i // 250}.{i % 250}.1", 50000) for i in range(size)]
+        self.nodes = {}
+        self.loops = {}
+        for addr in addrs:
+            node = Membership(addr, self.sender(addr), clock=self.clock, rng=random.Random(self.random.random()))
+            # Start from a settled swarm where everybody knows everybody
+            for other in addrs:
+                if other != addr:
+                    node.members[other] = Member(other)
+            self.nodes[addr] = node
+        for addr, node in self.nodes.items():
+            loop = LoopingCall(node.tick)
+            loop.clock = self.clock
+            self.clock.callLater(self.random.random() * node.period, loop.start, node.period)
+            self.loops[addr] = loop
+
+    def sender(self, src):
+        def send(message, dst):
+            if src in self.down:
+                return
+            self.sent += 1
+            self.bytes += len(protocol.encode(message))
+            if dst in self.down or self.random.random() < self.loss:
+                return
+            fields = dict(message)
+            msgtype = fields.pop('msgtype')
+            self.clock.callLater(self.latency, self.deliver, Message(msgtype, src, fields), dst)
+        return send
+
+    def deliver(self, message, dst):
+        if dst in self.down:
+            return
+        node = self.nodes[dst]
+        if message.msgtype == 'ping':
+            node.handle_ping(message)
+        elif message.msgtype == 'ping_req':
+            node.handle_ping_req(message)
+        elif message.msgtype == 'pong':
+            node.handle_pong(message)
+
+    def kill(self, addr):
+        self.down.add(addr)
+        loop = self.loops[addr]
+        if loop.running:
+            loop.stop()
+
+    def run(self, seconds, until=None):
+        end = self.clock.seconds() + seconds
+        while self.clock.seconds() < end:
+            self.clock.advance(STEP)
+            if until is not None and until():
+                return True
+        return False
+
+
+def measure(size, loss, latency, seconds, seed):
+    swarm = Swarm(size, loss, latency, seed)
+    swarm.run(5)
+    sent, sent_bytes = swarm.sent, swarm.bytes
+    start = time.process_time()
+    swarm.run(seconds)
+    cpu = time.process_time() - start
+    per_peer = (swarm.sent - sent) / seconds / size
+    bytes_per_peer = (swarm.bytes - sent_bytes) / seconds / size
+    false_dead = sum(len(node.dead) for node in swarm.nodes.values())
+
+    victim = swarm.random.choice(list(swarm.nodes))
+    swarm.kill(victim)
+    killed_at = swarm.clock.seconds()
+    live = [node for addr, node in swarm.nodes.items() if addr not in swarm.down]
+    first = {}
+
+    def detected():
+        if not first and any(victim in node.dead for node in live):
+            first['at'] = swarm.clock.seconds()
+        return all(victim not in node.members for node in live)
+
+    done = swarm.run(120, detected)
+    first_seen = first.get('at', swarm.clock.seconds()) - killed_at
+    everyone = swarm.clock.seconds() - killed_at if done else float('inf')
+    return per_peer, bytes_per_peer, cpu / seconds, false_dead, first_seen, everyone
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", default="10,100,1000", help="comma separated swarm sizes")
+    parser.add_argument("--loss", type=float, default=0.01, help="probability a datagram is lost")
+    parser.add_argument("--latency", type=float, default=0.005, help="one-way latency in seconds")
+    parser.add_argument("--seconds", type=float, default=20, help="simulated seconds to measure the load over")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    print(f"{args.loss:.0%} loss, {args.latency * 1000:.0f} ms latency, 1 s protocol period")
+    print(f"{'peers':>6} | {'full mesh':>10} | {'SWIM msg/s':>10} {'B/s':>7} | {'CPU/sim s':>9} | {'false dead':>10} | {'first dead':>10} {'all dead':>9}")
+    for size in map(int, args.sizes.split(",")):
+        per_peer, bytes_per_peer, cpu, false_dead, first_seen, everyone = measure(size, args.loss, args.latency, args.seconds, args.seed)
+        print(
+            f"{size:6} | {2 * (size - 1):10} | {per_peer:10.2f} {bytes_per_peer:7.0f} | {cpu:8.3f}s | "
+            f"{false_dead:10} | {first_seen:9.2f}s {everyone:8.2f}s"
+        )
+
+
+if __name__ == "__main__":
+    main()
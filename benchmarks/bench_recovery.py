@@ -0,0 +1,150 @@
+"""
+Benchmark: how peers recover after losing track of each other on a
+simulated network. One of two reliable peers forgets the other, as after a
+false failure report, while moves are still in flight, and they say hello
+again; reports the moves each side then got and how long after the last
+one was sent they had all arrived. Then a swarm is cut in two for long
+enough that each half declares the other dead, both halves play on, and
+the network heals; reports how long the peers take to know each other and
+agree on the board again. Exits with an error if a move is lost or the
+swarm does not come back together.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_recovery [--moves N] [--loss P] [--latency S]
+        [--peers N] [--cut S]
+"""
+import argparse
+import sys
+
+from peer import Peer
+from simulation import SimulatedNetwork, Swarm
+
+
+def pair(args):
+    network = SimulatedNetwork(latency=args.latency, loss=args.loss, seed=args.seed)
+    peers = []
+    for i in (1, 2):
+        peer = Peer(reliable=True, addr=f"10.0.0.{i}", port=9000 + i, clock=network.clock)
+        network.attach(peer)
+        peer.start_loops()
+        peer.got = []
+        peer.add_handler('move', lambda message, peer=peer: peer.got.append(message['number']))
+        peers.append(peer)
+    return network, peers
+
+
+def run(network, seconds):
+    network.clock.run_until(network.clock.seconds() + seconds)
+
+
+def address(peer):
+    return (peer.addr, peer.port)
+
+
+def play(network, src, dst, moves):
+    for i in range(moves):
+        src.send_message({'msgtype': 'move', 'row': i % 9, 'col': i // 9 % 9, 'number': i % 9 + 1},
+                         address(dst), reliable=True)
+        run(network, 0.01)
+
+
+def greet(network, who, other, limit):
+    """
+    Say hello until both sides know the other acks sequenced messages, as
+    a hello can be lost.
+    """
+    end = network.clock.seconds() + limit
+    while not (who.is_reliable(address(other)) and other.is_reliable(address(who))):
+        if network.clock.seconds() >= end:
+            return False
+        who.send_hello(address(other))
+        run(network, 0.2)
+    return True
+
+
+def forget_and_rehello(args):
+    """
+    Moves from before, during and after one peer forgets the other,
+    then moves both ways on the channels made by the new hello. Returns the
+    moves each side got after the forget, and the simulated seconds from
+    the last move sent until the last one arrived.
+    """
+    network, peers = pair(args)
+    who, other = peers
+    greet(network, who, other, args.limit)
+    play(network, other, who, args.moves)
+    run(network, args.limit)
+    who.got.clear()
+
+    who.forget(address(other))
+    play(network, other, who, args.moves)
+    greet(network, who, other, args.limit)
+    play(network, other, who, args.moves)
+    play(network, who, other, args.moves)
+    sent = network.clock.seconds()
+    while len(who.got) < 2 * args.moves or len(other.got) < args.moves:
+        if network.clock.seconds() - sent >= args.limit:
+            break
+        run(network, 0.01)
+    taken = network.clock.seconds() - sent
+    run(network, args.limit)
+    return len(who.got), len(other.got), taken
+
+
+def partition_and_heal(args):
+    """
+    Cut a swarm in two for args.cut simulated seconds while both halves
+    play, then heal it. Returns the peers each peer knows just before the
+    heal, at least, and the simulated seconds from the heal until every
+    peer knows every other one and the boards agree, or None.
+    """
+    network = SimulatedNetwork(latency=args.latency, loss=args.loss, seed=args.seed)
+    swarm = Swarm(args.peers, network, seed=args.seed)
+    swarm.start_loops()
+    if not swarm.connect():
+        raise RuntimeError(f"{args.peers} peers did not all get the game")
+    swarm.run(2)
+    addrs = [address(peer) for peer in swarm.peers]
+    half = len(addrs) // 2
+    network.partition(addrs[:half], addrs[half:])
+    end = swarm.clock.seconds() + args.cut
+    while swarm.clock.seconds() < end:
+        swarm.play_random()
+        swarm.run(1)
+    known = min(len(peer.peers) for peer in swarm.peers)
+    network.heal()
+    start = swarm.clock.seconds()
+    if swarm.run_until(lambda: swarm.full_view() and swarm.converged(), args.limit, step=0.1):
+        return known, swarm.clock.seconds() - start
+    return known, None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--moves", type=int, default=20, help="moves sent in each phase")
+    parser.add_argument("--loss", type=float, default=0.0)
+    parser.add_argument("--latency", type=float, default=0.005, help="one-way latency in seconds")
+    parser.add_argument("--peers", type=int, default=6, help="peers in the swarm that is cut in two")
+    parser.add_argument("--cut", type=float, default=30, help="simulated seconds the swarm stays cut in two")
+    parser.add_argument("--limit", type=float, default=60, help="simulated seconds to wait for delivery or to come back together")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    print(f"{args.moves} moves per phase, {args.loss:.0%} loss, {args.latency * 1000:.0f} ms latency")
+    forgot, other, taken = forget_and_rehello(args)
+    # The forgetter gets the moves sent after it said hello again and, as
+    # they are resent until acked, the ones sent while it had forgotten
+    ok = forgot == 2 * args.moves and other == args.moves
+    print(f"forget then hello | forgetter got {forgot:4} other got {other:4} | {taken:6.2f}s | {'ok' if ok else 'LOST MOVES'}")
+
+    known, healed = partition_and_heal(args)
+    if healed is None:
+        print(f"partition of {args.peers} peers for {args.cut:.0f}s | {known} peers known when cut | not back together after {args.limit:.0f}s")
+    else:
+        print(f"partition of {args.peers} peers for {args.cut:.0f}s | {known} peers known when cut | back together {healed:6.2f}s after the heal")
+    if not ok or healed is None:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Benchmark: reliable delivery of moves between two peers through a lossy,
+reordering UDP proxy in each direction. Reports whether every move arrived
+in order, the retransmit rate and the goodput.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_reliable [--moves N] [--loss P] [--reorder P]
+"""
+import argparse
+import time
+
+from twisted.internet import reactor
+
+from benchmarks.lossy_proxy import LossyProxy
+from peer import Peer
+
+
+def move_for(i):
+    return {'msgtype': 'move', 'row': i % 9, 'col': i // 9 % 9, 'number': i % 10}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--moves", type=int, default=2000)
+    parser.add_argument("--rate", type=int, default=1000, help="moves sent per second")
+    parser.add_argument("--loss", type=float, default=0.1)
+    parser.add_argument("--reorder", type=float, default=0.1)
+    parser.add_argument("--duplicate", type=float, default=0.01)
+    parser.add_argument("--timeout", type=float, default=60)
+    args = parser.parse_args()
+
+    sender, receiver = Peer(reliable=True), Peer(reliable=True)
+    proxies = []
+    for peer in (sender, receiver):
+        reactor.listenUDP(peer.port, peer)
+        proxy = LossyProxy((peer.addr, peer.port), args.loss, args.reorder, args.duplicate, seed=peer.port)
+        proxies.append(proxy)
+        # Announce the proxy in front of the peer, so everything sent to it goes through the proxy
+        peer.port = reactor.listenUDP(0, proxy).getHost().port
+
+    received = []
+    receiver.add_handler('move', lambda move: received.append((move['row'], move['col'], move['number'])))
+    state = {'sent': 0, 'start': None}
+
+    def handshake():
+        if sender.is_reliable((receiver.addr, receiver.port)) and receiver.is_reliable((sender.addr, sender.port)):
+            state['start'] = time.perf_counter()
+            send_batch()
+            return
+        sender.send_hello((receiver.addr, receiver.port))
+        receiver.send_hello((sender.addr, sender.port))
+        reactor.callLater(0.1, handshake)
+
+    def send_batch():
+        per_tick = max(1, args.rate // 100)
+        for _ in range(per_tick):
+            if state['sent'] == args.moves:
+                break
+            sender.broadcast(move_for(state['sent']), reliable=True)
+            state['sent'] += 1
+        if state['sent'] < args.moves:
+            reactor.callLater(0.01, send_batch)
+
+    def check():
+        channel = sender.channels.get((receiver.addr, receiver.port))
+        done = len(received) == args.moves and channel is not None and not channel.unacked and not channel.backlog
+        if done or time.perf_counter() - state['begin'] > args.timeout:
+            report()
+            reactor.stop()
+        else:
+            reactor.callLater(0.01, check)
+
+    def report():
+        elapsed = time.perf_counter() - (state['start'] or state['begin'])
+        stats = sender.reliability_stats()
+        expected = [(m['row'], m['col'], m['number']) for m in map(move_for, range(args.moves))]
+        dropped = sum(p.dropped for p in proxies)
+        forwarded = sum(p.received for p in proxies)
+        print(f"network: {args.loss:.0%} loss, {args.reorder:.0%} reordered, {dropped}/{forwarded} datagrams dropped")
+        print(f"delivered {len(received)}/{args.moves} moves, in order: {received == expected[:len(received)]}")
+        print(f"sent {stats['sent']}, retransmitted {stats['retransmits']} (rate {stats['retransmit_rate']:.1%}), duplicates discarded {receiver.reliability_stats()['duplicates']}")
+        print(f"goodput: {len(received) / elapsed:.0f} moves/s, {stats['acked_bytes'] / elapsed:.0f} B/s acked over {elapsed:.2f}s")
+        rtt = sender.rtt_estimator((receiver.addr, receiver.port))
+        print(f"srtt {rtt.srtt * 1000 if rtt.srtt else float('nan'):.1f} ms, rto {rtt.rto * 1000:.0f} ms")
+
+    state['begin'] = time.perf_counter()
+    reactor.callWhenRunning(handshake)
+    reactor.callWhenRunning(check)
+    reactor.run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+"""
+Benchmark: frame times of the board under a synthetic stream of remote
+moves, repainting only the changed cells once per frame against deleting
+and recreating every number on each move. Also reports how late a Tk timer
+fires meanwhile, which is how long Twisted waits under tksupport, and the
+canvas calls made per frame.
+
+Without a display, or with --headless, Tk is replaced by a stand-in that
+runs the timers and counts the canvas calls without drawing anything, so
+the frame times are the Python side of drawing alone.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_render [--rate MOVES_PER_S] [--seconds S]
+        [--headless]
+"""
+import argparse
+import heapq
+import itertools
+import random
+import time
+from tkinter import Tk, TclError
+from unittest import mock
+
+import ui as ui_module
+from game import Game
+from metrics import Histogram
+from peer import Peer
+from simulation import HeapClock
+from ui import UI, FRAME_MS
+
+SENDER = ("10.0.0.2", 50000)
+
+
+class FullRedrawUI(UI):
+    """
+    The UI as it drew before: every change deletes all numbers and creates
+    them again, right away.
+    """
+    def draw_puzzle(self):
+        if not self.cell_items:
+            return
+        start = time.perf_counter()
+        self.canvas.delete("numbers")
+        for i in range(9):
+            for j in range(9):
+                answer = self.game.puzzle[i][j]
+                if answer != 0:
+                    x = self.margin + j * self.side + self.side / 2
+                    y = self.margin + i * self.side + self.side / 2
+                    original = self.game.board[i][j]
+                    color = "black" if answer == original else "sea green"
+                    self.canvas.create_text(x, y, text=answer, tags="numbers", fill=color)
+        self.frame_times.record(time.perf_counter() - start)
+
+
+class HeadlessRoot(object):
+    """
+    Stands in for Tk's root window without a display: 'after' timers run
+    from 'mainloop' on the wall clock, and canvas calls are only counted.
+    """
+    def __init__(self):
+        self.timers = []
+        self.cancelled = set()
+        self.counter = itertools.count()
+        self.running = False
+        self.calls = 0
+
+    def after(self, ms, callback, *args):
+        timer = next(self.counter)
+        heapq.heappush(self.timers, (time.perf_counter() + ms / 1000, timer, callback, args))
+        return timer
+
+    def after_cancel(self, timer):
+        self.cancelled.add(timer)
+
+    def mainloop(self):
+        self.running = True
+        while self.running and self.timers:
+            due, timer, callback, args = heapq.heappop(self.timers)
+            if timer in self.cancelled:
+                self.cancelled.discard(timer)
+                continue
+            wait = due - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+            callback(*args)
+
+    def quit(self):
+        self.running = False
+
+    def title(self, title):
+        pass
+
+    def destroy(self):
+        self.timers = []
+
+
+class HeadlessCanvas(object):
+    """
+    A canvas that draws nothing and counts the calls made to it.
+    """
+    def __init__(self, master, **options):
+        self.root = master.root
+        self.items = itertools.count(1)
+
+    def ignore(self, *args, **kwargs):
+        pass
+
+    def count(self, *args, **kwargs):
+        self.root.calls += 1
+
+    pack = bind = focus_set = tag_lower = ignore
+    delete = itemconfigure = create_line = create_rectangle = count
+
+    def create_text(self, *args, **kwargs):
+        self.root.calls += 1
+        return next(self.items)
+
+
+def headless(ui_class):
+    """
+    A subclass of 'ui_class' that runs on a HeadlessRoot rather than Tk.
+    """
+    class Headless(ui_class):
+        def __init__(self, root, *args, **kwargs):
+            with mock.patch.object(ui_module.Frame, '__init__', lambda frame, master: None):
+                ui_class.__init__(self, root, *args, **kwargs)
+
+        def init_ui(self):
+            with mock.patch.object(ui_module, 'Canvas', HeadlessCanvas):
+                ui_class.init_ui(self)
+
+        def after(self, ms, callback, *args):
+            return self.root.after(ms, callback, *args)
+
+        def after_cancel(self, timer):
+            self.root.after_cancel(timer)
+
+        def pack(self):
+            pass
+
+        def destroy(self):
+            pass
+
+    Headless.__name__ = ui_class.__name__
+    return Headless
+
+
+def run(ui_class, root, rate, seconds, seed):
+    clock = HeapClock()
+    peer = Peer(addr="10.0.0.1", port=50000, clock=clock)
+    peer.peers.add(SENDER)
+    game = Game(seed)
+    game.start()
+    ui = ui_class(root, peer, game)
+    ui.init_ui()
+    ui.after_cancel(ui.performance_call)
+    rng = random.Random(seed)
+    empty = [cell for cell in range(81) if game.board.cells[cell] == 0]
+    lag = Histogram()
+    state = {'moves': 0, 'tick': None}
+    calls = getattr(root, 'calls', None)
+    start = time.perf_counter()
+
+    def stream():
+        # Apply every move that is due by now, one message per move
+        due = int((time.perf_counter() - start) * rate)
+        while state['moves'] < due:
+            cell = rng.choice(empty)
+            state['moves'] += 1
+            ui.sync.apply_moves(SENDER, [(cell // 9, cell % 9, rng.randrange(10), state['moves'])])
+        if time.perf_counter() - start < seconds:
+            root.after(1, stream)
+
+    def ticker():
+        now = time.perf_counter()
+        if state['tick'] is not None:
+            lag.record(now - state['tick'] - FRAME_MS / 1000)
+        state['tick'] = now
+        if now - start < seconds:
+            root.after(FRAME_MS, ticker)
+        else:
+            root.quit()
+
+    root.after(0, stream)
+    root.after(0, ticker)
+    root.mainloop()
+    elapsed = time.perf_counter() - start
+    if ui.repaint_call is not None:
+        ui.after_cancel(ui.repaint_call)
+    ui.destroy()
+    frames = ui.frame_times.snapshot()['count']
+    per_frame = (root.calls - calls) / frames if calls is not None and frames else None
+    return state['moves'] / elapsed, ui.frame_times, lag, per_frame
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rate", type=float, default=1000, help="remote moves per second")
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--headless", action="store_true", help="count canvas calls instead of drawing, even with a display")
+    args = parser.parse_args()
+
+    root = None
+    if not args.headless:
+        try:
+            root = Tk()
+        except TclError as e:
+            print(f"No display ({e}), running headless")
+    classes = (("full redraw", FullRedrawUI), ("damage only", UI))
+    if root is None:
+        root = HeadlessRoot()
+        classes = tuple((name, headless(ui_class)) for name, ui_class in classes)
+
+    print(f"{args.rate:.0f} remote moves/s for {args.seconds:.0f}s{', headless' if isinstance(root, HeadlessRoot) else ''}")
+    print(f"{'':>13} | {'moves/s':>8} | {'frames':>6} {'p50':>7} {'p99':>7} {'max':>7} | {'timer lag p50':>13} {'p99':>7} | {'calls/frame':>11}")
+    for name, ui_class in classes:
+        achieved, frames, lag, per_frame = run(ui_class, root, args.rate, args.seconds, args.seed)
+        frame, late = frames.snapshot(), lag.snapshot()
+        print(
+            f"{name:>13} | {achieved:8.0f} | {frame['count']:6} {frame['p50'] * 1000:5.2f}ms {frame['p99'] * 1000:5.2f}ms {frame['max'] * 1000:5.2f}ms | "
+            f"{late['p50'] * 1000:11.2f}ms {late['p99'] * 1000:5.2f}ms | {'' if per_frame is None else f'{per_frame:11.1f}'}"
+        )
+    root.destroy()
+
+
+if __name__ == "__main__":
+    main()
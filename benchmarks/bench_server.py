@@ -0,0 +1,167 @@
+"""
+Benchmark: load on the relay server. Simulated players, each on a socket of
+its own, join --rooms rooms of --players players and send moves to empty
+cells at --rate moves per second in total; the server relays every move to
+the other players of the room. Reports the moves and relayed moves per
+second, how many relayed moves arrived, and the server's moves and relayed
+moves per CPU second, i.e. per core, summed over its worker processes.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_server [--workers N] [--rooms R]
+        [--players P] [--rate MOVES_PER_S] [--seconds S]
+"""
+import argparse
+import json
+import os
+import random
+import selectors
+import socket
+import subprocess
+import sys
+import time
+
+import protocol
+
+# Binary moves, no acks and no crdt, so the server sends whole puzzles and
+# the players know which cells are empty
+FEATURES = [protocol.FEATURE, "moves/1", "swim/1"]
+TICKS = os.sysconf('SC_CLK_TCK')
+
+
+def cpu_seconds(pid):
+    """
+    CPU time used by a process and its children still running.
+    """
+    total = 0
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        if int(entry) == pid or int(fields[1]) == pid:
+            total += (int(fields[11]) + int(fields[12])) / TICKS
+    return total
+
+
+class Player(object):
+    def __init__(self, room_id, server):
+        self.room_id = room_id
+        self.server = server
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.setblocking(False)
+        self.addr = self.sock.getsockname()
+        self.empty = None
+        self.received = 0
+
+    def send(self, data):
+        try:
+            self.sock.sendto(data, self.server)
+        except BlockingIOError:
+            pass
+
+    def join(self):
+        hello = {'msgtype': 'hello', 'addr': self.addr[0], 'port': self.addr[1], 'features': FEATURES}
+        self.send(json.dumps(hello).encode('utf-8'))
+        self.send(protocol.encode({'msgtype': 'ask_gamedata', 'seed': self.room_id, 'versions': {}}))
+
+    def receive(self):
+        while True:
+            try:
+                data = self.sock.recv(2048)
+            except BlockingIOError:
+                return
+            if not protocol.is_binary(data):
+                continue
+            if data[1] == protocol.CODECS['move'][0]:
+                self.received += 1
+            elif data[1] == protocol.CODECS['gamedata'][0] and self.empty is None:
+                puzzle = protocol.decode(data)[1]['puzzle']
+                self.empty = [cell for cell in range(81) if puzzle.cells[cell] == 0]
+
+
+def pump(selector, timeout=0):
+    for key, _ in selector.select(timeout):
+        key.data.receive()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--workers", type=int, default=1, help="server worker processes")
+    parser.add_argument("--rooms", type=int, default=500)
+    parser.add_argument("--players", type=int, default=4, help="players per room")
+    parser.add_argument("--rate", type=float, default=5000, help="moves per second sent by all players together")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--port", type=int, default=47501)
+    args = parser.parse_args()
+
+    server_addr = ("127.0.0.1", args.port)
+    server = subprocess.Popen([
+        sys.executable, "server.py", "--port", str(args.port), "--interface", "127.0.0.1", "--addr", "127.0.0.1",
+        "--workers", str(args.workers), "--link-port", str(args.port + 1), "--unreliable", "--idle-timeout", "600",
+    ])
+    selector = selectors.DefaultSelector()
+    players = []
+    try:
+        time.sleep(2)
+        start = time.perf_counter()
+        for room in range(args.rooms):
+            for _ in range(args.players):
+                player = Player(1000 + room, server_addr)
+                selector.register(player.sock, selectors.EVENT_READ, player)
+                players.append(player)
+                player.join()
+            pump(selector)
+        # Joins lost while the server was busy generating rooms are sent again
+        deadline = time.perf_counter() + 60
+        retry = time.perf_counter() + 1
+        while any(player.empty is None for player in players):
+            if time.perf_counter() > deadline:
+                raise RuntimeError(f"{sum(player.empty is None for player in players)} players got no game")
+            if time.perf_counter() > retry:
+                for player in players:
+                    if player.empty is None:
+                        player.join()
+                retry = time.perf_counter() + 1
+            pump(selector, 0.01)
+        print(f"{args.rooms} rooms of {args.players} players joined in {time.perf_counter() - start:.1f}s, on {args.workers} worker(s)")
+
+        rng = random.Random(1)
+        cpu = cpu_seconds(server.pid)
+        sent = 0
+        start = time.perf_counter()
+        end = start + args.seconds
+        while True:
+            now = time.perf_counter()
+            if now >= end:
+                break
+            # Send the moves due by now, then read whatever came back
+            due = int((now - start) * args.rate)
+            while sent < due:
+                player = players[sent % len(players)]
+                cell = rng.choice(player.empty)
+                sent += 1
+                player.send(protocol.encode({'msgtype': 'move', 'row': cell // 9, 'col': cell % 9, 'number': rng.randint(1, 9), 'ts': sent}))
+            pump(selector, 0.001)
+        drain = time.perf_counter() + 0.5
+        while time.perf_counter() < drain:
+            pump(selector, 0.01)
+        elapsed = time.perf_counter() - start
+        cpu = cpu_seconds(server.pid) - cpu
+    finally:
+        server.terminate()
+        server.wait()
+
+    received = sum(player.received for player in players)
+    expected = sent * (args.players - 1)
+    print(f"moves:   {sent / elapsed:8.0f}/s sent, {sent / cpu:8.0f} per server CPU second")
+    print(f"relayed: {received / elapsed:8.0f}/s arrived ({received / expected:.1%} of {expected}), {received / cpu:8.0f} per server CPU second")
+    print(f"server CPU: {cpu:.2f}s over {elapsed:.1f}s ({cpu / elapsed:.0%} of one core)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Micro-benchmark: boards per second for each solver engine.
+
+Two workloads are timed: generating full boards from an empty grid (what
+Game.generate_board does) and proving that carved puzzles have a unique
+solution (a bounded solution count, as needed when carving puzzles).
+
+Run from the repository root:
+
+    python -m benchmarks.bench_solver [--boards N] [--clues N]
+"""
+import argparse
+import random
+import time
+
+from solver import SOLVERS, BitmaskSolver
+
+
+def generate(solver, seed):
+    board = [[0] * 9 for _ in range(9)]
+    solver.solve(board, random.Random(seed))
+    return board
+
+
+def carve(board, clues, seed):
+    rng = random.Random(seed)
+    puzzle = [list(row) for row in board]
+    cells = list(range(81))
+    rng.shuffle(cells)
+    for cell in cells[:81 - clues]:
+        puzzle[cell // 9][cell % 9] = 0
+    return puzzle
+
+
+def report(workload, results):
+    reference = None
+    for name, rate in results:
+        if reference is None:
+            reference = rate
+        print(f"{workload:>10} {name:>14}: {rate:10.1f} boards/s  ({rate / reference:.1f}x)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--boards", type=int, default=200)
+    parser.add_argument("--clues", type=int, default=30)
+    args = parser.parse_args()
+
+    results = []
+    for name, solver_class in SOLVERS.items():
+        solver = solver_class()
+        start = time.perf_counter()
+        for seed in range(args.boards):
+            board = generate(solver, seed)
+            assert all(sorted(row) == list(range(1, 10)) for row in board)
+        results.append((name, args.boards / (time.perf_counter() - start)))
+    report("generate", results)
+
+    puzzles = [
+        carve(generate(BitmaskSolver(), seed), args.clues, seed)
+        for seed in range(args.boards)
+    ]
+    results = []
+    for name, solver_class in SOLVERS.items():
+        solver = solver_class()
+        start = time.perf_counter()
+        for puzzle in puzzles:
+            solver.count_solutions(puzzle, 2)
+        results.append((name, len(puzzles) / (time.perf_counter() - start)))
+    report("count", results)
+
+
+if __name__ == "__main__":
+    main()
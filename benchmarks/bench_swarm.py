@@ -0,0 +1,87 @@
+"""
+Benchmark: a game played by a swarm of headless peers on a simulated
+network. Reports how long the boards take to converge after each move,
+messages and bytes per move, and CPU time per message, for swarms of 2 to
+500 peers.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_swarm [--sizes 2,10,50,100,500] [--moves N]
+        [--rate MOVES_PER_S] [--loss P] [--latency S] [--jitter S]
+        [--reorder P] [--bandwidth BYTES_PER_S]
+"""
+import argparse
+import time
+
+from simulation import SimulatedNetwork, Swarm
+
+# Message types that carry or acknowledge board state, as opposed to
+# membership traffic
+SYNC_TYPES = ('move', 'moves', 'ack', 'digest', 'repair', 'gamedata', 'ask_gamedata')
+
+
+def measure(size, args):
+    network = SimulatedNetwork(
+        latency=args.latency, jitter=args.jitter, loss=args.loss, reorder=args.reorder,
+        bandwidth=args.bandwidth, seed=args.seed,
+    )
+    swarm = Swarm(size, network, seed=args.seed, flush_window=args.flush_window / 1000)
+    swarm.start_loops()
+    if not swarm.connect():
+        raise RuntimeError(f"{size} peers did not all get the game")
+    swarm.run(2)
+    network.reset_stats()
+
+    start = time.process_time()
+    interval = 1 / args.rate
+    settle = []
+    for _ in range(args.moves):
+        played_at = swarm.clock.seconds()
+        swarm.play_random()
+        if swarm.run_until(swarm.converged, args.limit, step=0.001):
+            settle.append(swarm.clock.seconds() - played_at)
+        else:
+            settle.append(float('inf'))
+        swarm.run(max(0, played_at + interval - swarm.clock.seconds()))
+    cpu = time.process_time() - start
+
+    sync = sum(n for msgtype, (n, _) in network.by_type.items() if msgtype in SYNC_TYPES)
+    sync_bytes = sum(b for msgtype, (_, b) in network.by_type.items() if msgtype in SYNC_TYPES)
+    return {
+        'settle_avg': sum(settle) / len(settle),
+        'settle_max': max(settle),
+        'sync_per_move': sync / args.moves,
+        'sync_bytes_per_move': sync_bytes / args.moves,
+        'all_per_move': network.datagrams / args.moves,
+        'all_bytes_per_move': network.bytes / args.moves,
+        'cpu_per_message': cpu / network.delivered * 1e6 if network.delivered else 0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", default="2,10,50,100,500", help="comma separated swarm sizes")
+    parser.add_argument("--moves", type=int, default=100)
+    parser.add_argument("--rate", type=float, default=20, help="moves per second, over the whole swarm")
+    parser.add_argument("--flush-window", type=float, default=10, help="move batching window in ms")
+    parser.add_argument("--loss", type=float, default=0.0)
+    parser.add_argument("--latency", type=float, default=0.005, help="one-way latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.002, help="extra random latency in seconds")
+    parser.add_argument("--reorder", type=float, default=0.0, help="probability a datagram is held back")
+    parser.add_argument("--bandwidth", type=float, default=None, help="uplink of every peer in bytes per second")
+    parser.add_argument("--limit", type=float, default=60, help="simulated seconds to wait for convergence")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    print(f"{args.moves} moves at {args.rate:.0f}/s, {args.loss:.0%} loss, {args.latency * 1000:.0f}+{args.jitter * 1000:.0f} ms latency")
+    print(f"{'peers':>6} | {'converged avg':>13} {'max':>7} | {'sync msg/move':>13} {'B/move':>8} | {'all msg/move':>12} {'B/move':>8} | {'CPU/msg':>8}")
+    for size in map(int, args.sizes.split(",")):
+        result = measure(size, args)
+        print(
+            f"{size:6} | {result['settle_avg'] * 1000:11.1f}ms {result['settle_max'] * 1000:5.1f}ms | {result['sync_per_move']:13.1f} {result['sync_bytes_per_move']:8.0f} | "
+            f"{result['all_per_move']:12.1f} {result['all_bytes_per_move']:8.0f} | {result['cpu_per_message']:6.1f}us"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+"""
+Benchmark: the Twisted and asyncio transport backends, and asyncio on uvloop
+when it is installed. Startup is the time from a fresh interpreter to a peer
+listening with its loops running, import time included. Throughput is the
+number of binary move datagrams a peer decodes and hands to its handler per
+second while a sender floods it over localhost, and the receiver's CPU time
+per datagram, which does not depend on how many cores the sender leaves it.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_transport [--seconds S] [--runs N]
+"""
+import argparse
+import json
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+BACKENDS = ("twisted", "asyncio", "uvloop")
+
+# The receiver reports once no datagram came for this long
+IDLE = 0.5
+
+
+def new_loop(backend):
+    import asyncio
+    if backend == "uvloop":
+        import uvloop
+        return uvloop.new_event_loop()
+    return asyncio.new_event_loop()
+
+
+def start(backend, port):
+    """
+    Import a backend, listen on 'port' and run its loop until the peer's
+    first ping went out. Prints the time it took.
+    """
+    begin = time.perf_counter()
+    if backend == "twisted":
+        from twisted.internet import reactor
+        from peer import Peer
+        imported = time.perf_counter()
+        peer = Peer(addr="127.0.0.1", port=port)
+        reactor.listenUDP(port, peer, interface="127.0.0.1")
+        reactor.callWhenRunning(reactor.stop)
+        reactor.run()
+    else:
+        loop = new_loop(backend)
+        from aiopeer import AsyncioPeer
+        imported = time.perf_counter()
+        peer = AsyncioPeer(addr="127.0.0.1", port=port, loop=loop)
+        loop.run_until_complete(peer.listen("127.0.0.1"))
+        peer.stop()
+        loop.run_until_complete(peer.closed)
+    print(json.dumps({'import': imported - begin, 'listen': time.perf_counter() - imported}))
+
+
+def receive(backend, port):
+    """
+    Count the moves handed to the handler until the sender stops, then print
+    how many came in, over how long and the CPU time they took.
+    """
+    state = {'moves': 0, 'first': None, 'last': None, 'cpu_start': None, 'cpu': None}
+
+    def handle_move(move):
+        now = time.perf_counter()
+        if state['first'] is None:
+            state['first'] = now
+            state['cpu_start'] = time.process_time()
+        state['last'] = now
+        state['moves'] += 1
+
+    def idle():
+        if state['last'] is None or time.perf_counter() - state['last'] <= IDLE:
+            return False
+        if state['cpu'] is None:
+            state['cpu'] = time.process_time() - state['cpu_start']
+        return True
+
+    if backend == "twisted":
+        from twisted.internet import reactor
+        from twisted.internet.task import LoopingCall
+        from peer import Peer
+        peer = Peer(addr="127.0.0.1", port=port)
+        peer.add_handler("move", handle_move)
+        reactor.listenUDP(port, peer, interface="127.0.0.1")
+        LoopingCall(lambda: idle() and reactor.stop()).start(0.1)
+        print("ready", flush=True)
+        reactor.run()
+    else:
+        import asyncio
+        from aiopeer import AsyncioPeer
+        loop = new_loop(backend)
+        peer = AsyncioPeer(addr="127.0.0.1", port=port, loop=loop)
+        peer.add_handler("move", handle_move)
+
+        async def run():
+            await peer.listen("127.0.0.1")
+            print("ready", flush=True)
+            while not idle():
+                await asyncio.sleep(0.1)
+
+        loop.run_until_complete(run())
+    print(json.dumps({'moves': state['moves'], 'elapsed': state['last'] - state['first'], 'cpu': state['cpu']}))
+
+
+def flood(port, seconds):
+    """
+    Send binary moves to 'port' as fast as the socket takes them for
+    'seconds'. Returns the number sent.
+    """
+    import protocol
+    datagrams = [
+        protocol.encode({'msgtype': 'move', 'row': cell // 9, 'col': cell % 9, 'number': cell % 10, 'ts': cell})
+        for cell in range(81)
+    ]
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    target = ("127.0.0.1", port)
+    sent = 0
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        for data in datagrams:
+            try:
+                sock.sendto(data, target)
+                sent += 1
+            except BlockingIOError:
+                pass
+    sock.close()
+    return sent
+
+
+def available(backend):
+    if backend != "uvloop":
+        return True
+    try:
+        import uvloop
+    except ImportError:
+        return False
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--seconds", type=float, default=3, help="how long the sender floods each backend")
+    parser.add_argument("--runs", type=int, default=5, help="startups timed per backend")
+    parser.add_argument("--port", type=int, default=47101)
+    parser.add_argument("--backend", choices=BACKENDS, help=argparse.SUPPRESS)
+    parser.add_argument("--mode", choices=("start", "receive"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode == "start":
+        start(args.backend, args.port)
+        return
+    if args.mode == "receive":
+        receive(args.backend, args.port)
+        return
+
+    command = [sys.executable, "-m", "benchmarks.bench_transport", "--port", str(args.port)]
+    print(f"{'':>8} | {'startup':>8} {'import':>8} {'listen':>8} | {'sent/s':>8} {'handled/s':>9} {'lost':>6} {'CPU/msg':>8}")
+    for backend in BACKENDS:
+        if not available(backend):
+            print(f"{backend:>8} | not installed")
+            continue
+        timings = []
+        for _ in range(args.runs):
+            begin = time.perf_counter()
+            output = subprocess.run(command + ["--backend", backend, "--mode", "start"], capture_output=True, text=True, check=True).stdout
+            timings.append((time.perf_counter() - begin, json.loads(output.strip().splitlines()[-1])))
+        startup = statistics.median(total for total, _ in timings)
+        imported = statistics.median(timing['import'] for _, timing in timings)
+        listen = statistics.median(timing['listen'] for _, timing in timings)
+
+        receiver = subprocess.Popen(command + ["--backend", backend, "--mode", "receive"], stdout=subprocess.PIPE, text=True)
+        try:
+            receiver.stdout.readline()
+            sent = flood(args.port, args.seconds)
+            result = json.loads(receiver.stdout.read().strip().splitlines()[-1])
+        finally:
+            receiver.kill()
+            receiver.wait()
+        print(
+            f"{backend:>8} | {startup * 1000:6.0f}ms {imported * 1000:6.0f}ms {listen * 1000:6.1f}ms | "
+            f"{sent / args.seconds:8.0f} {result['moves'] / result['elapsed']:9.0f} {1 - result['moves'] / sent:6.1%} "
+            f"{result['cpu'] / result['moves'] * 1e6:6.2f}us"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+Benchmark: ping round-trip times of a peer whose UI is busy, with the
+reactor driven from the UI loop the way tksupport does it against on a
+thread of its own, as app.py --threaded runs it. The UI is simulated, so no
+display is needed: every 16 ms frame it spends --ui-work milliseconds, in
+both modes, part of it running Python and the rest in calls that release
+the GIL, like Tk drawing. Where the OS allows it, the peer is pinned to one
+CPU and the peer pinging it to another, so the two do not steal each
+other's time and the UI thread and the reactor share a core as on a busy
+machine.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_uithread [--ui-work MS] [--gil-share P]
+        [--seconds S] [--rate PINGS_PER_S]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+from uiqueue import SWITCH_INTERVAL
+
+FRAME = 0.016
+MODES = ("idle", "in UI loop", "threaded")
+
+
+def pin(cpu):
+    """
+    Run this process, and the threads it starts, on one CPU only, if the OS
+    lets us pick.
+    """
+    if hasattr(os, "sched_setaffinity"):
+        cpus = sorted(os.sched_getaffinity(0))
+        os.sched_setaffinity(0, {cpus[cpu % len(cpus)]})
+
+
+def busy(work, gil_share):
+    """
+    Spend 'work' seconds like a UI frame: first holding the GIL, then not.
+    """
+    end = time.perf_counter() + work * gil_share
+    while time.perf_counter() < end:
+        pass
+    time.sleep(work * (1 - gil_share))
+
+
+def respond(mode, port, args):
+    """
+    A peer answering pings while its UI is busy, until it is killed.
+    """
+    from twisted.internet import reactor
+    from twisted.internet.task import LoopingCall
+    from peer import Peer
+
+    pin(0)
+    peer = Peer(addr="127.0.0.1", port=port)
+    reactor.listenUDP(port, peer, interface="127.0.0.1")
+    work = args.ui_work / 1000
+    if mode == "threaded":
+        sys.setswitchinterval(SWITCH_INTERVAL)
+        threading.Thread(target=reactor.run, kwargs={'installSignalHandlers': False}, daemon=True).start()
+        while True:
+            frame = time.perf_counter()
+            busy(work, args.gil_share)
+            time.sleep(max(0, frame + FRAME - time.perf_counter()))
+    if mode == "in UI loop":
+        # tksupport calls Tk's update from a LoopingCall, which draws the
+        # frames that are due, so the reactor waits for each of them
+        LoopingCall(busy, work, args.gil_share).start(FRAME, now=False)
+    reactor.run()
+
+
+def probe(port, target, args):
+    """
+    Ping the target at a steady rate from an idle peer and print the round
+    trips measured.
+    """
+    from twisted.internet import reactor
+    from twisted.internet.task import LoopingCall
+    from peer import Peer
+
+    pin(-1)
+    peer = Peer(addr="127.0.0.1", port=port)
+    reactor.listenUDP(port, peer, interface="127.0.0.1")
+    pinger = LoopingCall(lambda: peer.send_message({'msgtype': 'ping', 'timestamp': peer.timer()}, target))
+    reactor.callWhenRunning(pinger.start, 1 / args.rate)
+    reactor.callLater(args.seconds, reactor.stop)
+    reactor.run()
+    print(json.dumps(peer.metrics.rtt.snapshot()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--ui-work", type=float, default=12, help="milliseconds of UI work per frame")
+    parser.add_argument("--gil-share", type=float, default=0.5, help="part of the UI work that holds the GIL")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--rate", type=float, default=100, help="pings per second")
+    parser.add_argument("--port", type=int, default=47001, help="first of the two UDP ports used")
+    parser.add_argument("--mode", choices=MODES + ("probe",), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    target = ("127.0.0.1", args.port)
+    if args.mode == "probe":
+        probe(args.port + 1, target, args)
+        return
+    if args.mode is not None:
+        respond(args.mode, args.port, args)
+        return
+
+    command = [sys.executable, "-m", "benchmarks.bench_uithread", "--ui-work", str(args.ui_work), "--gil-share", str(args.gil_share),
+               "--seconds", str(args.seconds), "--rate", str(args.rate), "--port", str(args.port)]
+    print(f"{args.rate:.0f} pings/s over localhost to a peer with {args.ui_work:.0f} ms of UI work per frame, {args.gil_share:.0%} of it holding the GIL")
+    print(f"{'':>11} | {'pongs':>6} {'p50':>8} {'p99':>8} {'p99.9':>8} {'max':>8}")
+    for mode in MODES:
+        responder = subprocess.Popen(command + ["--mode", mode])
+        try:
+            time.sleep(1)
+            output = subprocess.run(command + ["--mode", "probe"], capture_output=True, text=True, check=True).stdout
+        finally:
+            responder.kill()
+            responder.wait()
+        rtt = json.loads(output.strip().splitlines()[-1])
+        print(
+            f"{mode:>11} | {rtt['count']:6} {rtt['p50'] * 1000:6.2f}ms {rtt['p99'] * 1000:6.2f}ms "
+            f"{rtt['p999'] * 1000:6.2f}ms {rtt['max'] * 1000:6.2f}ms"
+        )
+
+if __name__ == "__main__":
+    main()
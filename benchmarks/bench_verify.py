@@ -0,0 +1,120 @@
+"""
+Benchmark: validating submitted boards in batches with numpy against looping
+Game.check_win. A mix of solved boards, completed boards with two cells
+swapped and half-played boards with some wrong numbers is checked for a win,
+the clashing cells and the cells that differ from the seed's solution; the
+results of both ways are compared before timing them. Needs numpy.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_verify [--boards N] [--seeds S]
+"""
+import argparse
+import random
+import sys
+import time
+
+import verify
+from game import Game
+
+
+def make_boards(count, seeds, rng):
+    """
+    'count' boards of the games of 'seeds' random seeds, with the seed of
+    each.
+    """
+    games = []
+    for _ in range(seeds):
+        game = Game(rng.randint(1, 2**31 - 2))
+        game.start()
+        games.append(game)
+    boards, board_seeds = [], []
+    for i in range(count):
+        game = rng.choice(games)
+        kind = i % 3
+        if kind == 0:
+            board = game.solution.clone()
+        elif kind == 1:
+            board = game.solution.clone()
+            a, b = rng.sample(range(81), 2)
+            board.cells[a], board.cells[b] = board.cells[b], board.cells[a]
+        else:
+            board = game.board.clone()
+            for cell in range(81):
+                if board.cells[cell] == 0 and rng.random() < 0.5:
+                    board.cells[cell] = game.solution.cells[cell] if rng.random() < 0.9 else rng.randint(1, 9)
+        boards.append(board)
+        board_seeds.append(game.seed - 1)
+    return boards, board_seeds, {game.seed - 1: game.solution for game in games}
+
+
+def check_loop(boards, board_seeds, solutions):
+    """
+    One board at a time: load it into a Game, check for a win, list the
+    clashing cells and compare it with the solution.
+    """
+    game = Game(0)
+    results = []
+    for board, seed in zip(boards, board_seeds):
+        game.puzzle = board
+        solution = solutions[seed]
+        wrong = [cell for cell in range(81) if board.cells[cell] and board.cells[cell] != solution.cells[cell]]
+        results.append((game.check_win() and board == solution, game.conflicts(), wrong))
+    return results
+
+
+def check_batch(boards, board_seeds):
+    return verify.verify(boards, board_seeds)
+
+
+def agree(looped, batched):
+    ok, conflicts, wrong = batched
+    for i, (win, clashing, cells) in enumerate(looped):
+        if bool(ok[i]) != win:
+            return False
+        if [tuple(cell) for cell in verify.np.argwhere(conflicts[i]).tolist()] != clashing:
+            return False
+        if verify.np.flatnonzero(wrong[i]).tolist() != cells:
+            return False
+    return True
+
+
+def timed(f, *args):
+    start = time.perf_counter()
+    result = f(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--boards", type=int, default=30000)
+    parser.add_argument("--seeds", type=int, default=100, help="distinct games the boards come from")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    if not verify.available():
+        sys.exit("bench_verify needs numpy: pip install numpy")
+
+    rng = random.Random(args.seed)
+    boards, board_seeds, solutions = make_boards(args.boards, args.seeds, rng)
+    looped, loop_time = timed(check_loop, boards, board_seeds, solutions)
+    batched, batch_time = timed(check_batch, boards, board_seeds)
+    if not agree(looped, batched):
+        sys.exit("numpy and check_win disagree")
+
+    array = verify.as_array(boards)
+    _, convert_time = timed(verify.as_array, boards)
+    _, validate_time = timed(verify.validate, array)
+    solved, solve_time = timed(verify.solutions, board_seeds)
+    _, compare_time = timed(verify.compare, array, solved)
+
+    print(f"{args.boards} boards from {args.seeds} games, {sum(win for win, _, _ in looped)} solved")
+    print(f"  check_win loop:  {args.boards / loop_time:10.0f} boards/s (win, conflicts, wrong cells)")
+    print(f"  numpy batch:     {args.boards / batch_time:10.0f} boards/s (same, solutions included), {loop_time / batch_time:.1f}x")
+    print(f"    boards to array:  {args.boards / convert_time:10.0f} boards/s")
+    print(f"    validate:         {args.boards / validate_time:10.0f} boards/s")
+    print(f"    solutions:        {args.seeds / solve_time:10.0f} seeds/s")
+    print(f"    compare:          {args.boards / compare_time:10.0f} boards/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+A UDP proxy that forwards datagrams to a fixed target while dropping,
+delaying, reordering and duplicating some of them, to test how peers cope
+with a bad network without needing one.
+
+    python -m benchmarks.lossy_proxy --listen 40000 --target 127.0.0.1:50000 --loss 0.1
+"""
+import argparse
+import random
+
+from twisted.internet import reactor
+from twisted.internet.protocol import DatagramProtocol
+
+
+class LossyProxy(DatagramProtocol):
+    """
+    Forwards every datagram it receives to 'target'. Each datagram is dropped
+    with probability 'loss', duplicated with probability 'duplicate', and
+    delayed by 'delay' seconds plus, with probability 'reorder', up to
+    'jitter' seconds more, which lets later datagrams overtake it.
+    """
+    def __init__(self, target, loss=0.1, reorder=0.1, duplicate=0.0, delay=0.001, jitter=0.02, seed=None):
+        self.target = target
+        self.loss = loss
+        self.reorder = reorder
+        self.duplicate = duplicate
+        self.delay = delay
+        self.jitter = jitter
+        self.random = random.Random(seed)
+        self.received = 0
+        self.dropped = 0
+        self.reordered = 0
+        self.duplicated = 0
+
+    def datagramReceived(self, data, addr):
+        self.received += 1
+        copies = 1
+        if self.random.random() < self.duplicate:
+            copies = 2
+            self.duplicated += 1
+        for _ in range(copies):
+            if self.random.random() < self.loss:
+                self.dropped += 1
+                continue
+            delay = self.delay
+            if self.random.random() < self.reorder:
+                delay += self.random.uniform(0, self.jitter)
+                self.reordered += 1
+            reactor.callLater(delay, self.forward, data)
+
+    def forward(self, data):
+        try:
+            self.transport.write(data, self.target)
+        except OSError:
+            pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--listen", type=int, required=True, help="port to listen on")
+    parser.add_argument("--target", required=True, help="ip:port to forward to")
+    parser.add_argument("--loss", type=float, default=0.1)
+    parser.add_argument("--reorder", type=float, default=0.1)
+    parser.add_argument("--duplicate", type=float, default=0.0)
+    parser.add_argument("--delay", type=float, default=0.001)
+    parser.add_argument("--jitter", type=float, default=0.02)
+    args = parser.parse_args()
+    host, port = args.target.split(":")
+    reactor.listenUDP(args.listen, LossyProxy(
+        (host, int(port)), args.loss, args.reorder, args.duplicate, args.delay, args.jitter,
+    ))
+    reactor.run()
+
+
+if __name__ == "__main__":
+    main()
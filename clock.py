@@ -0,0 +1,120 @@
+import asyncio
+import logging
+import math
+
+log = logging.getLogger(__name__)
+
+
+class LoopingCall(object):
+    """
+    Calls a function every 'interval' seconds on a clock, like Twisted's
+    LoopingCall but without Deferreds, so the peer's periodic tasks run on
+    any clock with seconds() and callLater(): the reactor, a simulated clock
+    or an AsyncioClock.
+
+    Calls stay on the grid of the start time: if the clock falls behind,
+    the intervals missed are skipped rather than run back to back. An
+    exception raised by the function is logged and the loop goes on.
+    'clock' defaults to the reactor on the first start.
+
+    While a profiling.Profiler is installed, it is 'profiler' on the class
+    and times every tick of every loop.
+    """
+    profiler = None
+
+    def __init__(self, f, *args, **kwargs):
+        self.f = f
+        self.args = args
+        self.kwargs = kwargs
+        self.clock = None
+        self.interval = None
+        self.started = None
+        self.tick = 0
+        self.call = None
+        self.running = False
+
+    def start(self, interval, now=True):
+        if self.running:
+            raise RuntimeError("LoopingCall is already running")
+        if interval <= 0:
+            raise ValueError("interval must be positive")
+        if self.clock is None:
+            from twisted.internet import reactor
+            self.clock = reactor
+        self.interval = interval
+        self.started = self.clock.seconds()
+        self.running = True
+        if now:
+            self.tick = 0
+            self()
+        else:
+            self.tick = 1
+            self.call = self.clock.callLater(interval, self)
+        return self
+
+    def stop(self):
+        if not self.running:
+            raise RuntimeError("LoopingCall is not running")
+        self.running = False
+        if self.call is not None and self.call.active():
+            self.call.cancel()
+        self.call = None
+
+    def __call__(self):
+        # The next call is scheduled first, so the function can stop the loop.
+        # Counting ticks keeps a call that fires a rounding error early from
+        # scheduling itself again for the same tick.
+        now = self.clock.seconds()
+        self.tick = max(self.tick + 1, math.floor((now - self.started) / self.interval) + 1)
+        self.call = self.clock.callLater(self.started + self.tick * self.interval - now, self)
+        try:
+            if self.profiler is None:
+                self.f(*self.args, **self.kwargs)
+            else:
+                self.profiler.tick(self.f, *self.args, **self.kwargs)
+        except Exception:
+            log.exception("Error in looping call to %r", self.f)
+
+
+class AsyncioCall(object):
+    """
+    A call scheduled on an asyncio loop, with the part of Twisted's
+    DelayedCall interface the peer uses.
+    """
+    def __init__(self, loop, delay, f, args, kwargs):
+        self.time = loop.time() + delay
+        self.called = False
+        self.cancelled = False
+        self.handle = loop.call_at(self.time, self.run, f, args, kwargs)
+
+    def run(self, f, args, kwargs):
+        self.called = True
+        f(*args, **kwargs)
+
+    def getTime(self):
+        return self.time
+
+    def active(self):
+        return not (self.called or self.cancelled)
+
+    def cancel(self):
+        if not self.active():
+            raise RuntimeError("call has already been called or cancelled")
+        self.cancelled = True
+        self.handle.cancel()
+
+
+class AsyncioClock(object):
+    """
+    An asyncio event loop, asyncio's own or uvloop's, seen through the
+    seconds() and callLater() interface of Twisted's reactor. 'loop'
+    defaults to the running loop.
+    """
+    def __init__(self, loop=None):
+        self.loop = loop if loop is not None else asyncio.get_running_loop()
+
+    def seconds(self):
+        return self.loop.time()
+
+    def callLater(self, delay, f, *args, **kwargs):
+        return AsyncioCall(self.loop, max(0, delay), f, args, kwargs)
@@ -0,0 +1,99 @@
+import zlib
+
+# Feature peers advertise in their hello to say they exchange board deltas
+FEATURE = "crdt/1"
+
+
+def node_id(addr):
+    """
+    The node id a peer stamps its writes with, from its (addr, port).
+    """
+    return f"{addr[0]}:{addr[1]}"
+
+
+class LWWBoard(object):
+    """
+    The stamps of a shared board: one last-writer-wins register per cell.
+
+    Every write is stamped with (counter, node), where the counter is a
+    Lamport clock and the node id breaks ties, so all peers order concurrent
+    writes to a cell the same way no matter in which order they arrive. The
+    values themselves live in Game.puzzle; this only keeps the stamps and a
+    version vector holding the highest counter seen from each node, which is
+    what peers compare to find out which writes the other side is missing.
+
+    A node's counters skip the values it saw from others, so the vector
+    cannot tell a write that was lost or overtaken from one that never
+    existed: it jumps to the highest counter seen. Deltas worked out from it
+    are best-effort, and anti-entropy repairs the writes they leave out.
+    """
+    def __init__(self, node):
+        self.node = node
+        self.clock = 0
+        self.stamps = [None] * 81
+        self.versions = {}
+
+    def reset(self):
+        """
+        Forget all stamps for a new round. The clock keeps counting.
+        """
+        self.stamps = [None] * 81
+        self.versions = {}
+
+    def local_write(self, cell):
+        """
+        Stamp a write made by this node. Returns the new stamp.
+        """
+        self.clock += 1
+        stamp = (self.clock, self.node)
+        self.stamps[cell] = stamp
+        self.versions[self.node] = self.clock
+        return stamp
+
+    def observe(self, stamp):
+        """
+        Advance the clock and version vector past a stamp from elsewhere.
+        """
+        counter, node = stamp
+        if counter > self.clock:
+            self.clock = counter
+        if counter > self.versions.get(node, 0):
+            self.versions[node] = counter
+
+    def merge(self, cell, stamp):
+        """
+        Take in a remote write. Returns True if it wins over what the cell
+        holds, in which case the caller applies the value.
+        """
+        self.observe(stamp)
+        current = self.stamps[cell]
+        if current is not None and current >= stamp:
+            return False
+        self.stamps[cell] = stamp
+        return True
+
+    def missing(self, versions):
+        """
+        List the cells holding writes that a peer with the given version
+        vector has not seen. A write below a counter the peer has seen from
+        the same node is taken as held, even if it never got there.
+        """
+        return [
+            cell for cell, stamp in enumerate(self.stamps)
+            if stamp is not None and stamp[0] > versions.get(stamp[1], 0)
+        ]
+
+    def digest(self, puzzle):
+        """
+        Hash every row of the board, values and stamps together, so two
+        peers can tell which rows they disagree on by swapping 36 bytes.
+        """
+        cells = puzzle.cells
+        rows = []
+        for row in range(9):
+            text = ";".join(
+                f"{cells[cell]},{stamp[0]},{stamp[1]}" if stamp else str(cells[cell])
+                for cell, stamp in enumerate(self.stamps[row * 9:row * 9 + 9], row * 9)
+            )
+            rows.append(zlib.crc32(text.encode("utf-8")))
+        return rows
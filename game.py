@@ -1,100 +1,216 @@
 import random
+from solver import get_solver
+from crdt import LWWBoard
+from board import Board
+import grader
+
+# Number of clues a carved puzzle is left with, per difficulty. Carving stops
+# early if no further clue can go without losing the unique solution, so the
+# harder levels are a floor rather than an exact count.
+DIFFICULTIES = {
+    "easy": 36,
+    "medium": 30,
+    "hard": 25,
+    "expert": 17,
+}
+
+DEFAULT_DIFFICULTY = "easy"
+
+# Bump whenever a change to the generator means a seed no longer produces the
+# same board, so cached puzzles from older versions are thrown away.
+GENERATOR_VERSION = 1
+
+# The row, column and box each cell belongs to, numbered 0-8, 9-17 and 18-26
+UNITS = [(cell // 9, 9 + cell % 9, 18 + cell // 27 * 3 + cell % 9 // 3) for cell in range(81)]
+# The cells of each unit
+UNIT_CELLS = [[cell for cell in range(81) if unit in UNITS[cell]] for unit in range(27)]
+
+
+def pack_board(board):
+    """
+    Pack a 9x9 board, a Board or nine rows, into 41 bytes, two cells per byte.
+    """
+    if not isinstance(board, Board):
+        board = Board.from_rows(board)
+    return board.pack()
+
+
+def unpack_board(data):
+    """
+    Unpack 41 bytes produced by pack_board back into a Board.
+    """
+    return Board.unpack(data)
+
 
 class Game(object):
     """
     A Sudoku game, in charge of storing the state of the board and checking
     whether the puzzle is completed.
+
+    Alongside the puzzle it keeps how often each number occurs in each row,
+    column and box, the number of empty cells and the (unit, number) pairs
+    that occur more than once. Every write updates them in constant time, so
+    checking for a win or the cells left never scans the board, and finding
+    the clashing cells only looks at the units that have a clash.
+
+    'grade' is how hard the puzzle is for a person (see grader.py). It comes
+    with pooled puzzles and with game data, and is only worked out when
+    asked for otherwise.
+
+    With a 'journal' (see journal.py) every new round and every write that
+    changes the board is recorded there.
     """
-    def __init__(self, seed, debug=False):
+    def __init__(self, seed, debug=False, solver=None, difficulty=DEFAULT_DIFFICULTY, clues=None, pool=None, node=None, journal=None):
         self.seed = seed
         self.debug = debug
+        self.solver = get_solver(solver)
+        self.difficulty = difficulty
+        self.clues = clues if clues is not None else DIFFICULTIES[difficulty]
+        self.pool = pool
+        self.solution = None
         self.board = None
         self.puzzle = None
+        self._grade = None
         self.game_over = False
+        self.registers = LWWBoard(node)
+        self.journal = journal
 
     def generate_board(self):
         """
-        Generate a random valid Sudoku board.
+        Generate a random valid Sudoku board, taking it from the puzzle pool
+        if one has been generated ahead of time.
         """
         self.seed = self.seed + 1
-        random.seed(self.seed)
-        board = [[0]*9 for _ in range(9)] # create an empty board
-        self.solve_sudoku(board)
+        puzzle = self.pool.get(self.seed, self.clues) if self.pool is not None else None
+        if puzzle is not None:
+            self.solution, board, self._grade = puzzle
+        else:
+            self._grade = None
+            board = self.generate_solution(self.seed)
+            self.solution = board.clone()
+            self.remove_cells(board)
         if self.debug:
             print("Sudoku board:")
-            for row in board:
+            for row in self.solution.rows():
                 print(row)
-        self.remove_cells(board)
+        if self.pool is not None:
+            self.pool.prefetch(self.seed + 1, self.clues)
         return board
     
-    def solve_sudoku(self, board):
-        """
-        Solve the Sudoku board using backtracking.
-        """
-        empty_cell = self.find_empty_cell(board)
-        if not empty_cell:
-            return True
-        row, col = empty_cell
-        numbers = list(range(1, 10))
-        random.shuffle(numbers)
-        for num in numbers:
-            if self.is_valid_move(board, row, col, num):
-                board[row][col] = num
-                if self.solve_sudoku(board):
-                    return True
-                board[row][col] = 0
-        return False
-    
-    def remove_cells(self, board):
+    def generate_solution(self, seed):
         """
-        Remove cells from the Sudoku board to create a puzzle.
+        Generate the full board a seed's puzzle is carved from, without
+        carving it.
         """
-        random.seed(self.seed) 
-        cells_to_remove = random.randint(40, 50)
-        for _ in range(cells_to_remove):
-            row, col = random.randint(0, 8), random.randint(0, 8)
-            if board[row][col] != 0:
-                board[row][col] = 0
+        board = Board() # create an empty board
+        self.solve_sudoku(board, random.Random(seed))
+        return board
 
-    def find_empty_cell(self, board):
+    def solve_sudoku(self, board, rng=None):
         """
-        Find the next empty cell in the Sudoku board.
+        Solve the Sudoku board in place using the configured solver engine.
         """
-        for i in range(9):
-            for j in range(9):
-                if board[i][j] == 0:
-                    return (i, j)
-        return None
+        return self.solver.solve(board, rng)
 
-    def is_valid_move(self, board, row, col, num):
+    def remove_cells(self, board):
         """
-        Check if placing 'num' at position (row, col) is a valid move.
+        Remove cells from the Sudoku board to create a puzzle.
+
+        Cells are tried in a seeded random order and a removal is only kept if
+        the puzzle still has exactly one solution, until the board is down to
+        the target number of clues. A single pass is enough: a clue that could
+        not go earlier can never go once even more clues are missing.
         """
-        return (
-            self.is_valid_row(board, row, num)
-            and self.is_valid_col(board, col, num)
-            and self.is_valid_box(board, row - row % 3, col - col % 3, num)
-        )
+        rng = random.Random(self.seed)
+        cells = list(range(81))
+        rng.shuffle(cells)
+        clues = board.filled()
+        for cell in cells:
+            if clues <= self.clues:
+                break
+            number = board.cells[cell]
+            if number == 0:
+                continue
+            board.cells[cell] = 0
+            if self.solver.count_solutions(board, 2) == 1:
+                clues -= 1
+            else:
+                board.cells[cell] = number
+
+    @property
+    def grade(self):
+        """
+        The grade of the puzzle: 1-9 for the hardest solving technique it
+        needs, grader.UNSOLVED if those are not enough.
+        """
+        if self._grade is None and self.board is not None:
+            self._grade = grader.grade(self.board)
+        return self._grade
 
-    def is_valid_row(self, board, row, num):
+    @grade.setter
+    def grade(self, grade):
+        self._grade = grade
+
+    @property
+    def puzzle(self):
         """
-        Check if 'num' is valid in the given row.
+        The board as played, clues and entered numbers. Assigning a whole new
+        one, a Board or nine rows, recounts it; single cells go through
+        set_cell and merge_cell.
         """
-        return num not in board[row]
+        return self._puzzle
+
+    @puzzle.setter
+    def puzzle(self, puzzle):
+        if puzzle is not None and not isinstance(puzzle, Board):
+            puzzle = Board.from_rows(puzzle)
+        self._puzzle = puzzle
+        self.recount()
 
-    def is_valid_col(self, board, col, num):
+    def recount(self):
         """
-        Check if 'num' is valid in the given column.
+        Count the numbers of the whole puzzle from scratch.
         """
-        return num not in [board[i][col] for i in range(9)]
+        self.counts = [0] * 270
+        self.empty = 81
+        self.clashes = set()
+        if self._puzzle is None:
+            return
+        for cell, number in enumerate(self._puzzle.cells):
+            self.place(cell, number)
 
-    def is_valid_box(self, board, row, col, num):
+    def place(self, cell, number):
+        if number == 0:
+            return
+        self.empty -= 1
+        counts = self.counts
+        for unit in UNITS[cell]:
+            i = unit * 10 + number
+            counts[i] += 1
+            if counts[i] == 2:
+                self.clashes.add(i)
+
+    def unplace(self, cell, number):
+        if number == 0:
+            return
+        self.empty += 1
+        counts = self.counts
+        for unit in UNITS[cell]:
+            i = unit * 10 + number
+            counts[i] -= 1
+            if counts[i] == 1:
+                self.clashes.discard(i)
+
+    def write(self, cell, number):
         """
-        Check if 'num' is valid in the 3x3 box containing (row, col).
+        Put a number into a cell, keeping the counts up to date.
         """
-        return num not in [
-            board[row + i][col + j] for i in range(3) for j in range(3)
-        ]
+        cells = self._puzzle.cells
+        old = cells[cell]
+        if old != number:
+            self.unplace(cell, old)
+            cells[cell] = number
+            self.place(cell, number)
 
     def start(self):
         """
@@ -103,25 +219,118 @@ class Game(object):
         self.game_over = False
         self.board = self.generate_board()
         if not self.puzzle:
-            self.puzzle = [[cell for cell in row] for row in self.board]
+            self.puzzle = self.board.clone()
+            self.registers.reset()
+        if self.journal is not None:
+            self.journal.round(self)
+
+    def set_cell(self, row, col, number):
+        """
+        Write a number entered on this peer into a cell. Returns the stamp to
+        send along with the move, or None if the cell holds a clue.
+        """
+        if not 0 <= number <= 9:
+            raise ValueError(f"Invalid number {number!r}")
+        if not (0 <= row < 9 and 0 <= col < 9):
+            raise ValueError(f"Invalid cell {row!r}, {col!r}")
+        if self.board.cells[row * 9 + col] != 0:
+            return None
+        self.write(row * 9 + col, number)
+        stamp = self.registers.local_write(row * 9 + col)
+        if self.journal is not None:
+            self.journal.move(row * 9 + col, number, stamp)
+        return stamp
+
+    def merge_cell(self, row, col, number, stamp):
+        """
+        Apply a write made on another peer, unless the cell already holds a
+        later one. Returns True if the cell changed.
+        """
+        if not 0 <= number <= 9:
+            raise ValueError(f"Invalid number {number!r}")
+        if not (0 <= row < 9 and 0 <= col < 9):
+            raise ValueError(f"Invalid cell {row!r}, {col!r}")
+        if self.board.cells[row * 9 + col] != 0:
+            return False
+        if not self.registers.merge(row * 9 + col, stamp):
+            return False
+        self.write(row * 9 + col, number)
+        if self.journal is not None:
+            self.journal.move(row * 9 + col, number, stamp)
+        return True
+
+    def deltas(self, versions):
+        """
+        List the entered cells a peer with the given version vector has not
+        seen, as [cell, number, counter, node].
+        """
+        return self.entries(self.registers.missing(versions))
+
+    def rows(self, mask):
+        """
+        List the entered cells of the rows in a 9-bit mask, as
+        [cell, number, counter, node].
+        """
+        stamps = self.registers.stamps
+        return self.entries(
+            cell for cell in range(81) if mask >> (cell // 9) & 1 and stamps[cell] is not None
+        )
+
+    def entries(self, cells):
+        stamps = self.registers.stamps
+        return [
+            [cell, self.puzzle.cells[cell], stamps[cell][0], stamps[cell][1]]
+            for cell in cells
+        ]
+
+    def digest(self):
+        """
+        One hash per row of the entered cells, for anti-entropy.
+        """
+        return self.registers.digest(self.puzzle)
+
+    def versions(self):
+        """
+        The version vector of the entered cells: node -> highest counter seen.
+        """
+        return dict(self.registers.versions)
 
     def check_win(self):
         """
-        Check if the puzzle has been completed.
-        """
-        for row in range(9):
-            if not self.check_row(row):
-                return False
-        for column in range(9):
-            if not self.check_column(column):
-                return False
-        for row in range(3):
-            for column in range(3):
-                if not self.check_square(row, column):
-                    return False
+        Check if the puzzle has been completed: no cell is empty and no number
+        occurs twice in a row, column or box, so every unit holds 1-9.
+        """
+        if self.empty or self.clashes:
+            return False
         self.game_over = True
         return True
 
+    def remaining(self):
+        """
+        The number of empty cells.
+        """
+        return self.empty
+
+    def conflicting(self, row, col):
+        """
+        Check if the number in a cell occurs again in its row, column or box.
+        """
+        number = self._puzzle.cells[row * 9 + col]
+        return number != 0 and any(self.counts[unit * 10 + number] > 1 for unit in UNITS[row * 9 + col])
+
+    def conflicts(self):
+        """
+        List the (row, col) of every cell whose number occurs again in its row,
+        column or box.
+        """
+        clashing = set()
+        for i in self.clashes:
+            unit, number = divmod(i, 10)
+            for cell in UNIT_CELLS[unit]:
+                if self._puzzle.cells[cell] == number:
+                    clashing.add(cell)
+        return [(cell // 9, cell % 9) for cell in sorted(clashing)]
+
     def check_block(self, block):
         """
         Check if a block (row, column, or square) contains the numbers 1-9.
@@ -132,24 +341,16 @@ class Game(object):
         """
         Check if a row contains the numbers 1-9.
         """
-        return self.check_block(self.puzzle[row])
+        return self.check_block(self.puzzle.row(row))
 
     def check_column(self, column):
         """
         Check if a column contains the numbers 1-9.
         """
-        return self.check_block(
-            [self.puzzle[row][column] for row in range(9)]
-        )
+        return self.check_block(self.puzzle.col(column))
 
     def check_square(self, row, column):
         """
         Check if a 3x3 square contains the numbers 1-9.
         """
-        return self.check_block(
-            [
-                self.puzzle[r][c]
-                for r in range(row * 3, (row + 1) * 3)
-                for c in range(column * 3, (column + 1) * 3)
-            ]
-        )
\ No newline at end of file
+        return self.check_block(self.puzzle.box(row * 3 + column))
\ No newline at end of file
@@ -0,0 +1,319 @@
+from concurrent.futures import ProcessPoolExecutor
+from itertools import combinations
+from multiprocessing import get_context
+
+from board import Board
+from solver import ALL_DIGITS, BIT, DIGIT_OF, POPCOUNT, UNITS, PEERS, BOX_OF, ROW_OF, COL_OF
+
+# Feature peers advertise in their hello to say their game data may carry
+# the grade of the puzzle
+FEATURE = "grade/2"
+
+# The techniques the grader knows, easiest first, in about the order the
+# usual human-style raters put them. A puzzle's grade is 1 + the index of the
+# hardest technique it needs, so 1 to 9, and UNSOLVED if they are not enough
+# and a player has to guess or know harder patterns.
+TECHNIQUES = (
+    "hidden single",
+    "naked single",
+    "pointing",
+    "claiming",
+    "naked pair",
+    "hidden pair",
+    "naked triple",
+    "hidden triple",
+    "x-wing",
+)
+UNSOLVED = len(TECHNIQUES) + 1
+
+# Every place a row or column crosses a box: the three cells they share,
+# the rest of the line and the rest of the box
+INTERSECTIONS = []
+for _line in range(18):
+    for _box in range(9):
+        _segment = [cell for cell in UNITS[_line] if BOX_OF[cell] == _box]
+        if _segment:
+            INTERSECTIONS.append((
+                _segment,
+                [cell for cell in UNITS[_line] if cell not in _segment],
+                [cell for cell in UNITS[18 + _box] if cell not in _segment],
+            ))
+
+# The rows, then the columns, as 9 cells each for the x-wing
+LINES = (UNITS[:9], UNITS[9:18])
+
+
+def grade_name(grade):
+    """
+    The name of the hardest technique a grade stands for.
+    """
+    if grade is None:
+        return None
+    if grade == UNSOLVED:
+        return "beyond " + TECHNIQUES[-1] + "s"
+    return TECHNIQUES[grade - 1]
+
+
+class Grader(object):
+    """
+    Grades a puzzle by the hardest technique a player needs to solve it
+    without guessing. It solves the way a person does: every empty cell
+    keeps a bitmask of its candidates, and the easiest technique that places
+    a number or strikes a candidate is applied, starting over from the
+    easiest after each success, until the board is full or none applies.
+    """
+    def __init__(self):
+        self.steps = (
+            self.hidden_single,
+            self.naked_single,
+            self.pointing,
+            self.claiming,
+            self.naked_pair,
+            self.hidden_pair,
+            self.naked_triple,
+            self.hidden_triple,
+            self.x_wing,
+        )
+
+    def grade(self, board):
+        """
+        Grade a puzzle, a Board or nine rows: 1-9 for the hardest technique
+        of TECHNIQUES it needs, UNSOLVED if they are not enough, which is
+        also the grade of a board that contradicts itself.
+        """
+        if not isinstance(board, Board):
+            board = Board.from_rows(board)
+        self.load(board)
+        hardest = 0
+        while self.empty:
+            for level, step in enumerate(self.steps):
+                if step():
+                    hardest = max(hardest, level + 1)
+                    break
+            else:
+                return UNSOLVED
+        return max(hardest, 1)
+
+    def load(self, board):
+        self.cells = bytearray(board.cells)
+        self.candidates = [0] * 81
+        self.empty = 0
+        units = [0] * 27
+        for cell in range(81):
+            number = self.cells[cell]
+            if number:
+                bit = BIT[number - 1]
+                units[ROW_OF[cell]] |= bit
+                units[9 + COL_OF[cell]] |= bit
+                units[18 + BOX_OF[cell]] |= bit
+        for cell in range(81):
+            if not self.cells[cell]:
+                self.empty += 1
+                self.candidates[cell] = ALL_DIGITS & ~(units[ROW_OF[cell]] | units[9 + COL_OF[cell]] | units[18 + BOX_OF[cell]])
+
+    def place(self, cell, bit):
+        candidates = self.candidates
+        self.cells[cell] = DIGIT_OF[bit]
+        candidates[cell] = 0
+        self.empty -= 1
+        for peer in PEERS[cell]:
+            candidates[peer] &= ~bit
+
+    def strike(self, cells, mask):
+        """
+        Take the candidates of 'mask' away from the cells. Returns True if
+        any cell had one of them.
+        """
+        candidates = self.candidates
+        struck = False
+        for cell in cells:
+            if candidates[cell] & mask:
+                candidates[cell] &= ~mask
+                struck = True
+        return struck
+
+    def hidden_single(self):
+        """
+        A number that fits in only one cell of a row, column or box.
+        """
+        candidates = self.candidates
+        placed = False
+        for unit in UNITS:
+            once = twice = 0
+            for cell in unit:
+                mask = candidates[cell]
+                twice |= once & mask
+                once |= mask
+            hidden = once & ~twice
+            while hidden:
+                bit = hidden & -hidden
+                hidden ^= bit
+                for cell in unit:
+                    if candidates[cell] & bit:
+                        self.place(cell, bit)
+                        placed = True
+                        break
+        return placed
+
+    def naked_single(self):
+        """
+        A cell with one candidate left.
+        """
+        candidates = self.candidates
+        placed = False
+        for cell in range(81):
+            mask = candidates[cell]
+            if mask and POPCOUNT[mask] == 1:
+                self.place(cell, mask)
+                placed = True
+        return placed
+
+    def pointing(self):
+        """
+        A number whose candidates in a box all lie in one row or column can
+        go nowhere else in that line.
+        """
+        candidates = self.candidates
+        for segment, line, box in INTERSECTIONS:
+            inside = candidates[segment[0]] | candidates[segment[1]] | candidates[segment[2]]
+            outside = 0
+            for cell in box:
+                outside |= candidates[cell]
+            if self.strike(line, inside & ~outside):
+                return True
+        return False
+
+    def claiming(self):
+        """
+        A number whose candidates in a row or column all lie in one box can
+        go nowhere else in that box.
+        """
+        candidates = self.candidates
+        for segment, line, box in INTERSECTIONS:
+            inside = candidates[segment[0]] | candidates[segment[1]] | candidates[segment[2]]
+            outside = 0
+            for cell in line:
+                outside |= candidates[cell]
+            if self.strike(box, inside & ~outside):
+                return True
+        return False
+
+    def naked_subset(self, size):
+        """
+        'size' cells of a unit that only take 'size' numbers between them
+        leave those numbers to no other cell of the unit.
+        """
+        candidates = self.candidates
+        for unit in UNITS:
+            open_cells = [cell for cell in unit if candidates[cell] and POPCOUNT[candidates[cell]] <= size]
+            if len(open_cells) < size:
+                continue
+            for subset in combinations(open_cells, size):
+                mask = 0
+                for cell in subset:
+                    mask |= candidates[cell]
+                if POPCOUNT[mask] == size and self.strike([cell for cell in unit if cell not in subset], mask):
+                    return True
+        return False
+
+    def hidden_subset(self, size):
+        """
+        'size' numbers that only fit in 'size' cells of a unit take those
+        cells, so their other candidates go.
+        """
+        candidates = self.candidates
+        for unit in UNITS:
+            # For every number, the positions in the unit it fits in
+            places = {}
+            for position, cell in enumerate(unit):
+                mask = candidates[cell]
+                while mask:
+                    bit = mask & -mask
+                    mask ^= bit
+                    places[bit] = places.get(bit, 0) | 1 << position
+            numbers = [bit for bit, where in places.items() if POPCOUNT[where] <= size]
+            if len(numbers) < size:
+                continue
+            for subset in combinations(numbers, size):
+                where = 0
+                for bit in subset:
+                    where |= places[bit]
+                if POPCOUNT[where] != size:
+                    continue
+                keep = sum(subset)
+                struck = False
+                for position in range(9):
+                    cell = unit[position]
+                    if where >> position & 1 and candidates[cell] & ~keep:
+                        candidates[cell] &= keep
+                        struck = True
+                if struck:
+                    return True
+        return False
+
+    def naked_pair(self):
+        return self.naked_subset(2)
+
+    def naked_triple(self):
+        return self.naked_subset(3)
+
+    def hidden_pair(self):
+        return self.hidden_subset(2)
+
+    def hidden_triple(self):
+        return self.hidden_subset(3)
+
+    def x_wing(self):
+        """
+        A number that fits in the same two columns of two rows, and nowhere
+        else in them, is in those columns in those rows; the same with rows
+        and columns swapped.
+        """
+        candidates = self.candidates
+        for lines, crosses in (LINES, LINES[::-1]):
+            for bit in BIT:
+                # The lines the number fits in exactly two places of
+                pairs = {}
+                for index, line in enumerate(lines):
+                    where = 0
+                    for position, cell in enumerate(line):
+                        if candidates[cell] & bit:
+                            where |= 1 << position
+                    if POPCOUNT[where] == 2:
+                        pairs.setdefault(where, []).append(index)
+                for where, indexes in pairs.items():
+                    if len(indexes) < 2:
+                        continue
+                    for first, second in combinations(indexes, 2):
+                        others = [
+                            cell
+                            for position in range(9) if where >> position & 1
+                            for index, cell in enumerate(crosses[position]) if index not in (first, second)
+                        ]
+                        if self.strike(others, bit):
+                            return True
+        return False
+
+
+def grade(board):
+    """
+    Grade a puzzle, a Board or nine rows. See Grader.grade.
+    """
+    return Grader().grade(board)
+
+
+def grade_packed(boards):
+    # Runs in the pool's worker processes; boards come as 81 bytes each
+    grader = Grader()
+    return [grader.grade(Board(board)) for board in boards]
+
+
+def grade_many(boards, workers=None, chunk=256):
+    """
+    Grade many puzzles in a pool of worker processes, 'workers' of them or
+    one per CPU. Returns the grades in the order of the boards.
+    """
+    packed = [bytes(board if isinstance(board, Board) else Board.from_rows(board)) for board in boards]
+    chunks = [packed[i:i + chunk] for i in range(0, len(packed), chunk)]
+    with ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn")) as executor:
+        return [grade for grades in executor.map(grade_packed, chunks) for grade in grades]
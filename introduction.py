@@ -0,0 +1,83 @@
+from collections import OrderedDict
+
+# Feature peers advertise in their hello to say they introduce joining peers
+# with paged 'peers' messages instead of a list inside the hello
+FEATURE = "intro/1"
+
+# Peers per 'peers' message, which keeps it well inside one datagram
+PAGE_SIZE = 32
+# Most peers handed to one joiner; it learns about the rest through gossip
+MAX_INTRODUCED = 256
+
+
+class TokenBucket(object):
+    """
+    Allows 'rate' events per second on average, in bursts of up to 'burst'.
+    """
+    def __init__(self, rate, burst, clock):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.tokens = burst
+        self.updated = clock.seconds()
+
+    def refill(self):
+        now = self.clock.seconds()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self):
+        """
+        Use up a token if there is one. Returns False otherwise.
+        """
+        self.refill()
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    def wait(self):
+        """
+        Seconds until the next token is available.
+        """
+        self.refill()
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+
+class View(object):
+    """
+    The peers this peer has said hello to, each stamped with the version of
+    the view it was added at. A joiner that already got an introduction up to
+    some version only needs the peers added after it.
+    """
+    def __init__(self):
+        self.version = 0
+        self.added = OrderedDict()
+
+    def add(self, addr):
+        self.version += 1
+        self.added.pop(addr, None)
+        self.added[addr] = self.version
+
+    def remove(self, addr):
+        if self.added.pop(addr, None) is not None:
+            self.version += 1
+
+    def since(self, version, exclude=None, limit=MAX_INTRODUCED):
+        """
+        The most recently added peers, up to 'limit', added after 'version'.
+        """
+        peers = []
+        for addr in reversed(self.added):
+            if self.added[addr] <= version or len(peers) >= limit:
+                break
+            if addr != exclude:
+                peers.append(addr)
+        return peers
+
+
+def pages(peers, size=PAGE_SIZE):
+    """
+    Split a list of peers into pages for 'peers' messages.
+    """
+    return [peers[i:i + size] for i in range(0, len(peers), size)] or [[]]
@@ -0,0 +1,212 @@
+import logging
+import mmap
+import os
+import struct
+
+from game import Game
+from protocol import DIFFICULTY_NAMES, pack_node, unpack_node
+
+log = logging.getLogger(__name__)
+
+JOURNAL_MAGIC = b"SUDOKUJL"
+SNAPSHOT_MAGIC = b"SUDOKUSN"
+JOURNAL_FORMAT = 1
+JOURNAL_HEADER = struct.Struct("<8sBQ")  # magic, format, sequence number of the first move
+SNAPSHOT_HEADER = struct.Struct("<8sBQIBB")  # magic, format, moves up to, seed, difficulty, clues
+ENTRY = struct.Struct("<BBI6s")  # cell, number, Lamport counter, node
+
+
+class Journal(object):
+    """
+    An append-only file of the moves applied to the game, local and remote,
+    so a peer that crashes or restarts gets its board back without asking
+    anyone for it.
+
+    Every move that changed the board is one 12-byte record; moves are
+    numbered from the start of the journal. Now and then, and whenever a new
+    round starts, the board is compacted into a snapshot, the round and its
+    entered cells, written next to the journal at 'path'.snap, and the
+    journal starts over. Recovery loads the snapshot and replays the moves
+    after it from a memory map of the journal; a record cut short by a crash
+    is ignored.
+
+    Moves are written straight to the file without buffering, so they
+    survive the process but not necessarily the machine; snapshots are
+    synced to disk before they replace the old one.
+    """
+    def __init__(self, path, snapshot_every=1000):
+        self.path = path
+        self.snapshot_path = path + ".snap"
+        self.snapshot_every = snapshot_every
+        self.game = None
+        self.base = 0
+        self.seq = 0
+        self.nodes = {}
+        self.file = None
+
+    def open(self):
+        """
+        Open the journal for appending.
+        """
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.file = open(self.path, "ab", buffering=0)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def restart(self):
+        """
+        Empty the journal; the next move gets the current sequence number.
+        """
+        self.file.truncate(0)
+        self.file.write(JOURNAL_HEADER.pack(JOURNAL_MAGIC, JOURNAL_FORMAT, self.seq))
+        self.base = self.seq
+
+    def pack_node(self, node):
+        packed = self.nodes.get(node)
+        if packed is None:
+            packed = self.nodes[node] = pack_node(node)
+        return packed
+
+    def round(self, game):
+        """
+        Note that a new round started: the moves of the last one are of no
+        use any more, so the journal is compacted right away.
+        """
+        self.game = game
+        self.snapshot()
+
+    def move(self, cell, number, stamp):
+        """
+        Append a move that changed the board.
+        """
+        if self.file is None:
+            return
+        try:
+            self.file.write(ENTRY.pack(cell, number, stamp[0], self.pack_node(stamp[1])))
+        except ValueError:
+            # Only IPv4 node ids fit in a record; such peers are not journaled
+            log.warning("Not journaling a move by node %r", stamp[1])
+            return
+        self.seq += 1
+        if self.seq - self.base >= self.snapshot_every:
+            self.snapshot()
+
+    def snapshot(self):
+        """
+        Write the round and its entered cells to the snapshot file and empty
+        the journal.
+        """
+        game = self.game
+        if game is None or self.file is None:
+            return
+        entries = []
+        for cell, number, counter, node in game.deltas({}):
+            try:
+                entries.append(ENTRY.pack(cell, number, counter, self.pack_node(node)))
+            except ValueError:
+                continue
+        header = SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, JOURNAL_FORMAT, self.seq, game.seed - 1,
+                                      DIFFICULTY_NAMES.index(game.difficulty), game.clues)
+        tmp_path = self.snapshot_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(header + b"".join(entries))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+        self.restart()
+
+    def read_snapshot(self):
+        """
+        The round and entered cells of the snapshot, as (seq, seed,
+        difficulty, clues, entries), or None if there is none to use.
+        """
+        try:
+            with open(self.snapshot_path, "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+        if len(data) < SNAPSHOT_HEADER.size:
+            return None
+        magic, version, seq, seed, difficulty, clues = SNAPSHOT_HEADER.unpack_from(data)
+        if (magic, version) != (SNAPSHOT_MAGIC, JOURNAL_FORMAT) or (len(data) - SNAPSHOT_HEADER.size) % ENTRY.size:
+            return None
+        return seq, seed, DIFFICULTY_NAMES[difficulty], clues, list(ENTRY.iter_unpack(data[SNAPSHOT_HEADER.size:]))
+
+    def replay(self, since=0):
+        """
+        Read the moves journaled from sequence number 'since' on, through a
+        memory map of the file, as (seq, cell, number, counter, packed node).
+        Returns None if the journal starts after 'since', as the moves
+        before it were compacted into the snapshot.
+        """
+        if self.file is not None:
+            self.file.flush()
+        try:
+            f = open(self.path, "rb")
+        except OSError:
+            return [] if since == 0 else None
+        with f:
+            size = os.fstat(f.fileno()).st_size
+            if size < JOURNAL_HEADER.size:
+                return [] if since == 0 else None
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                magic, version, base = JOURNAL_HEADER.unpack_from(data)
+                if (magic, version) != (JOURNAL_MAGIC, JOURNAL_FORMAT) or since < base:
+                    return None
+                start = JOURNAL_HEADER.size + (since - base) * ENTRY.size
+                end = JOURNAL_HEADER.size + (size - JOURNAL_HEADER.size) // ENTRY.size * ENTRY.size
+                view = memoryview(data)[min(start, end):end]
+                try:
+                    return [(seq, *entry) for seq, entry in enumerate(ENTRY.iter_unpack(view), since)]
+                finally:
+                    view.release()
+
+    def since(self, seq):
+        """
+        The moves from sequence number 'seq' on, as [cell, number, counter,
+        node] like game data carries them, or None if some of them were
+        compacted away and the whole board is needed.
+        """
+        moves = self.replay(seq)
+        if moves is None:
+            return None
+        return [[cell, number, counter, unpack_node(node)] for _, cell, number, counter, node in moves]
+
+    def load(self, **kwargs):
+        """
+        Rebuild the game of the last round from the snapshot and the moves
+        journaled after it, and keep journaling its moves. Returns the Game,
+        made with 'kwargs', or None if there is nothing to recover, in which
+        case the journal starts empty.
+        """
+        snapshot = self.read_snapshot()
+        if snapshot is None:
+            self.open()
+            self.restart()
+            return None
+        seq, seed, difficulty, clues, entries = snapshot
+        moves = self.replay(seq)
+        if moves is None:
+            # A journal that does not follow on from the snapshot, e.g. one
+            # that could not be written; the snapshot is all there is
+            moves = []
+        game = Game(seed, difficulty=difficulty, clues=clues, **kwargs)
+        game.start()
+        nodes = {}
+        for cell, number, counter, node in entries + [move[1:] for move in moves]:
+            if node not in nodes:
+                nodes[node] = unpack_node(node)
+            game.merge_cell(cell // 9, cell % 9, number, (counter, nodes[node]))
+        self.seq = seq + len(moves)
+        self.game = game
+        game.journal = self
+        # Compact what was recovered before journaling anything new
+        self.open()
+        self.snapshot()
+        log.info("Recovered round %d with %d snapshot cells and %d journaled moves", seed, len(entries), len(moves))
+        return game
@@ -0,0 +1,343 @@
+import math
+import random
+
+# Feature peers advertise in their hello to say they take part in SWIM probing
+FEATURE = "swim/1"
+
+ALIVE = 0
+SUSPECT = 1
+DEAD = 2
+
+STATE_NAMES = ("alive", "suspect", "dead")
+
+
+class Member(object):
+    """
+    What is known about one member: its state, the incarnation that state was
+    announced with, and when a suspicion about it runs out.
+    """
+    __slots__ = ('addr', 'state', 'incarnation', 'deadline')
+
+    def __init__(self, addr, state=ALIVE, incarnation=0):
+        self.addr = addr
+        self.state = state
+        self.incarnation = incarnation
+        self.deadline = None
+
+
+class Probe(object):
+    """
+    A ping waiting for its ack. 'relay' is set for pings sent on behalf of
+    another member, to (requester, probe, timestamp) of the original request.
+    """
+    __slots__ = ('target', 'relay', 'acked')
+
+    def __init__(self, target, relay=None):
+        self.target = target
+        self.relay = relay
+        self.acked = False
+
+
+class Membership(object):
+    """
+    SWIM failure detection and membership dissemination.
+
+    Every protocol period one member is pinged, going round a shuffled list
+    so every member is probed within a bounded time. If it does not ack
+    within 'ping_timeout', 'indirect' other members are asked to ping it on
+    our behalf, and if no ack has come back by the end of the period it is
+    suspected. A suspected member that does not refute the suspicion, by
+    announcing itself alive with a higher incarnation, is declared dead once
+    the suspicion timeout runs out. The timeout grows with the log of the
+    swarm size, as the suspicion takes longer to reach every member.
+
+    Changes in membership are not broadcast: they ride along on pings and
+    acks, each one a number of times growing with the log of the swarm size.
+    So every member sends one ping and one ack per period, plus a few
+    indirect pings when a probe fails, however large the swarm is.
+
+    The transport is left to the caller: 'send' is called with a message dict
+    and an (addr, port) and the handle_* methods take received Messages.
+    'on_join' and 'on_leave' are called with the address of a member that was
+    learned about through gossip or declared dead. Pings are stamped with
+    'timer', the clock's time unless given, and acks echo the stamp back.
+    """
+    def __init__(self, me, send, clock=None, rng=None, period=1.0, ping_timeout=0.5, indirect=3,
+                 suspicion_mult=4, retransmit_mult=4, max_updates=8, on_join=None, on_leave=None, timer=None):
+        if clock is None:
+            from twisted.internet import reactor as clock
+        self.me = me
+        self.send = send
+        self.clock = clock
+        self.timer = timer or clock.seconds
+        self.random = rng or random.Random()
+        self.period = period
+        self.ping_timeout = ping_timeout
+        self.indirect = indirect
+        self.suspicion_mult = suspicion_mult
+        self.retransmit_mult = retransmit_mult
+        self.max_updates = max_updates
+        self.on_join = on_join
+        self.on_leave = on_leave
+        self.incarnation = 0
+        self.members = {}
+        self.suspects = {}
+        self.dead = {}
+        self.updates = {}
+        self.probes = {}
+        self.next_probe = 1
+        self.current = None
+        self.probe_order = []
+        self.pings_sent = 0
+        self.indirect_sent = 0
+        self.suspicions = 0
+        self.refutations = 0
+
+    def add(self, addr, incarnation=0):
+        """
+        Add a member we have heard from directly, e.g. through its hello.
+        """
+        if addr == self.me:
+            return
+        member = self.members.get(addr)
+        if member is None:
+            self.dead.pop(addr, None)
+            self.join(addr, incarnation)
+        elif incarnation > member.incarnation:
+            self.apply(addr, ALIVE, incarnation)
+
+    def remove(self, addr):
+        """
+        Declare a member gone, e.g. after its bye, and tell the others.
+        """
+        member = self.members.get(addr)
+        if member is not None:
+            self.declare_dead(member)
+
+    def alive(self):
+        """
+        The addresses of every member not declared dead.
+        """
+        return list(self.members)
+
+    def timeout(self):
+        """
+        How long a suspected member has to refute the suspicion.
+        """
+        return self.suspicion_mult * max(1.0, math.log10(len(self.members) + 1)) * self.period
+
+    def tick(self):
+        """
+        Run one protocol period: settle the previous probe and the suspicions
+        that ran out, then ping the next member.
+        """
+        now = self.clock.seconds()
+        if self.current is not None:
+            probe = self.probes.pop(self.current, None)
+            if probe is not None and not probe.acked:
+                member = self.members.get(probe.target)
+                if member is not None and member.state == ALIVE:
+                    self.suspect(member, member.incarnation)
+            self.current = None
+        for member in list(self.suspects.values()):
+            if member.deadline <= now:
+                self.declare_dead(member)
+        for addr, (_, expires) in list(self.dead.items()):
+            if expires <= now:
+                del self.dead[addr]
+        target = self.next_target()
+        if target is None:
+            return
+        self.current = self.ping(target)
+        self.clock.callLater(self.ping_timeout, self.ping_indirectly, self.current)
+
+    def join(self, addr, incarnation):
+        self.members[addr] = Member(addr, ALIVE, incarnation)
+        # New members go in at a random place of the probe round
+        self.probe_order.insert(self.random.randint(0, len(self.probe_order)), addr)
+        self.gossip(addr, ALIVE, incarnation)
+
+    def next_target(self):
+        while self.probe_order:
+            addr = self.probe_order.pop()
+            if addr in self.members:
+                return addr
+        if not self.members:
+            return None
+        self.probe_order = list(self.members)
+        self.random.shuffle(self.probe_order)
+        return self.probe_order.pop()
+
+    def ping(self, target, relay=None):
+        probe = self.next_probe
+        self.next_probe = self.next_probe % 0xFFFFFFFF + 1
+        self.probes[probe] = Probe(target, relay)
+        self.pings_sent += 1
+        self.send({'msgtype': 'ping', 'timestamp': self.timer(), 'probe': probe, 'updates': self.piggyback(target)}, target)
+        if relay is not None:
+            # Relayed probes are not settled by tick
+            self.clock.callLater(self.period, self.probes.pop, probe, None)
+        return probe
+
+    def ping_indirectly(self, probe):
+        """
+        Ask a few other members to ping the target of a probe not acked yet.
+        """
+        pending = self.probes.get(probe)
+        if pending is None or pending.acked:
+            return
+        others = [addr for addr in self.members if addr != pending.target]
+        helpers = self.random.sample(others, min(self.indirect, len(others)))
+        for helper in helpers:
+            self.indirect_sent += 1
+            self.send({
+                'msgtype': 'ping_req',
+                'timestamp': self.timer(),
+                'probe': probe,
+                'target': list(pending.target),
+                'updates': self.piggyback(),
+            }, helper)
+
+    def handle_ping(self, ping):
+        """
+        Ack a ping, piggybacking updates on the pong.
+        """
+        self.merge(ping.get('updates', ()))
+        self.send({
+            'msgtype': 'pong',
+            'timestamp': self.timer(),
+            'echo': ping['timestamp'],
+            'probe': ping['probe'],
+            'updates': self.piggyback(),
+        }, ping.sender)
+
+    def handle_ping_req(self, req):
+        """
+        Ping a member on behalf of another one.
+        """
+        self.merge(req.get('updates', ()))
+        target = tuple(req['target'])
+        self.ping(target, relay=(req.sender, req['probe'], req['timestamp']))
+
+    def handle_pong(self, pong):
+        """
+        Settle the probe a pong acks, passing it on if it was a relayed one.
+        Returns True if it acked a ping of ours sent directly to the sender,
+        i.e. a round trip that can be used as an RTT sample.
+        """
+        self.merge(pong.get('updates', ()))
+        probe = self.probes.get(pong['probe'])
+        if probe is None or probe.acked:
+            return False
+        probe.acked = True
+        if probe.relay is not None:
+            requester, origin, timestamp = probe.relay
+            self.send({
+                'msgtype': 'pong',
+                'timestamp': self.timer(),
+                'echo': timestamp,
+                'probe': origin,
+                'updates': self.piggyback(),
+            }, requester)
+            return False
+        return probe.target == pong.sender
+
+    def suspect(self, member, incarnation):
+        self.suspicions += 1
+        member.state = SUSPECT
+        member.incarnation = incarnation
+        member.deadline = self.clock.seconds() + self.timeout()
+        self.suspects[member.addr] = member
+        self.gossip(member.addr, SUSPECT, incarnation)
+
+    def declare_dead(self, member):
+        del self.members[member.addr]
+        self.suspects.pop(member.addr, None)
+        # Kept for a while so that stale gossip does not bring it back
+        self.dead[member.addr] = (member.incarnation, self.clock.seconds() + self.timeout() * 4)
+        self.gossip(member.addr, DEAD, member.incarnation)
+        if self.on_leave is not None:
+            self.on_leave(member.addr)
+
+    def merge(self, updates):
+        for addr, port, state, incarnation in updates:
+            self.apply((addr, port), state, incarnation)
+
+    def apply(self, addr, state, incarnation):
+        """
+        Apply a membership update, following SWIM's precedence rules: a
+        higher incarnation wins, at the same incarnation suspect beats alive,
+        and dead beats everything.
+        """
+        if addr == self.me:
+            if state != ALIVE and incarnation >= self.incarnation:
+                # Refute the rumour about us
+                self.refutations += 1
+                self.incarnation = incarnation + 1
+                self.gossip(self.me, ALIVE, self.incarnation)
+            return
+        member = self.members.get(addr)
+        if member is None:
+            if state == DEAD or addr in self.dead and incarnation <= self.dead[addr][0]:
+                return
+            self.dead.pop(addr, None)
+            self.join(addr, incarnation)
+            if state == SUSPECT:
+                self.suspect(self.members[addr], incarnation)
+            if self.on_join is not None:
+                self.on_join(addr)
+            return
+        if state == DEAD:
+            if incarnation >= member.incarnation:
+                self.declare_dead(member)
+        elif state == SUSPECT:
+            if incarnation > member.incarnation or incarnation == member.incarnation and member.state == ALIVE:
+                self.suspect(member, incarnation)
+        elif incarnation > member.incarnation:
+            member.state = ALIVE
+            member.incarnation = incarnation
+            member.deadline = None
+            self.suspects.pop(addr, None)
+            self.gossip(addr, ALIVE, incarnation)
+
+    def gossip(self, addr, state, incarnation):
+        """
+        Queue an update to be piggybacked on the next messages.
+        """
+        self.updates[addr] = [state, incarnation, 0]
+
+    def piggyback(self, target=None):
+        """
+        Take the updates sent the fewest times so far, up to 'max_updates',
+        dropping the ones that have been sent often enough. An update about
+        the target itself always goes first, so a suspected member hears of
+        it as soon as it is probed and can refute it.
+        """
+        if not self.updates:
+            return []
+        limit = self.retransmit_mult * max(1, math.ceil(math.log10(len(self.members) + 1)))
+        chosen = sorted(self.updates.items(), key=lambda item: (item[0] != target, item[1][2]))[:self.max_updates]
+        updates = []
+        for addr, update in chosen:
+            state, incarnation, sent = update
+            updates.append([addr[0], addr[1], state, incarnation])
+            update[2] = sent + 1
+            if update[2] >= limit:
+                del self.updates[addr]
+        return updates
+
+    def stats(self):
+        """
+        Members by state, probes sent and suspicions raised and refuted.
+        """
+        suspect = len(self.suspects)
+        return {
+            'alive': len(self.members) - suspect,
+            'suspect': suspect,
+            'dead': len(self.dead),
+            'pings': self.pings_sent,
+            'indirect': self.indirect_sent,
+            'suspicions': self.suspicions,
+            'refutations': self.refutations,
+            'incarnation': self.incarnation,
+        }
@@ -0,0 +1,288 @@
+import json
+import logging
+import os
+import time
+
+from clock import LoopingCall
+
+log = logging.getLogger(__name__)
+
+IN = "in"
+OUT = "out"
+# Outgoing datagrams lost before they left: dropped from a full send queue
+# or refused by the socket
+DROPPED = "dropped"
+SEND_ERRORS = "send_errors"
+
+# Histogram buckets: values below 2**SUB_BITS microseconds get a bucket each,
+# larger ones 2**(SUB_BITS - 1) buckets per power of two, so every bucket is
+# within 1.6% of the values it holds
+SUB_BITS = 7
+SUB_BUCKETS = 1 << SUB_BITS
+HALF_BUCKETS = SUB_BUCKETS >> 1
+
+QUANTILES = (("p50", 0.5), ("p99", 0.99), ("p999", 0.999))
+
+
+class Histogram(object):
+    """
+    An HDR-style histogram of durations in seconds. Samples are counted in
+    log-linear microsecond buckets, so recording is O(1), memory grows with
+    the log of the range rather than the number of samples, and percentiles
+    are exact to the bucket width.
+    """
+    def __init__(self):
+        self.counts = {}
+        self.count = 0
+        self.total = 0.0
+        self.min = float('inf')
+        self.max = 0.0
+
+    @staticmethod
+    def bucket(value):
+        """
+        The bucket a value in microseconds falls in.
+        """
+        if value < SUB_BUCKETS:
+            return value
+        shift = value.bit_length() - SUB_BITS
+        return shift * HALF_BUCKETS + (value >> shift)
+
+    @staticmethod
+    def highest(bucket):
+        """
+        The largest value in microseconds a bucket holds.
+        """
+        if bucket < SUB_BUCKETS:
+            return bucket
+        shift = bucket // HALF_BUCKETS - 1
+        return ((bucket - shift * HALF_BUCKETS + 1) << shift) - 1
+
+    def record(self, seconds):
+        seconds = max(0.0, seconds)
+        bucket = self.bucket(int(seconds * 1e6))
+        self.counts[bucket] = self.counts.get(bucket, 0) + 1
+        self.count += 1
+        self.total += seconds
+        self.min = min(self.min, seconds)
+        self.max = max(self.max, seconds)
+
+    def percentile(self, q):
+        """
+        The smallest value, in seconds, that at least a fraction 'q' of the
+        samples do not exceed. 0 if there are none.
+        """
+        if not self.count:
+            return 0.0
+        rank = max(1, q * self.count)
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= rank:
+                return min(self.max, self.highest(bucket) / 1e6)
+        return self.max
+
+    def snapshot(self):
+        snapshot = {
+            'count': self.count,
+            'sum': self.total,
+            'min': self.min if self.count else 0.0,
+            'max': self.max,
+            'mean': self.total / self.count if self.count else 0.0,
+        }
+        for name, q in QUANTILES:
+            snapshot[name] = self.percentile(q)
+        return snapshot
+
+
+class Metrics(object):
+    """
+    Counters of the packets and bytes sent to and received from every peer,
+    per message type, and histograms of the round-trip times measured to
+    them, and of the outgoing datagrams dropped or not sent, per message
+    type. Nothing is ever reset; rates are the difference between two
+    snapshots. A peer's own counters are dropped when it is forgotten, the
+    totals per message type are kept.
+    """
+    def __init__(self, clock=None):
+        if clock is None:
+            from twisted.internet import reactor as clock
+        self.clock = clock
+        self.started = clock.seconds()
+        self.peers = {}
+        self.totals = {IN: {}, OUT: {}}
+        self.losses = {DROPPED: {}, SEND_ERRORS: {}}
+        self.rtt = Histogram()
+        self.peer_rtt = {}
+
+    def count(self, direction, addr, msgtype, size):
+        """
+        Count a message of 'size' bytes sent to or received from a peer.
+        """
+        counters = self.totals[direction].get(msgtype)
+        if counters is None:
+            counters = self.totals[direction][msgtype] = [0, 0]
+        counters[0] += 1
+        counters[1] += size
+        peer = self.peers.get(addr)
+        if peer is None:
+            peer = self.peers[addr] = {IN: {}, OUT: {}}
+        counters = peer[direction].get(msgtype)
+        if counters is None:
+            counters = peer[direction][msgtype] = [0, 0]
+        counters[0] += 1
+        counters[1] += size
+
+    def count_loss(self, kind, msgtype):
+        """
+        Count an outgoing message that was DROPPED or hit one of the
+        SEND_ERRORS.
+        """
+        losses = self.losses[kind]
+        losses[msgtype] = losses.get(msgtype, 0) + 1
+
+    def record_rtt(self, addr, seconds):
+        """
+        Record a round trip to a peer.
+        """
+        self.rtt.record(seconds)
+        if addr not in self.peer_rtt:
+            self.peer_rtt[addr] = Histogram()
+        self.peer_rtt[addr].record(seconds)
+
+    def forget(self, addr):
+        self.peers.pop(addr, None)
+        self.peer_rtt.pop(addr, None)
+
+    def prune(self, keep):
+        """
+        Drop the counters of every peer not in 'keep'; the totals per message
+        type are kept.
+        """
+        self.peers = {addr: counters for addr, counters in self.peers.items() if addr in keep}
+        self.peer_rtt = {addr: histogram for addr, histogram in self.peer_rtt.items() if addr in keep}
+
+    def total(self, direction):
+        """
+        The packets and bytes sent or received so far, over every peer. Safe
+        to call from another thread than the one counting.
+        """
+        totals = list(self.totals[direction].values())
+        packets = sum(counters[0] for counters in totals)
+        size = sum(counters[1] for counters in totals)
+        return packets, size
+
+    def snapshot(self):
+        """
+        Everything measured so far as a dict of plain types.
+        """
+        def by_type(counters):
+            return {msgtype: {'packets': n, 'bytes': size} for msgtype, (n, size) in sorted(counters.items())}
+
+        peers = {}
+        for addr in set(self.peers) | set(self.peer_rtt):
+            counters = self.peers.get(addr, {IN: {}, OUT: {}})
+            peers[label(addr)] = {
+                IN: by_type(counters[IN]),
+                OUT: by_type(counters[OUT]),
+                'rtt': self.peer_rtt[addr].snapshot() if addr in self.peer_rtt else Histogram().snapshot(),
+            }
+        return {
+            'time': time.time(),
+            'uptime': self.clock.seconds() - self.started,
+            IN: by_type(self.totals[IN]),
+            OUT: by_type(self.totals[OUT]),
+            DROPPED: dict(sorted(self.losses[DROPPED].items())),
+            SEND_ERRORS: dict(sorted(self.losses[SEND_ERRORS].items())),
+            'rtt': self.rtt.snapshot(),
+            'peers': peers,
+        }
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), sort_keys=True)
+
+    def to_prometheus(self):
+        """
+        The snapshot in the Prometheus text exposition format.
+        """
+        snapshot = self.snapshot()
+        lines = []
+
+        def counter(name, help, samples):
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} counter")
+            lines.extend(samples)
+
+        def summary(name, help, histograms):
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} summary")
+            for labels, histogram in histograms:
+                for key, q in QUANTILES:
+                    lines.append(f"{name}{{{labels}quantile=\"{q}\"}} {histogram[key]:.6f}")
+                braces = f"{{{labels.rstrip(',')}}}" if labels else ""
+                lines.append(f"{name}_sum{braces} {histogram['sum']:.6f}")
+                lines.append(f"{name}_count{braces} {histogram['count']}")
+
+        for unit, index in (("packets", "packets"), ("bytes", "bytes")):
+            samples = []
+            for direction in (IN, OUT):
+                for msgtype, counters in snapshot[direction].items():
+                    samples.append(f"sudoku_{unit}_total{{direction=\"{direction}\",msgtype=\"{msgtype}\"}} {counters[index]}")
+            counter(f"sudoku_{unit}_total", f"{unit.capitalize()} sent and received per message type.", samples)
+            samples = []
+            for peer, counters in sorted(snapshot['peers'].items()):
+                for direction in (IN, OUT):
+                    for msgtype, by_type in counters[direction].items():
+                        samples.append(f"sudoku_peer_{unit}_total{{peer=\"{peer}\",direction=\"{direction}\",msgtype=\"{msgtype}\"}} {by_type[index]}")
+            counter(f"sudoku_peer_{unit}_total", f"{unit.capitalize()} sent to and received from each peer per message type.", samples)
+        counter("sudoku_dropped_total", "Outgoing messages dropped from a full send queue per message type.",
+                [f"sudoku_dropped_total{{msgtype=\"{msgtype}\"}} {n}" for msgtype, n in snapshot[DROPPED].items()])
+        counter("sudoku_send_errors_total", "Outgoing messages the socket would not send per message type.",
+                [f"sudoku_send_errors_total{{msgtype=\"{msgtype}\"}} {n}" for msgtype, n in snapshot[SEND_ERRORS].items()])
+        summary("sudoku_rtt_seconds", "Round-trip time of pings to every peer.", [("", snapshot['rtt'])])
+        summary("sudoku_peer_rtt_seconds", "Round-trip time of pings to each peer.",
+                [(f"peer=\"{peer}\",", peer_snapshot['rtt']) for peer, peer_snapshot in sorted(snapshot['peers'].items())])
+        lines.append("# HELP sudoku_uptime_seconds Seconds since the metrics were created.")
+        lines.append("# TYPE sudoku_uptime_seconds gauge")
+        lines.append(f"sudoku_uptime_seconds {snapshot['uptime']:.3f}")
+        return "\n".join(lines) + "\n"
+
+
+def label(addr):
+    if isinstance(addr, tuple):
+        return f"{addr[0]}:{addr[1]}"
+    return str(addr)
+
+
+class MetricsExporter(object):
+    """
+    Writes a metrics snapshot to 'path' every 'interval' seconds, in the
+    Prometheus text format if the file name ends in .prom and as JSON
+    otherwise. The file is replaced in one go, so readers never see half of
+    a snapshot.
+    """
+    def __init__(self, metrics, path, interval=5.0, clock=None):
+        self.metrics = metrics
+        self.path = path
+        self.interval = interval
+        self.lc_export = LoopingCall(self.export)
+        if clock is not None:
+            self.lc_export.clock = clock
+
+    def start(self):
+        self.lc_export.start(self.interval)
+
+    def stop(self):
+        if self.lc_export.running:
+            self.lc_export.stop()
+        self.export()
+
+    def export(self):
+        text = self.metrics.to_prometheus() if self.path.endswith(".prom") else self.metrics.to_json()
+        tmp = f"{self.path}.tmp"
+        try:
+            with open(tmp, "w") as f:
+                f.write(text)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            log.warning("Could not write metrics to %s: %s", self.path, e)
@@ -0,0 +1,41 @@
+import json
+from twisted.internet.protocol import Factory, Protocol
+
+
+class MetricsServer(Protocol):
+    """
+    Answers one HTTP request with a snapshot, as JSON for paths ending in
+    .json and in the Prometheus text format otherwise, then hangs up. With a
+    profiler, /profile.json gets its timings instead.
+    """
+    def __init__(self):
+        self.buffer = b""
+
+    def dataReceived(self, data):
+        self.buffer += data
+        if b"\n" not in self.buffer:
+            if len(self.buffer) > 4096:
+                self.transport.loseConnection()
+            return
+        request = self.buffer.split(b"\n", 1)[0].split()
+        path = request[1].decode('ascii', 'replace') if len(request) > 1 else "/"
+        path = path.split("?")[0]
+        if path == "/profile.json" and self.factory.profiler is not None:
+            body, content_type = json.dumps(self.factory.profiler.snapshot(), sort_keys=True), "application/json"
+        elif path.endswith(".json"):
+            body, content_type = self.factory.metrics.to_json(), "application/json"
+        else:
+            body, content_type = self.factory.metrics.to_prometheus(), "text/plain; version=0.0.4"
+        body = body.encode('utf-8')
+        self.transport.write(
+            f"HTTP/1.0 200 OK\r\nContent-Type: {content_type}\r\nContent-Length: {len(body)}\r\n\r\n".encode('ascii') + body
+        )
+        self.transport.loseConnection()
+
+
+class MetricsFactory(Factory):
+    protocol = MetricsServer
+
+    def __init__(self, metrics, profiler=None):
+        self.metrics = metrics
+        self.profiler = profiler
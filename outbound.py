@@ -0,0 +1,254 @@
+import errno
+import logging
+from collections import deque
+
+from introduction import TokenBucket
+from metrics import OUT, DROPPED, SEND_ERRORS
+
+log = logging.getLogger(__name__)
+
+# Priority classes of outgoing datagrams, most urgent first. Moves, and the
+# acks that let the reliable channel deliver them, go before the pongs that
+# answer probes, which go before pings; everything else, game data, hellos,
+# introductions and anti-entropy, is bulk state
+MOVES, PONGS, PINGS, BULK = range(4)
+PRIORITIES = {
+    'move': MOVES,
+    'moves': MOVES,
+    'ack': MOVES,
+    'pong': PONGS,
+    'ping': PINGS,
+    'ping_req': PINGS,
+    'bye': PINGS,
+}
+PRIORITY_NAMES = ("moves", "pongs", "pings", "bulk")
+
+# Datagrams per second, and per burst, sent to any one peer
+SEND_RATE = 2000
+SEND_BURST = 500
+# Datagrams each class may have waiting for one peer; past that the oldest
+# of the class is dropped
+QUEUE_LIMITS = (1024, 64, 64, 256)
+
+# Errors of a socket whose send buffer is full: the datagram is kept and
+# tried again after this many seconds
+BLOCKED = frozenset((errno.EAGAIN, errno.EWOULDBLOCK, errno.ENOBUFS))
+BLOCKED_RETRY = 0.005
+# A lane that ran out of tokens is drained again no sooner than this, so a
+# bucket a rounding error short of a token does not spin the clock
+PACE_INTERVAL = 0.001
+# Lanes not written to for this many seconds are let go once there are many
+LANE_TIMEOUT = 30.0
+
+
+class Lane(object):
+    """
+    The datagrams waiting to go to one peer, a queue per priority class, and
+    the bucket that paces them.
+    """
+    __slots__ = ('bucket', 'queues', 'queued', 'call')
+
+    def __init__(self, rate, burst, clock):
+        self.bucket = TokenBucket(rate, burst, clock)
+        self.queues = tuple(deque() for _ in QUEUE_LIMITS)
+        self.queued = 0
+        self.call = None
+
+    def idle(self, now):
+        """
+        Whether nothing waits and nothing was written for LANE_TIMEOUT
+        seconds, by when the bucket is full again.
+        """
+        return not self.queued and now - self.bucket.updated > LANE_TIMEOUT
+
+
+class Outbound(object):
+    """
+    The scheduler every datagram a peer sends goes through. Each peer it
+    sends to gets a token bucket of 'rate' datagrams per second in bursts of
+    'burst'; while there are tokens and nothing waits, a datagram is written
+    at once. Otherwise it waits in the queue of its priority class and the
+    lane is drained on the clock, the most urgent class first, as tokens come
+    back. A full queue drops its oldest datagram, and a socket whose buffer
+    is full holds the lane back for a moment rather than losing it.
+
+    Producers of traffic that can wait, such as retransmissions and
+    anti-entropy, ask 'congested' first and skip peers with a backlog.
+
+    Datagrams are counted in 'metrics' when they are written, and the ones
+    dropped or refused by the socket under their message type. 'transmit'
+    is called with (data, addr) to write one.
+    """
+    def __init__(self, transmit, clock, metrics, rate=SEND_RATE, burst=SEND_BURST, limits=QUEUE_LIMITS):
+        self.transmit = transmit
+        self.clock = clock
+        self.metrics = metrics
+        self.rate = rate
+        self.burst = burst
+        self.limits = limits
+        self.lanes = {}
+        self.prune_at = 1024
+        self.deferred = 0
+        self.dropped = [0] * len(limits)
+        self.errors = 0
+        self.blocked = 0
+
+    def send(self, data, addr, msgtype):
+        """
+        Write a datagram to a peer now if its lane allows it, and queue it
+        otherwise.
+        """
+        lane = self.lanes.get(addr)
+        if lane is None:
+            if len(self.lanes) >= self.prune_at:
+                self.prune()
+            lane = self.lanes[addr] = Lane(self.rate, self.burst, self.clock)
+        if not lane.queued:
+            # TokenBucket.take, inlined as nearly every datagram comes by here
+            bucket = lane.bucket
+            now = self.clock.seconds()
+            tokens = bucket.tokens + (now - bucket.updated) * bucket.rate
+            bucket.updated = now
+            if tokens >= 1:
+                bucket.tokens = (tokens if tokens < bucket.burst else bucket.burst) - 1
+                try:
+                    self.transmit(data, addr)
+                except Exception as e:
+                    if not self.failed(e, addr, msgtype):
+                        self.requeue(lane, addr, data, msgtype)
+                    return
+                self.metrics.count(OUT, addr, msgtype, len(data))
+                return
+            bucket.tokens = tokens
+        priority = PRIORITIES.get(msgtype, BULK)
+        queue = lane.queues[priority]
+        if len(queue) >= self.limits[priority]:
+            self.drop(queue.popleft()[1], priority)
+        else:
+            lane.queued += 1
+        queue.append((data, msgtype))
+        self.deferred += 1
+        if lane.call is None:
+            lane.call = self.clock.callLater(max(lane.bucket.wait(), PACE_INTERVAL), self.drain, addr)
+
+    def write(self, data, addr, msgtype):
+        """
+        Hand a datagram to the transport. Returns False if the socket's
+        buffer is full and it should be tried again.
+        """
+        try:
+            self.transmit(data, addr)
+        except Exception as e:
+            return self.failed(e, addr, msgtype)
+        self.metrics.count(OUT, addr, msgtype, len(data))
+        return True
+
+    def failed(self, e, addr, msgtype):
+        """
+        Count a datagram the transport raised 'e' for. Returns False if the
+        socket's buffer is full and it should be tried again, True if it is
+        lost.
+        """
+        if isinstance(e, OSError) and e.errno in BLOCKED:
+            self.blocked += 1
+            return False
+        self.errors += 1
+        self.metrics.count_loss(SEND_ERRORS, msgtype)
+        log.debug("Could not send %s to %s: %r", msgtype, addr, e)
+        return True
+
+    def requeue(self, lane, addr, data, msgtype):
+        """
+        Put a datagram the socket refused back at the head of its queue and
+        try the lane again shortly.
+        """
+        lane.queues[PRIORITIES.get(msgtype, BULK)].appendleft((data, msgtype))
+        lane.queued += 1
+        if lane.call is None:
+            lane.call = self.clock.callLater(BLOCKED_RETRY, self.drain, addr)
+
+    def drain(self, addr):
+        """
+        Write the datagrams waiting for a peer that its bucket allows, most
+        urgent first, and come back when the next token is due.
+        """
+        lane = self.lanes.get(addr)
+        if lane is None:
+            return
+        lane.call = None
+        queues = lane.queues
+        while lane.queued and lane.bucket.take():
+            for queue in queues:
+                if queue:
+                    break
+            data, msgtype = queue.popleft()
+            lane.queued -= 1
+            if not self.write(data, addr, msgtype):
+                self.requeue(lane, addr, data, msgtype)
+                return
+        if lane.queued:
+            lane.call = self.clock.callLater(max(lane.bucket.wait(), PACE_INTERVAL), self.drain, addr)
+
+    def drop(self, msgtype, priority):
+        self.dropped[priority] += 1
+        self.metrics.count_loss(DROPPED, msgtype)
+
+    def congested(self, addr):
+        """
+        Whether datagrams are waiting to go to a peer.
+        """
+        lane = self.lanes.get(addr)
+        return lane is not None and lane.queued > 0
+
+    def flush(self):
+        """
+        Write everything waiting, paced or not, e.g. before the socket closes.
+        """
+        for addr, lane in list(self.lanes.items()):
+            if lane.call is not None and lane.call.active():
+                lane.call.cancel()
+            lane.call = None
+            for queue in lane.queues:
+                while queue:
+                    data, msgtype = queue.popleft()
+                    self.write(data, addr, msgtype)
+            lane.queued = 0
+
+    def forget(self, addr):
+        """
+        Drop the lane to a peer that is gone, and what still waits in it.
+        """
+        lane = self.lanes.pop(addr, None)
+        if lane is None:
+            return
+        if lane.call is not None and lane.call.active():
+            lane.call.cancel()
+        for priority, queue in enumerate(lane.queues):
+            for _, msgtype in queue:
+                self.drop(msgtype, priority)
+
+    def prune(self):
+        """
+        Let go of the lanes that are idle, so peers written to once, such as
+        ones said hello to that never answered, do not pile up.
+        """
+        now = self.clock.seconds()
+        self.lanes = {addr: lane for addr, lane in self.lanes.items() if not lane.idle(now)}
+        self.prune_at = max(1024, 2 * len(self.lanes))
+
+    def stats(self):
+        """
+        The datagrams that had to wait, are waiting, were dropped per class
+        and could not be sent.
+        """
+        queued = [0] * len(self.limits)
+        for lane in self.lanes.values():
+            for priority, queue in enumerate(lane.queues):
+                queued[priority] += len(queue)
+        return {
+            'deferred': self.deferred,
+            'queued': dict(zip(PRIORITY_NAMES, queued)),
+            'dropped': dict(zip(PRIORITY_NAMES, self.dropped)),
+            'send_errors': self.errors,
+            'blocked': self.blocked,
+        }
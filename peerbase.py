@@ -0,0 +1,740 @@
+import json
+import logging
+from random import randint
+import netifaces
+from collections import deque
+import protocol
+from protocol import Message
+from reliable import ReliableChannel, RttEstimator, FEATURE as RELIABLE
+from membership import Membership, FEATURE as SWIM
+from introduction import TokenBucket, View, pages, FEATURE as INTRO, PAGE_SIZE
+from metrics import Metrics, IN, DROPPED
+from outbound import Outbound, SEND_RATE, SEND_BURST
+from clock import LoopingCall
+from sessions import Sessions, FEATURE as SESSIONS, SCOPED
+
+log = logging.getLogger(__name__)
+
+# Optional protocol features this peer advertises in its hello messages
+FEATURES = [protocol.FEATURE, SWIM, INTRO, SESSIONS]
+
+# How long acks are held back so that one ack covers a burst of messages
+ACK_DELAY = 0.01
+RETRANSMIT_INTERVAL = 0.05
+
+# A peer is not sent a second hello within this many seconds
+HELLO_INTERVAL = 1.0
+# Peers that stopped answering, or never did, are said hello to again for
+# this long, ever less often down to once every RECALL_INTERVAL seconds, in
+# case they were only cut off from us or the hellos were lost
+RECALL_INTERVAL = 10.0
+RECALL_TIMEOUT = 600.0
+# Calls held for a peer until its hello arrives, at most, such as the
+# reliable messages sent to it before we know whether it acks them
+AWAITING_LIMIT = 256
+
+
+class PeerBase(object):
+    """
+    The message logic of a peer, shared by the transport backends: decoding,
+    dispatch to the handler registry, hellos, pings, membership and reliable
+    delivery. A backend feeds it every datagram through datagramReceived,
+    sets 'transport' to an object whose write(data, addr) sends one and
+    stopListening() closes the socket, and passes the clock the peer runs on.
+    Nothing here imports Twisted.
+    """
+    def __init__(self, reliable=False, probe_interval=1.0, probe_timeout=0.5, timeout=10,
+                 hello_rate=50, send_rate=SEND_RATE, send_burst=SEND_BURST, addr=None, port=None, clock=None, timer=None):
+        """
+        Initialize the client with the given address and port for the discovery server. If no address and port are given, the client will not connect to a discovery server.
+
+        With 'reliable' set, messages sent with reliable=True to peers that
+        support it are sequenced, acked and retransmitted until they arrive,
+        and are handed to the handlers in the order they were sent. Those
+        sent to a peer before its hello told us whether it supports it wait
+        in 'awaiting' until the hello comes.
+
+        Peers that support SWIM are watched by the membership protocol, which
+        probes one peer every 'probe_interval' seconds and waits
+        'probe_timeout' seconds for its ack before probing it indirectly.
+        Other peers are pinged every second and dropped after 'timeout'
+        seconds without a pong. Peers dropped this way are kept in 'lost' and
+        said hello to again, now and then and as soon as anything comes from
+        them, so that peers on both sides of a network partition find each
+        other again once it heals. So are peers we said hello to that have
+        not answered yet, such as the one we join through, as either hello
+        can be lost.
+
+        Hellos to peers learned about from others go out at no more than
+        'hello_rate' per second. 'addr' and 'port' default to the first
+        network interface and a random port. 'clock' schedules every timer
+        and 'timer', which defaults to the clock's seconds, stamps pings.
+
+        Every datagram goes out through the 'outbound' scheduler, which
+        sends no more than 'send_rate' per second, in bursts of 'send_burst',
+        to any one peer and lets moves overtake pings and bulk state when it
+        has to hold some back.
+
+        Every message sent and received is counted in 'metrics', per peer and
+        message type, along with the round-trip time of every ping and the
+        messages dropped or not sent.
+
+        A profiling.Profiler installed on the peer sets 'profiler' and times
+        every message dispatched; it is None otherwise.
+
+        Once the peer is in a game session, game messages are handed to the
+        session they are for through 'sessions' rather than to the handler
+        registry.
+        """
+        self.peers = set()
+        self.peer_features = {}
+        self.aliases = {}
+        self.reliable = reliable
+        self.features = FEATURES + ([RELIABLE] if reliable else [])
+        self.channels = {}
+        self.rtt = {}
+        self.pending_acks = {}
+        self.sessions = Sessions()
+        self.handlers = {
+            "hello": self.handle_hello,
+            "bye": self.handle_bye,
+            "ping": self.handle_ping,
+            "pong": self.handle_pong,
+            "ack": self.handle_ack,
+            "ping_req": self.handle_ping_req,
+            "peers": self.handle_peers,
+        }
+        if addr is None:
+            addr = next((netifaces.ifaddresses(interface)[netifaces.AF_INET][0]['addr'] for interface in netifaces.interfaces()[1:] if netifaces.AF_INET in netifaces.ifaddresses(interface)), None)
+        self.addr = addr
+        self.port = port if port is not None else randint(49152, 65535)
+        self.clock = clock
+        self.timer = timer if timer is not None else clock.seconds
+        self.transport = None
+        self.timeout = timeout
+        self.metrics = Metrics(self.clock)
+        self.outbound = Outbound(self.transmit, self.clock, self.metrics, rate=send_rate, burst=send_burst)
+        self.membership = Membership((self.addr, self.port), self.send_message, clock=self.clock, timer=self.timer, period=probe_interval,
+                                     ping_timeout=probe_timeout, on_join=self.queue_hello, on_leave=self.member_left)
+        self.view = View()
+        self.intro_versions = {}
+        self.hello_sent = {}
+        self.hello_queue = deque()
+        self.hello_queued = set()
+        self.hello_call = None
+        self.hello_bucket = TokenBucket(hello_rate, hello_rate, self.clock)
+        self.lc_ping = LoopingCall(self.send_ping)
+        self.lc_probe = LoopingCall(self.membership.tick)
+        self.lc_retransmit = LoopingCall(self.retransmit)
+        for lc in (self.lc_ping, self.lc_probe, self.lc_retransmit):
+            lc.clock = self.clock
+        self.last_pings = {}
+        self.lost = {}
+        self.joining = set()
+        self.awaiting = {}
+        self.profiler = None
+
+    def datagramReceived(self, data, addr):
+        """
+        Method called when a datagram is received. Every message in it is
+        decoded once and handed to the handler for its type.
+        """
+        messages = self.decode_datagram(data, addr)
+        for message in messages:
+            self.metrics.count(IN, message.sender, message.msgtype, len(data) // len(messages))
+            if self.lost and message.sender in self.lost:
+                # Whatever it sent is dropped, but the peer is back
+                self.queue_hello(message.sender)
+            if log.isEnabledFor(logging.DEBUG):
+                log.debug("%s from %s: %s", message.msgtype, message.sender, message.fields)
+            seq = message.fields.pop('seq', None)
+            if seq is None:
+                self.dispatch(message)
+            else:
+                epoch = message.fields.pop('epoch', None)
+                base = message.fields.pop('base', None)
+                for message in self.receive_sequenced(seq, message, epoch, base):
+                    self.dispatch(message)
+
+    def dispatch(self, message):
+        """
+        Method to hand a message to the handler for its type.
+        """
+        handler = self.find_handler(message)
+        if handler is None:
+            return
+        try:
+            if self.profiler is None:
+                handler(message)
+            else:
+                self.profiler.handle(handler, message)
+        except (KeyError, TypeError, ValueError) as e:
+            log.warning("Invalid %s message from %s: %r", message.msgtype, message.sender, e)
+
+    def find_handler(self, message):
+        """
+        Method to find the handler for a message: its session's for game
+        messages, the registered one for the others and for every message
+        while the peer is in no session and waits for no game.
+        """
+        if message.msgtype in SCOPED and (self.sessions.local or self.sessions.waiting):
+            return self.sessions.route(message)
+        return self.handlers.get(message.msgtype)
+
+    def decode_datagram(self, data, addr):
+        """
+        Method to decode a datagram, binary or JSON lines, into messages.
+        """
+        if not data:
+            return []
+
+        if protocol.is_binary(data):
+            try:
+                msgtype, fields = protocol.decode(data)
+            except protocol.ProtocolError as e:
+                log.warning("Dropping datagram from %s: %s", addr, e)
+                return []
+            # Binary messages leave out the sender, so look up who is behind the address
+            return [Message(msgtype, self.aliases.get(addr, addr), fields)]
+
+        messages = []
+        try:
+            for line in data.decode('utf-8').splitlines():
+                line = line.strip()
+                if not line:
+                    continue
+                fields = json.loads(line)
+                msgtype = fields.pop('msgtype')
+                if 'addr' in fields and 'port' in fields:
+                    sender = (fields['addr'], int(fields['port']))
+                    self.alias(addr, sender)
+                else:
+                    sender = self.aliases.get(addr, addr)
+                messages.append(Message(msgtype, sender, fields))
+        except ValueError:
+            log.warning("Dropping undecodable datagram from %s: %r", addr, data)
+        except (KeyError, TypeError, AttributeError):
+            log.warning("Invalid message type received from %s.", addr)
+        return messages
+
+    def alias(self, addr, sender):
+        """
+        Method to remember who is behind an address, for the messages that
+        leave the sender out. Only addresses that differ from the sender they
+        stand for are kept.
+        """
+        if sender == addr:
+            self.aliases.pop(addr, None)
+        else:
+            self.aliases[addr] = sender
+
+    def handle_hello(self, hello):
+        """
+        Method to handle a hello message received from a peer.
+        """
+        peer = hello.sender
+        self.lost.pop(peer, None)
+        self.joining.discard(peer)
+        self.peer_features[peer] = set(hello.get('features', ()))
+        if SESSIONS in self.peer_features[peer]:
+            shared = self.sessions.update(peer, hello.get('sessions', ()))
+        else:
+            self.sessions.legacy.add(peer)
+            shared = False
+        if SWIM in self.peer_features[peer]:
+            self.membership.add(peer, hello.get('incarnation', 0))
+        recent = self.clock.seconds() - self.hello_sent.get(peer, float('-inf')) < HELLO_INTERVAL
+        if peer not in self.peers:
+            self.peers.add(peer)
+            self.view.add(peer)
+            # Peers that do not page introductions get a capped list inline
+            legacy = INTRO not in self.peer_features[peer]
+            if legacy or not recent:
+                self.send_hello(peer, include_peers=legacy)
+        elif not recent:
+            # A peer we know that says hello again may have forgotten us
+            self.send_hello(peer)
+        # A peer that just joined one of our sessions learns that we are in it
+        if shared and self.sessions.stale(peer):
+            self.send_hello(peer)
+        if 'join' in hello:
+            self.introduce(peer, hello['join'])
+        if 'peers' in hello:
+            for peer in hello['peers']:
+                self.queue_hello((peer['addr'], peer['port']))
+        self.greeted(hello.sender)
+
+    def greeted(self, addr):
+        """
+        Method to run the calls that waited for a peer's hello, now that its
+        features are known.
+        """
+        for callback in self.awaiting.pop(addr, ()):
+            callback(addr)
+
+    def after_hello(self, addr, callback):
+        """
+        Method to call 'callback' with a peer's address once we know its
+        features: right away if its hello has come, else once it does. Until
+        then the peer is said hello to now and then, like a lost one. Returns
+        False if the call was dropped, as AWAITING_LIMIT calls already wait.
+        """
+        addr = tuple(addr)
+        if addr in self.peer_features:
+            callback(addr)
+            return True
+        awaiting = self.awaiting.setdefault(addr, [])
+        if len(awaiting) >= AWAITING_LIMIT:
+            return False
+        awaiting.append(callback)
+        self.queue_hello(addr)
+        return True
+
+    def send_hello(self, addr, include_peers=False, join=None):
+        """
+        Method to send a hello message to a peer. 'join' asks the peer to
+        introduce us to the peers it has added since that view version.
+        """
+        if addr == (self.addr, self.port):
+            return
+
+        hello = {
+            'addr': self.addr,
+            'port': self.port,
+            'msgtype': 'hello',
+            'features': self.features,
+            'incarnation': self.membership.incarnation,
+        }
+        if self.sessions.local:
+            # No list means no sessions
+            hello['sessions'] = sorted(self.sessions.local)
+
+        if include_peers:
+            peers = []
+            for peer in self.view.since(0, exclude=addr, limit=PAGE_SIZE):
+                peers.append({'addr': peer[0], 'port': peer[1]})
+            hello['peers'] = peers
+
+        if join is not None:
+            hello['join'] = join
+
+        self.hello_sent[addr] = self.clock.seconds()
+        self.sessions.told[addr] = frozenset(self.sessions.local)
+
+        hello = json.dumps(hello)
+        hello = hello.encode('utf-8')
+        self.write(hello, addr, 'hello')
+
+    def announce_sessions(self):
+        """
+        Method to tell the peers we know that the sessions we are in
+        changed. Peers met later learn them from the usual hello.
+        """
+        for peer in list(self.peers):
+            if SESSIONS in self.peer_features.get(peer, ()) and self.sessions.stale(peer):
+                self.send_hello(peer)
+
+    def join(self, addr, on_hello=None):
+        """
+        Method to join a game through a peer, asking it to introduce us to
+        the peers it knows. The hello is sent again until the peer's comes
+        back, and 'on_hello' is then called with its address.
+        """
+        addr = tuple(addr)
+        self.joining.add(addr)
+        self.lost.setdefault(addr, self.clock.seconds())
+        self.send_hello(addr, join=self.intro_versions.get(addr, 0))
+        if on_hello is not None:
+            self.after_hello(addr, on_hello)
+
+    def introduce(self, addr, since):
+        """
+        Method to tell a joining peer about the peers added to our view since
+        the version it already has, a page per message.
+        """
+        introduced = self.view.since(since, exclude=addr)
+        chunks = pages(introduced)
+        for page, chunk in enumerate(chunks):
+            self.send_message({
+                'msgtype': 'peers',
+                'version': self.view.version,
+                'page': page,
+                'pages': len(chunks),
+                'peers': [list(peer) for peer in chunk],
+            }, addr, reliable=True)
+
+    def handle_peers(self, message):
+        """
+        Method to handle a page of peers introduced to us.
+        """
+        self.intro_versions[message.sender] = max(message['version'], self.intro_versions.get(message.sender, 0))
+        for addr, port in message['peers']:
+            self.queue_hello((addr, port))
+
+    def queue_hello(self, addr):
+        """
+        Method to say hello to a peer we were told about, unless we know it,
+        already plan to or said hello recently. Hellos are paced by a token
+        bucket so a large introduction does not go out in one burst. Until
+        the peer answers, recall says hello to it again.
+        """
+        addr = tuple(addr)
+        if addr == (self.addr, self.port) or addr in self.peers or addr in self.hello_queued:
+            return
+        # Said hello to again until it answers
+        self.lost.setdefault(addr, self.clock.seconds())
+        if self.clock.seconds() - self.hello_sent.get(addr, float('-inf')) < HELLO_INTERVAL:
+            return
+        self.hello_queue.append(addr)
+        self.hello_queued.add(addr)
+        if self.hello_call is None:
+            self.drain_hellos()
+
+    def drain_hellos(self):
+        """
+        Method to send the queued hellos the rate limit allows.
+        """
+        self.hello_call = None
+        while self.hello_queue and self.hello_bucket.take():
+            addr = self.hello_queue.popleft()
+            self.hello_queued.discard(addr)
+            if addr not in self.peers:
+                self.send_hello(addr)
+        if self.hello_queue:
+            self.hello_call = self.clock.callLater(self.hello_bucket.wait(), self.drain_hellos)
+        if len(self.hello_sent) > 4 * len(self.peers) + 1024:
+            now = self.clock.seconds()
+            self.hello_sent = {addr: at for addr, at in self.hello_sent.items() if now - at < HELLO_INTERVAL or addr in self.lost}
+
+    def send_bye(self, addr):
+        """
+        Method to send a bye message to a peer.
+        """
+        self.send_message({'msgtype': 'bye'}, addr)
+    
+    def handle_bye(self, bye):
+        """
+        Method to handle a bye message from a peer.
+        """
+        self.forget(bye.sender)
+
+    def send_ping(self):
+        """
+        Method to send a ping message to the online peers that do not take part
+        in the membership protocol.
+        """
+        ping = {'msgtype': 'ping', 'timestamp': self.timer()}
+        for peer in self.peers.copy():
+            if SWIM in self.peer_features.get(peer, ()):
+                continue
+            self.send_message(ping, peer)
+            if peer in self.last_pings and self.clock.seconds() - self.last_pings[peer] > self.timeout:
+                log.info("No response from %s. It appears to have gone offline.", peer)
+                self.forget(peer)
+                self.lost[peer] = self.clock.seconds()
+        if self.lost:
+            self.recall()
+        # Counters of senders that never became peers are not dropped by
+        # forget, so they are let go of once they pile up
+        if len(self.metrics.peers) > 2 * len(self.peers) + 1024:
+            self.metrics.prune(self.peers)
+    
+    def recall(self):
+        """
+        Method to say hello again to the peers lost within RECALL_TIMEOUT,
+        and let go of the older ones. The wait between two hellos doubles
+        from HELLO_INTERVAL up to RECALL_INTERVAL seconds. Peers we join
+        through are asked to introduce us again.
+        """
+        now = self.clock.seconds()
+        for addr, since in list(self.lost.items()):
+            sent = self.hello_sent.get(addr, since)
+            if now - since > RECALL_TIMEOUT:
+                del self.lost[addr]
+                self.joining.discard(addr)
+                self.awaiting.pop(addr, None)
+            elif now - sent >= min(RECALL_INTERVAL, max(HELLO_INTERVAL, sent - since)):
+                if addr in self.joining:
+                    self.join(addr)
+                else:
+                    self.queue_hello(addr)
+
+    def handle_ping(self, ping):
+        """
+        Method to handle a ping message from a peer.
+        """
+        if 'probe' in ping:
+            self.membership.handle_ping(ping)
+        else:
+            self.send_pong(ping.sender, self.timer(), ping['timestamp'])
+
+    def handle_ping_req(self, req):
+        """
+        Method to handle a request to probe a peer on behalf of another one.
+        """
+        self.membership.handle_ping_req(req)
+    
+    def send_pong(self, addr, pong_timestamp, echo):
+        """
+        Method to send a pong message to a peer, echoing the timestamp of the
+        ping so the peer can measure the round trip on its own clock.
+        """
+        self.send_message({'msgtype': 'pong', 'timestamp': pong_timestamp, 'echo': echo}, addr)
+
+    def handle_pong(self, pong):
+        """
+        Method to handle a pong message from a peer.
+        """
+        self.last_pings[pong.sender] = self.clock.seconds()
+        # Acks of indirect probes echo the time of another peer's ping
+        direct = 'probe' not in pong or self.membership.handle_pong(pong)
+        if 'echo' in pong and direct:
+            rtt = self.timer() - pong['echo']
+            self.rtt_estimator(pong.sender).sample(rtt)
+            self.metrics.record_rtt(pong.sender, rtt)
+
+    def encode_message(self, message, addr):
+        """
+        Method to encode a message for a peer, in binary if the peer has said
+        it understands it and as JSON otherwise. The session id is left out
+        for peers that do not know about sessions.
+        """
+        features = self.peer_features.get(addr, ())
+        if 'session' in message and SESSIONS not in features:
+            message = {key: value for key, value in message.items() if key != 'session'}
+        if protocol.FEATURE in features and protocol.can_encode(message['msgtype']):
+            try:
+                return protocol.encode(message)
+            except protocol.ProtocolError:
+                pass
+        return json.dumps(dict(message, addr=self.addr, port=self.port), default=protocol.jsonable).encode('utf-8')
+
+    def send_message(self, message, addr, reliable=False):
+        """
+        Method to send a message to a peer. Reliable messages are sequenced
+        and kept for retransmission if the peer supports it. Whether it does
+        is only known from its hello, so until that comes they are held back.
+        """
+        if reliable and self.reliable and addr not in self.peer_features:
+            if not self.after_hello(addr, lambda addr: self.send_message(message, addr, reliable=True)):
+                self.metrics.count_loss(DROPPED, message['msgtype'])
+            return
+        if reliable and self.is_reliable(addr):
+            send = self.channel(addr).send(message, self.clock.seconds())
+            if send is not None:
+                self.write_sequenced(send, addr)
+                return
+        self.write(self.encode_message(message, addr), addr, message['msgtype'])
+
+    def broadcast(self, message, reliable=False, peers=None):
+        """
+        Method to send a message to all online peers, or the given ones,
+        encoding it at most once per wire format.
+        """
+        encoded = {}
+        for peer in list(self.peers if peers is None else peers):
+            if reliable and self.is_reliable(peer):
+                self.send_message(message, peer, reliable=True)
+                continue
+            features = self.peer_features.get(peer, ())
+            wire = (protocol.FEATURE in features, SESSIONS in features)
+            if wire not in encoded:
+                encoded[wire] = self.encode_message(message, peer)
+            self.write(encoded[wire], peer, message['msgtype'])
+
+    def write(self, data, addr, msgtype=None):
+        """
+        Method to send a datagram through the outbound scheduler, which
+        paces and prioritizes it by the type of the message it carries.
+        """
+        self.outbound.send(data, addr, msgtype or 'unknown')
+
+    def transmit(self, data, addr):
+        """
+        Method to write a datagram to the transport right away.
+        """
+        self.transport.write(data, addr)
+
+    def congested(self, addr):
+        """
+        Method to check whether datagrams are waiting to go to a peer, so
+        traffic that can wait is better held back.
+        """
+        return self.outbound.congested(addr)
+
+    def outbound_stats(self):
+        """
+        Method to sum up the outbound scheduler: datagrams held back, still
+        waiting and dropped per priority class, and the ones the socket
+        would not send.
+        """
+        return self.outbound.stats()
+
+    def write_sequenced(self, send, addr):
+        """
+        Method to write (seq, message) pairs from a reliable channel, stamped
+        with its epoch and oldest unacked sequence number.
+        """
+        channel = self.channels[addr]
+        for seq, message in send:
+            data = self.encode_message(dict(message, seq=seq, epoch=channel.epoch, base=channel.base(seq)), addr)
+            if seq in channel.unacked:
+                channel.unacked[seq].size = len(data)
+            self.write(data, addr, message['msgtype'])
+
+    def is_reliable(self, addr):
+        """
+        Method to check whether reliable delivery is used towards a peer.
+        """
+        return self.reliable and RELIABLE in self.peer_features.get(addr, ())
+
+    def rtt_estimator(self, addr):
+        """
+        Method to get the round-trip time estimate for a peer.
+        """
+        if addr not in self.rtt:
+            self.rtt[addr] = RttEstimator()
+        return self.rtt[addr]
+
+    def channel(self, addr):
+        """
+        Method to get the reliable channel to a peer.
+        """
+        if addr not in self.channels:
+            self.channels[addr] = ReliableChannel(self.rtt_estimator(addr))
+        return self.channels[addr]
+
+    def receive_sequenced(self, seq, message, epoch=None, base=None):
+        """
+        Method to take in a sequenced message of the sender's channel
+        'epoch'. Returns the messages that are now ready to be handled, in
+        order, and schedules an ack.
+        """
+        if not self.reliable:
+            return [message]
+        ready = self.channel(message.sender).on_receive(seq, message, epoch, base)
+        if message.sender not in self.pending_acks:
+            self.pending_acks[message.sender] = self.clock.callLater(ACK_DELAY, self.send_ack, message.sender)
+        return ready
+
+    def send_ack(self, addr):
+        """
+        Method to acknowledge everything received from a peer so far.
+        """
+        self.pending_acks.pop(addr, None)
+        channel = self.channels.get(addr)
+        if channel is not None:
+            self.send_message(dict(channel.ack_fields(), msgtype='ack'), addr)
+
+    def handle_ack(self, ack):
+        """
+        Method to handle an ack from a peer.
+        """
+        channel = self.channels.get(ack.sender)
+        if channel is None:
+            return
+        self.write_sequenced(channel.on_ack(ack['ack'], ack['sack'], ack['latest'], self.clock.seconds(), ack.get('epoch')), ack.sender)
+
+    def retransmit(self):
+        """
+        Method to resend the reliable messages whose timeout has run out,
+        except to peers whose earlier datagrams are still waiting to go out.
+        """
+        now = self.clock.seconds()
+        for peer, channel in list(self.channels.items()):
+            if channel.unacked and not self.outbound.congested(peer):
+                self.write_sequenced(channel.due(now), peer)
+
+    def reliability_stats(self):
+        """
+        Method to sum up the reliable channels: messages sent, retransmitted
+        and delivered, and the bytes the peers have acknowledged.
+        """
+        stats = dict.fromkeys(('sent', 'retransmits', 'overflows', 'delivered', 'duplicates', 'acked_bytes', 'unacked', 'backlog'), 0)
+        for channel in self.channels.values():
+            stats['sent'] += channel.sent
+            stats['retransmits'] += channel.retransmits
+            stats['overflows'] += channel.overflows
+            stats['delivered'] += channel.delivered
+            stats['duplicates'] += channel.duplicates
+            stats['acked_bytes'] += channel.acked_bytes
+            stats['unacked'] += len(channel.unacked)
+            stats['backlog'] += len(channel.backlog)
+        stats['retransmit_rate'] = stats['retransmits'] / stats['sent'] if stats['sent'] else 0
+        return stats
+
+    def member_left(self, addr):
+        """
+        Method called when the membership protocol declares a peer dead.
+        """
+        if addr in self.peers:
+            log.info("%s failed its probes. It appears to have gone offline.", addr)
+        self.forget(addr)
+        self.lost[addr] = self.clock.seconds()
+
+    def forget(self, addr):
+        """
+        Method to drop a peer and everything kept about it, telling the other
+        members it is gone.
+        """
+        self.membership.remove(addr)
+        self.view.remove(addr)
+        self.peers.discard(addr)
+        self.peer_features.pop(addr, None)
+        self.aliases.pop(addr, None)
+        for alias in [alias for alias, sender in self.aliases.items() if sender == addr]:
+            del self.aliases[alias]
+        self.last_pings.pop(addr, None)
+        self.lost.pop(addr, None)
+        self.joining.discard(addr)
+        self.awaiting.pop(addr, None)
+        self.channels.pop(addr, None)
+        self.rtt.pop(addr, None)
+        self.metrics.forget(addr)
+        self.outbound.forget(addr)
+        self.sessions.forget(addr)
+        pending_ack = self.pending_acks.pop(addr, None)
+        if pending_ack is not None and pending_ack.active():
+            pending_ack.cancel()
+
+    def start_loops(self, now=False):
+        """
+        Method to start the periodic tasks on the peer's clock. With 'now'
+        the first ping and probe go out right away.
+        """
+        self.lc_ping.start(1, now=now)
+        self.lc_probe.start(self.membership.period, now=now)
+        if self.reliable:
+            self.lc_retransmit.start(RETRANSMIT_INTERVAL, now=now)
+
+    def stop(self):
+        """
+        Method to stop the client: say goodbye to every peer, stop the
+        periodic tasks and close the socket.
+        """
+        for peer in self.peers:
+            self.send_bye(peer)
+
+        if self.lc_ping.running:
+            self.lc_ping.stop()
+        if self.hello_call is not None and self.hello_call.active():
+            self.hello_call.cancel()
+        if self.lc_probe.running:
+            self.lc_probe.stop()
+        if self.lc_retransmit.running:
+            self.lc_retransmit.stop()
+        if self.transport is not None:
+            self.outbound.flush()
+            self.transport.stopListening()
+    
+    def add_handler(self, command, callback):
+        """
+        Method to add a new command to the client.
+        """
+        self.handlers[command] = callback
+    
+    def remove_handler(self, command):
+        """
+        Method to remove a command from the client.
+        """
+        del self.handlers[command]
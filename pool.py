@@ -0,0 +1,212 @@
+import os
+import struct
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import get_context
+from random import SystemRandom
+
+from game import Game, DIFFICULTIES, DEFAULT_DIFFICULTY, GENERATOR_VERSION, pack_board, unpack_board
+
+CACHE_MAGIC = b"SUDOKUPL"
+CACHE_HEADER = struct.Struct("<8sBB")  # magic, cache format, generator version
+CACHE_FORMAT = 3
+RECORD = struct.Struct("<IB41s41sB")  # seed, clues, solution, board, grade
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "p2p-sudoku", "puzzles.bin")
+
+
+def build_puzzle(seed, clues):
+    """
+    Generate the solution and carved board for a board seed, exactly as
+    Game.generate_board would, and grade the puzzle. Runs in the pool's
+    worker threads or processes.
+    """
+    # generate_board bumps the seed before using it
+    game = Game(seed - 1, clues=clues)
+    game.board = game.generate_board()
+    return pack_board(game.solution), pack_board(game.board), game.grade
+
+
+class PuzzlePool(object):
+    """
+    Keeps a number of ready puzzles per difficulty, generated in the
+    background, so starting a game never has to generate a board on the
+    reactor thread.
+
+    Puzzles are keyed by (seed, clues) and are a pure function of that key,
+    so a puzzle served from the pool is the same board a peer joining with
+    the seed from 'gamedata' generates for itself. Ready puzzles are written
+    to a small binary cache on close and read back on start.
+    """
+    def __init__(self, size=4, levels=None, cache_path=None, workers=1, processes=False):
+        self.size = size
+        self.levels = sorted(set(levels or DIFFICULTIES.values()))
+        self.cache_path = cache_path
+        self.lock = threading.RLock()
+        self.ready = OrderedDict()
+        self.pending = set()
+        self.waiters = {}
+        self.random = SystemRandom()
+        self.closed = False
+        if processes:
+            self.executor = ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn"))
+        else:
+            self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="puzzle-pool")
+        if cache_path:
+            self.load()
+        self.fill()
+
+    def get(self, seed, clues):
+        """
+        Take the puzzle for the given board seed out of the pool. Returns
+        (solution, board, grade) or None if it is not ready, in which case
+        the caller generates it itself.
+        """
+        with self.lock:
+            entry = self.ready.pop((seed, clues), None)
+        if entry is None:
+            return None
+        self.fill()
+        return unpack_board(entry[0]), unpack_board(entry[1]), entry[2]
+
+    def prefetch(self, seed, clues):
+        """
+        Generate the puzzle for a specific board seed in the background, e.g.
+        the next round of the game being played.
+        """
+        with self.lock:
+            if (seed, clues) in self.ready or (seed, clues) in self.pending:
+                return
+            self.submit(seed, clues)
+
+    def when_ready(self, seed, clues, callback):
+        """
+        Call 'callback' once the puzzle for a board seed is in the pool:
+        right away if it is, else from the thread that generated it. It is
+        called if generating failed too, and the caller then generates the
+        puzzle itself.
+        """
+        key = (seed, clues)
+        with self.lock:
+            if key not in self.ready and not self.closed:
+                self.waiters.setdefault(key, []).append(callback)
+                if key not in self.pending:
+                    self.submit(seed, clues)
+                return
+        callback()
+
+    def ready_seed(self, clues):
+        """
+        Return the board seed of a ready puzzle with the given number of
+        clues, or None if there is none.
+        """
+        with self.lock:
+            for seed, level in self.ready:
+                if level == clues:
+                    return seed
+        return None
+
+    def new_game(self, difficulty=DEFAULT_DIFFICULTY, clues=None, **kwargs):
+        """
+        Create a Game whose first board is already in the pool, if possible.
+        """
+        if clues is None:
+            clues = DIFFICULTIES[difficulty]
+        seed = self.ready_seed(clues)
+        if seed is None:
+            seed = self.random.randint(1, 2**31 - 1)
+            self.prefetch(seed, clues)
+        return Game(seed - 1, difficulty=difficulty, clues=clues, pool=self, **kwargs)
+
+    def fill(self):
+        """
+        Top every level up to 'size' ready or pending puzzles.
+        """
+        with self.lock:
+            if self.closed:
+                return
+            counts = dict.fromkeys(self.levels, 0)
+            for _, clues in list(self.ready) + list(self.pending):
+                if clues in counts:
+                    counts[clues] += 1
+            for clues, count in counts.items():
+                for _ in range(self.size - count):
+                    self.submit(self.random.randint(1, 2**31 - 1), clues)
+
+    def submit(self, seed, clues):
+        # Called with the lock held
+        if self.closed:
+            return
+        key = (seed, clues)
+        self.pending.add(key)
+        future = self.executor.submit(build_puzzle, seed, clues)
+        future.add_done_callback(lambda future: self.done(key, future))
+
+    def done(self, key, future):
+        with self.lock:
+            self.pending.discard(key)
+            waiters = self.waiters.pop(key, ())
+            if not future.cancelled() and future.exception() is None:
+                self.ready[key] = future.result()
+                self.trim()
+        for callback in waiters:
+            callback()
+
+    def trim(self):
+        # Called with the lock held. Prefetched rounds may push a level over
+        # its size, in which case the oldest puzzles go first.
+        counts = {}
+        for key in reversed(list(self.ready)):
+            counts[key[1]] = counts.get(key[1], 0) + 1
+            if counts[key[1]] > self.size * 2:
+                del self.ready[key]
+
+    def load(self):
+        """
+        Read ready puzzles from the on-disk cache. Caches written by another
+        version of the generator are ignored, since their boards would not
+        match what peers generate from the same seed.
+        """
+        try:
+            with open(self.cache_path, "rb") as f:
+                data = f.read()
+        except OSError:
+            return
+        if len(data) < CACHE_HEADER.size:
+            return
+        magic, cache_format, generator = CACHE_HEADER.unpack_from(data)
+        if (magic, cache_format, generator) != (CACHE_MAGIC, CACHE_FORMAT, GENERATOR_VERSION):
+            return
+        with self.lock:
+            for offset in range(CACHE_HEADER.size, len(data) - RECORD.size + 1, RECORD.size):
+                seed, clues, solution, board, grade = RECORD.unpack_from(data, offset)
+                self.ready[(seed, clues)] = (solution, board, grade)
+
+    def save(self):
+        """
+        Write the ready puzzles to the on-disk cache.
+        """
+        with self.lock:
+            records = [RECORD.pack(seed, clues, *entry) for (seed, clues), entry in self.ready.items()]
+        directory = os.path.dirname(self.cache_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = self.cache_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(CACHE_HEADER.pack(CACHE_MAGIC, CACHE_FORMAT, GENERATOR_VERSION))
+            f.write(b"".join(records))
+        os.replace(tmp_path, self.cache_path)
+
+    def close(self):
+        """
+        Stop generating puzzles and persist the ready ones.
+        """
+        with self.lock:
+            self.closed = True
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        if self.cache_path:
+            try:
+                self.save()
+            except OSError:
+                pass
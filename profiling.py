@@ -0,0 +1,250 @@
+import cProfile
+import json
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+from collections import Counter
+
+from clock import LoopingCall
+from metrics import Histogram
+
+log = logging.getLogger(__name__)
+
+# How often the reactor lag is measured, in seconds
+LAG_INTERVAL = 0.1
+# Seconds between the stack samples of a sampling capture
+SAMPLE_INTERVAL = 0.005
+# Seconds a capture runs for unless told otherwise
+CAPTURE_SECONDS = 5.0
+
+
+class Timing(object):
+    """
+    Calls of one handler or periodic task, and the time they took.
+    """
+    __slots__ = ('calls', 'total', 'max')
+
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def snapshot(self):
+        return {
+            'calls': self.calls,
+            'total': self.total,
+            'mean': self.total / self.calls if self.calls else 0.0,
+            'max': self.max,
+        }
+
+
+class Profiler(object):
+    """
+    Opt-in instrumentation of where a peer's time goes. Once installed on a
+    peer, every message it dispatches is timed under its message type,
+    whichever handler or session takes it, and every LoopingCall tick in the
+    process under the name of the function it calls; each keeps the number
+    of calls and the total and largest time taken. The lag of the clock, how
+    late a call scheduled every LAG_INTERVAL seconds runs, goes into a
+    histogram. Nothing is timed until install is called.
+
+    'capture' records everything the loop thread does for a few seconds,
+    with cProfile or by sampling its stack, into a file to look at later,
+    so a live process can be profiled without attaching anything to it.
+
+    Calls are timed with perf_counter on the loop thread, which is also
+    where the UI sums up the metrics it shows, timed with 'tick'.
+    """
+    def __init__(self, clock, timer=time.perf_counter):
+        self.clock = clock
+        self.timer = timer
+        self.handlers = {}
+        self.ticks = {}
+        self.lag = Histogram()
+        self.lag_call = None
+        self.lag_due = None
+        self.peers = []
+        self.capturing = None
+
+    def install(self, peer):
+        """
+        Time the messages 'peer' dispatches and every LoopingCall tick, and
+        start measuring the lag of the clock.
+        """
+        peer.profiler = self
+        self.peers.append(peer)
+        LoopingCall.profiler = self
+        if self.lag_call is None:
+            self.lag_due = self.clock.seconds() + LAG_INTERVAL
+            self.lag_call = self.clock.callLater(LAG_INTERVAL, self.measure_lag)
+
+    def uninstall(self):
+        for peer in self.peers:
+            peer.profiler = None
+        self.peers = []
+        if LoopingCall.profiler is self:
+            LoopingCall.profiler = None
+        if self.lag_call is not None and self.lag_call.active():
+            self.lag_call.cancel()
+        self.lag_call = None
+
+    def call(self, timings, name, f, *args, **kwargs):
+        """
+        Call 'f' and time it under 'name' in 'timings', self.handlers or
+        self.ticks. Exceptions are timed too and passed on.
+        """
+        start = self.timer()
+        try:
+            return f(*args, **kwargs)
+        finally:
+            elapsed = self.timer() - start
+            timing = timings.get(name)
+            if timing is None:
+                timing = timings[name] = Timing()
+            timing.calls += 1
+            timing.total += elapsed
+            if elapsed > timing.max:
+                timing.max = elapsed
+
+    def handle(self, handler, message):
+        # Profiler.call for a handler, inlined as it runs for every message
+        timer = self.timer
+        start = timer()
+        try:
+            handler(message)
+        finally:
+            elapsed = timer() - start
+            timing = self.handlers.get(message.msgtype)
+            if timing is None:
+                timing = self.handlers[message.msgtype] = Timing()
+            timing.calls += 1
+            timing.total += elapsed
+            if elapsed > timing.max:
+                timing.max = elapsed
+
+    def tick(self, f, *args, **kwargs):
+        return self.call(self.ticks, getattr(f, '__qualname__', repr(f)), f, *args, **kwargs)
+
+    def measure_lag(self):
+        now = self.clock.seconds()
+        self.lag.record(now - self.lag_due)
+        self.lag_due = now + LAG_INTERVAL
+        self.lag_call = self.clock.callLater(LAG_INTERVAL, self.measure_lag)
+
+    def snapshot(self):
+        """
+        The timings so far as a dict of plain types, in seconds.
+        """
+        return {
+            'time': time.time(),
+            'handlers': {name: timing.snapshot() for name, timing in sorted(self.handlers.items())},
+            'ticks': {name: timing.snapshot() for name, timing in sorted(self.ticks.items())},
+            'lag': self.lag.snapshot(),
+        }
+
+    def report(self):
+        """
+        The timings as a table, the most time taken first.
+        """
+        lines = [f"{'':32} {'calls':>9} {'total ms':>10} {'mean us':>9} {'max ms':>8}"]
+        for title, timings in (("handlers", self.handlers), ("ticks", self.ticks)):
+            lines.append(title)
+            for name, timing in sorted(timings.items(), key=lambda item: -item[1].total):
+                mean = timing.total / timing.calls if timing.calls else 0.0
+                lines.append(f"  {name:30} {timing.calls:9} {timing.total * 1e3:10.1f} {mean * 1e6:9.1f} {timing.max * 1e3:8.2f}")
+        lag = self.lag.snapshot()
+        lines.append(f"lag p50 {lag['p50'] * 1e3:.2f} ms  p99 {lag['p99'] * 1e3:.2f} ms  max {lag['max'] * 1e3:.2f} ms over {lag['count']} samples")
+        return "\n".join(lines)
+
+    def dump(self, path):
+        """
+        Write the snapshot to 'path' as JSON, replacing the file in one go.
+        """
+        tmp = f"{path}.tmp"
+        try:
+            with open(tmp, "w") as f:
+                json.dump(self.snapshot(), f, indent=1, sort_keys=True)
+            os.replace(tmp, path)
+        except OSError as e:
+            log.warning("Could not write profile to %s: %s", path, e)
+
+    def capture(self, path, seconds=CAPTURE_SECONDS, sampling=False):
+        """
+        Profile the thread this is called on, which must be the one the
+        clock runs on, for 'seconds' and write the result to 'path': cProfile
+        statistics for pstats or snakeviz, or with 'sampling' the stacks seen
+        every SAMPLE_INTERVAL seconds in the folded format flame graph tools
+        read. Sampling slows the loop down far less than cProfile. Returns
+        False if a capture is already running.
+        """
+        if self.capturing is not None:
+            log.warning("A profile is already being captured to %s", self.capturing)
+            return False
+        self.capturing = path
+        if sampling:
+            sampler = threading.Thread(target=self.sample, args=(threading.get_ident(), path, seconds),
+                                       name="profile sampler", daemon=True)
+            sampler.start()
+        else:
+            profile = cProfile.Profile()
+            profile.enable()
+            self.clock.callLater(seconds, self.finish_capture, profile, path)
+        log.info("Capturing a profile to %s for %.1f s", path, seconds)
+        return True
+
+    def finish_capture(self, profile, path):
+        profile.disable()
+        try:
+            profile.dump_stats(path)
+        except OSError as e:
+            log.warning("Could not write profile to %s: %s", path, e)
+        self.capturing = None
+        log.info("Profile written to %s", path)
+
+    def sample(self, ident, path, seconds):
+        # Runs on the sampler thread
+        stacks = Counter()
+        end = time.monotonic() + seconds
+        while time.monotonic() < end:
+            frame = sys._current_frames().get(ident)
+            if frame is None:
+                break
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            stacks[";".join(reversed(stack))] += 1
+            del frame
+            time.sleep(SAMPLE_INTERVAL)
+        try:
+            with open(path, "w") as f:
+                for stack, count in stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+        except OSError as e:
+            log.warning("Could not write profile to %s: %s", path, e)
+        self.capturing = None
+        log.info("Profile of %d samples written to %s", sum(stacks.values()), path)
+
+    def on_signals(self, directory, call_in_loop, seconds=CAPTURE_SECONDS):
+        """
+        Capture a profile into 'directory' on SIGUSR1, with cProfile, and on
+        SIGUSR2, by sampling, writing the timings next to it.
+        'call_in_loop' hands a call to the loop thread, like the reactor's
+        callFromThread. Does nothing where these signals do not exist.
+        """
+        if not hasattr(signal, 'SIGUSR1'):
+            return
+
+        def capture(sampling):
+            stamp = time.strftime("%Y%m%d-%H%M%S")
+            name = os.path.join(directory, f"profile-{os.getpid()}-{stamp}")
+            self.dump(name + ".json")
+            self.capture(name + (".folded" if sampling else ".prof"), seconds, sampling)
+
+        os.makedirs(directory, exist_ok=True)
+        signal.signal(signal.SIGUSR1, lambda signum, frame: call_in_loop(capture, False))
+        signal.signal(signal.SIGUSR2, lambda signum, frame: call_in_loop(capture, True))
@@ -0,0 +1,424 @@
+import socket
+import struct
+from board import Board
+from game import DIFFICULTIES, pack_board, unpack_board
+
+# Binary messages start with this byte, which can never start a JSON message.
+# The low nibble is the protocol version.
+VERSION = 2
+MAGIC = 0xB0 | VERSION
+
+# Feature peers advertise in their hello to say they accept binary messages
+FEATURE = f"binary/{VERSION}"
+
+HEADER = struct.Struct(">BB")
+SEQ = struct.Struct(">IHB")  # sequence number, channel epoch, how far behind it the oldest unacked one is
+SESSION = struct.Struct(">I")
+PING = struct.Struct(">d")
+PONG = struct.Struct(">dd")
+ACK = struct.Struct(">IIIH")  # cumulative ack, selective ack bits, latest received, epoch
+MOVE = struct.Struct(">BBI")  # cell, number, Lamport counter
+NODE = struct.Struct(">4sH")
+GAMEDATA = struct.Struct(">IBBB")  # seed, difficulty, clues, grade << 4 | kind
+PUZZLE = struct.Struct(">41s")
+SEED = struct.Struct(">I")
+COUNT = struct.Struct(">H")
+CELL = struct.Struct(">BBIB")  # cell, number, Lamport counter, index into the node table
+VERSION_ENTRY = struct.Struct(">6sI")  # node, counter
+
+DIGEST = struct.Struct(">I9I")  # seed, one hash per row
+REPAIR = struct.Struct(">IH")  # seed, mask of the rows wanted back
+PROBE = struct.Struct(">I")
+UPDATE = struct.Struct(">4sHBI")  # addr, port, state, incarnation
+PING_REQ = struct.Struct(">dI4sH")  # timestamp, probe, target addr, target port
+PEERS = struct.Struct(">IBB")  # view version, page, pages
+ADDR = struct.Struct(">4sH")
+
+# Kinds of gamedata: the whole puzzle, or only the entered cells
+GAMEDATA_PUZZLE = 0
+GAMEDATA_CELLS = 1
+
+# Set on the type byte of messages that carry a sequence number, and of
+# game messages that carry a session id after it
+SEQ_FLAG = 0x80
+SESSION_FLAG = 0x40
+
+DIFFICULTY_NAMES = list(DIFFICULTIES)
+
+
+class ProtocolError(Exception):
+    """
+    Raised when a binary message cannot be decoded.
+    """
+
+
+class Message(object):
+    """
+    A decoded message, as handed to the handlers. 'sender' is the (addr, port)
+    the sending peer is known by and 'fields' holds the rest of the message.
+    """
+    __slots__ = ('msgtype', 'sender', 'fields')
+
+    def __init__(self, msgtype, sender, fields):
+        self.msgtype = msgtype
+        self.sender = sender
+        self.fields = fields
+
+    def __getitem__(self, key):
+        return self.fields[key]
+
+    def __contains__(self, key):
+        return key in self.fields
+
+    def get(self, key, default=None):
+        return self.fields.get(key, default)
+
+    def __repr__(self):
+        return f"Message({self.msgtype!r}, {self.sender!r}, {self.fields!r})"
+
+
+def jsonable(value):
+    """
+    The 'default' of json.dumps for JSON messages: boards go as nine rows.
+    """
+    if isinstance(value, Board):
+        return value.rows()
+    raise TypeError(f"Cannot send {type(value).__name__} as JSON")
+
+
+def encode_empty(message):
+    return b""
+
+
+def decode_empty(body):
+    return {}
+
+
+def encode_updates(updates):
+    return bytes([len(updates)]) + b"".join(
+        UPDATE.pack(socket.inet_aton(addr), port, state, incarnation)
+        for addr, port, state, incarnation in updates
+    )
+
+
+def decode_updates(body):
+    if len(body) != 1 + body[0] * UPDATE.size:
+        raise ValueError("updates length does not match count")
+    return [
+        [socket.inet_ntoa(addr), port, state, incarnation]
+        for addr, port, state, incarnation in UPDATE.iter_unpack(body[1:])
+    ]
+
+
+def encode_probe(message):
+    # Pings and pongs of the membership protocol carry a probe number and
+    # piggybacked membership updates after the timestamps
+    if 'probe' not in message:
+        return b""
+    return PROBE.pack(message['probe']) + encode_updates(message.get('updates', ()))
+
+
+def decode_probe(body, message):
+    if body:
+        message['probe'] = PROBE.unpack_from(body)[0]
+        message['updates'] = decode_updates(body[PROBE.size:])
+    return message
+
+
+def encode_ping(message):
+    return PING.pack(message['timestamp']) + encode_probe(message)
+
+
+def decode_ping(body):
+    return decode_probe(body[PING.size:], {'timestamp': PING.unpack_from(body)[0]})
+
+
+def encode_pong(message):
+    return PONG.pack(message['timestamp'], message.get('echo', 0.0)) + encode_probe(message)
+
+
+def decode_pong(body):
+    if len(body) == PING.size:
+        return {'timestamp': PING.unpack(body)[0]}
+    timestamp, echo = PONG.unpack_from(body)
+    return decode_probe(body[PONG.size:], {'timestamp': timestamp, 'echo': echo})
+
+
+def encode_ping_req(message):
+    addr, port = message['target']
+    return PING_REQ.pack(message['timestamp'], message['probe'], socket.inet_aton(addr), port) + encode_updates(message.get('updates', ()))
+
+
+def decode_ping_req(body):
+    timestamp, probe, addr, port = PING_REQ.unpack_from(body)
+    return {
+        'timestamp': timestamp,
+        'probe': probe,
+        'target': [socket.inet_ntoa(addr), port],
+        'updates': decode_updates(body[PING_REQ.size:]),
+    }
+
+
+def encode_ack(message):
+    return ACK.pack(message['ack'], message['sack'], message['latest'], message['epoch'] or 0)
+
+
+def decode_ack(body):
+    ack, sack, latest, epoch = ACK.unpack(body)
+    return {'ack': ack, 'sack': sack, 'latest': latest, 'epoch': epoch}
+
+
+def pack_node(node):
+    """
+    Pack an "addr:port" node id into 6 bytes.
+    """
+    addr, port = node.rsplit(":", 1)
+    try:
+        return NODE.pack(socket.inet_aton(addr), int(port))
+    except OSError:
+        raise ValueError(f"node {node!r} is not an IPv4 address")
+
+
+def unpack_node(data):
+    addr, port = NODE.unpack(data)
+    return f"{socket.inet_ntoa(addr)}:{port}"
+
+
+def encode_move(message):
+    # The node is left out when it is the sender, which is the common case
+    body = MOVE.pack(message['row'] * 9 + message['col'], message['number'], message.get('ts', 0))
+    if 'node' in message:
+        body += pack_node(message['node'])
+    return body
+
+
+def decode_move(body):
+    cell, number, ts = MOVE.unpack_from(body)
+    move = {'row': cell // 9, 'col': cell % 9, 'number': number, 'ts': ts}
+    if len(body) == MOVE.size + NODE.size:
+        move['node'] = unpack_node(body[MOVE.size:])
+    elif len(body) != MOVE.size:
+        raise ValueError("move has trailing bytes")
+    return move
+
+
+def encode_moves(message):
+    body = bytes([len(message['moves'])]) + b"".join(
+        MOVE.pack(row * 9 + col, number, ts) for row, col, number, ts in message['moves']
+    )
+    if 'node' in message:
+        body += pack_node(message['node'])
+    return body
+
+
+def decode_moves(body):
+    count = body[0]
+    size = 1 + count * MOVE.size
+    if len(body) not in (size, size + NODE.size):
+        raise ValueError("moves length does not match count")
+    moves = []
+    for cell, number, ts in MOVE.iter_unpack(body[1:size]):
+        moves.append([cell // 9, cell % 9, number, ts])
+    message = {'moves': moves}
+    if len(body) > size:
+        message['node'] = unpack_node(body[size:])
+    return message
+
+
+def encode_cells(cells):
+    # A node table followed by the cells, which refer to it by index
+    nodes = list(dict.fromkeys(node for _, _, _, node in cells))
+    index = {node: i for i, node in enumerate(nodes)}
+    return (
+        bytes([len(nodes)]) + b"".join(pack_node(node) for node in nodes)
+        + COUNT.pack(len(cells)) + b"".join(
+            CELL.pack(cell, number, ts, index[node]) for cell, number, ts, node in cells
+        )
+    )
+
+
+def decode_cells(body):
+    offset = 1 + body[0] * NODE.size
+    nodes = [unpack_node(body[i:i + NODE.size]) for i in range(1, offset, NODE.size)]
+    count = COUNT.unpack_from(body, offset)[0]
+    offset += COUNT.size
+    if len(body) != offset + count * CELL.size:
+        raise ValueError("cells length does not match count")
+    return [
+        [cell, number, ts, nodes[node]]
+        for cell, number, ts, node in CELL.iter_unpack(body[offset:])
+    ]
+
+
+def encode_gamedata(message):
+    difficulty = DIFFICULTY_NAMES.index(message['difficulty'])
+    # Grades go from 1, so 0 means none was sent
+    grade = message.get('grade', 0) << 4
+    if 'cells' in message:
+        header = GAMEDATA.pack(message['seed'], difficulty, message['clues'], grade | GAMEDATA_CELLS)
+        return header + encode_cells(message['cells'])
+    header = GAMEDATA.pack(message['seed'], difficulty, message['clues'], grade | GAMEDATA_PUZZLE)
+    return header + PUZZLE.pack(pack_board(message['puzzle']))
+
+
+def decode_gamedata(body):
+    seed, difficulty, clues, kind = GAMEDATA.unpack_from(body)
+    gamedata = {
+        'seed': seed,
+        'difficulty': DIFFICULTY_NAMES[difficulty],
+        'clues': clues,
+    }
+    if kind >> 4:
+        gamedata['grade'] = kind >> 4
+    kind &= 0x0F
+    body = body[GAMEDATA.size:]
+    if kind == GAMEDATA_PUZZLE:
+        gamedata['puzzle'] = unpack_board(PUZZLE.unpack(body)[0])
+    elif kind == GAMEDATA_CELLS:
+        gamedata['cells'] = decode_cells(body)
+    else:
+        raise ValueError(f"unknown gamedata kind {kind}")
+    return gamedata
+
+
+def encode_ask_gamedata(message):
+    # A peer without a game yet sends an empty body
+    if 'seed' not in message:
+        return b""
+    versions = message.get('versions', {})
+    return SEED.pack(message['seed']) + COUNT.pack(len(versions)) + b"".join(
+        VERSION_ENTRY.pack(pack_node(node), counter) for node, counter in versions.items()
+    )
+
+
+def decode_ask_gamedata(body):
+    if not body:
+        return {}
+    seed = SEED.unpack_from(body)[0]
+    count = COUNT.unpack_from(body, SEED.size)[0]
+    offset = SEED.size + COUNT.size
+    if len(body) != offset + count * VERSION_ENTRY.size:
+        raise ValueError("ask_gamedata length does not match count")
+    versions = {
+        unpack_node(node): counter
+        for node, counter in VERSION_ENTRY.iter_unpack(body[offset:])
+    }
+    return {'seed': seed, 'versions': versions}
+
+
+def encode_digest(message):
+    return DIGEST.pack(message['seed'], *message['rows'])
+
+
+def decode_digest(body):
+    seed, *rows = DIGEST.unpack(body)
+    return {'seed': seed, 'rows': rows}
+
+
+def encode_repair(message):
+    return REPAIR.pack(message['seed'], message['want']) + encode_cells(message['cells'])
+
+
+def decode_repair(body):
+    seed, want = REPAIR.unpack_from(body)
+    return {'seed': seed, 'want': want, 'cells': decode_cells(body[REPAIR.size:])}
+
+
+def encode_peers(message):
+    peers = message['peers']
+    return PEERS.pack(message['version'], message['page'], message['pages']) + bytes([len(peers)]) + b"".join(
+        ADDR.pack(socket.inet_aton(addr), port) for addr, port in peers
+    )
+
+
+def decode_peers(body):
+    version, page, pages = PEERS.unpack_from(body)
+    count = body[PEERS.size]
+    offset = PEERS.size + 1
+    if len(body) != offset + count * ADDR.size:
+        raise ValueError("peers length does not match count")
+    peers = [[socket.inet_ntoa(addr), port] for addr, port in ADDR.iter_unpack(body[offset:])]
+    return {'version': version, 'page': page, 'pages': pages, 'peers': peers}
+
+
+# msgtype -> (type byte, encoder, decoder). 'hello' stays JSON, as it is the
+# message peers negotiate the binary protocol with.
+CODECS = {
+    'bye': (1, encode_empty, decode_empty),
+    'ping': (2, encode_ping, decode_ping),
+    'pong': (3, encode_pong, decode_pong),
+    'move': (4, encode_move, decode_move),
+    'gamedata': (5, encode_gamedata, decode_gamedata),
+    'ask_gamedata': (6, encode_ask_gamedata, decode_ask_gamedata),
+    'ack': (7, encode_ack, decode_ack),
+    'moves': (8, encode_moves, decode_moves),
+    'digest': (9, encode_digest, decode_digest),
+    'repair': (10, encode_repair, decode_repair),
+    'ping_req': (11, encode_ping_req, decode_ping_req),
+    'peers': (12, encode_peers, decode_peers),
+}
+
+MSGTYPES = {code: (msgtype, decoder) for msgtype, (code, _, decoder) in CODECS.items()}
+
+
+def is_binary(data):
+    """
+    Check whether a datagram holds a binary message.
+    """
+    return len(data) > 0 and data[0] & 0xF0 == MAGIC & 0xF0
+
+
+def can_encode(msgtype):
+    """
+    Check whether a message type has a binary encoding.
+    """
+    return msgtype in CODECS
+
+
+def encode(message):
+    """
+    Encode a message dict into a binary datagram. The sender's address is
+    left out, as the receiver knows where the datagram came from.
+    """
+    code, encoder, _ = CODECS[message['msgtype']]
+    try:
+        prefix = b""
+        if 'seq' in message:
+            code |= SEQ_FLAG
+            prefix += SEQ.pack(message['seq'], message['epoch'], message['seq'] - message['base'])
+        if 'session' in message:
+            code |= SESSION_FLAG
+            prefix += SESSION.pack(message['session'])
+        return HEADER.pack(MAGIC, code) + prefix + encoder(message)
+    except (struct.error, ValueError, OSError) as e:
+        raise ProtocolError(f"Cannot encode {message['msgtype']} message: {e!r}")
+
+
+def decode(data):
+    """
+    Decode a binary datagram into its message type and a dict of fields,
+    without the sender's address.
+    """
+    try:
+        version, code = HEADER.unpack_from(data)
+        if version != MAGIC:
+            raise ProtocolError(f"Unsupported protocol version {version & 0x0F}.")
+        body = memoryview(data)[HEADER.size:]
+        seq = session = None
+        if code & SEQ_FLAG:
+            seq, epoch, behind = SEQ.unpack_from(body)
+            body = body[SEQ.size:]
+        if code & SESSION_FLAG:
+            session = SESSION.unpack_from(body)[0]
+            body = body[SESSION.size:]
+        msgtype, decoder = MSGTYPES[code & ~(SEQ_FLAG | SESSION_FLAG)]
+        message = decoder(body)
+        if seq is not None:
+            message['seq'] = seq
+            message['epoch'] = epoch
+            message['base'] = seq - behind
+        if session is not None:
+            message['session'] = session
+    except (struct.error, KeyError, IndexError, ValueError, OSError) as e:
+        raise ProtocolError(f"Malformed binary message: {e!r}")
+    return msgtype, message
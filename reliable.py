@@ -0,0 +1,218 @@
+import random
+from collections import OrderedDict, deque
+
+# Feature peers advertise in their hello to say they ack sequenced messages.
+# Version 2 stamps the channel's epoch on sequenced messages and acks.
+FEATURE = "reliable/2"
+
+SACK_BITS = 32
+
+
+class RttEstimator(object):
+    """
+    Smoothed round-trip time and retransmission timeout for one peer, as in
+    RFC 6298. Samples come from pongs and from acks of messages that were
+    only sent once.
+    """
+    def __init__(self, initial_rto=1.0, min_rto=0.2, max_rto=10.0):
+        self.srtt = None
+        self.rttvar = None
+        self.rto = initial_rto
+        self.min_rto = min_rto
+        self.max_rto = max_rto
+
+    def sample(self, rtt):
+        """
+        Feed a round-trip time measurement, in seconds.
+        """
+        if rtt < 0:
+            return
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+        self.rto = min(self.max_rto, max(self.min_rto, self.srtt + 4 * self.rttvar))
+
+
+class Pending(object):
+    """
+    A sequenced message waiting to be acked. A message the peer only
+    acknowledged selectively is 'sacked': it is not resent on the next gap,
+    but it is kept until the cumulative ack covers it, since the peer cannot
+    hand it on before then and may lose it.
+    """
+    __slots__ = ('message', 'sent_at', 'rto', 'retries', 'size', 'sacked')
+
+    def __init__(self, message, sent_at, rto):
+        self.message = message
+        self.sent_at = sent_at
+        self.rto = rto
+        self.retries = 0
+        self.size = 0
+        self.sacked = False
+
+
+class ReliableChannel(object):
+    """
+    Sequencing, acknowledgement and in-order delivery towards one peer.
+
+    Outgoing messages get consecutive sequence numbers and stay in a bounded
+    retransmit queue until acked; once 'window' messages are in flight, new
+    ones wait in a bounded backlog. Incoming sequenced messages are delivered
+    in order, with later ones buffered until the gap is filled. Acks carry the
+    highest in-order sequence number plus a bitmap of the next 32 messages
+    already buffered, so a single loss does not resend everything after it,
+    and the sequence number that triggered the ack, which gives a round-trip
+    sample that is not inflated by waiting for a gap to fill.
+
+    Every channel draws a random 'epoch'. Sequenced messages carry it and
+    the oldest sequence number still unacked, their 'base'; acks echo the
+    epoch they acknowledge. A peer that forgot us and made a new channel
+    sends a new epoch, so our receiving side starts over from its base
+    instead of waiting for sequence numbers that will never come again, and
+    acks of an old epoch are ignored. A peer we forgot keeps its epoch, and
+    our new channel starts at its base.
+    """
+    def __init__(self, rtt, window=256, backlog=4096):
+        if window > 256:
+            raise ValueError("window must be at most 256")
+        self.rtt = rtt
+        # Sent in 16 bits; the window keeps the base within 255 of any seq
+        self.epoch = random.getrandbits(16) or 1
+        self.peer_epoch = None
+        self.window = window
+        self.next_seq = 1
+        self.unacked = OrderedDict()
+        self.backlog = deque()
+        self.max_backlog = backlog
+        self.latest = 0
+        self.expected = 1
+        self.buffer = {}
+        self.sent = 0
+        self.retransmits = 0
+        self.overflows = 0
+        self.delivered = 0
+        self.duplicates = 0
+        self.acked_bytes = 0
+
+    def send(self, message, now):
+        """
+        Queue an outgoing message. Returns the (seq, message) pairs to put on
+        the wire now, which is empty if the message had to wait in the
+        backlog, or None if the backlog is full too, in which case the message
+        can only be sent unsequenced.
+        """
+        if len(self.unacked) < self.window:
+            return [self.stamp(message, now)]
+        if len(self.backlog) < self.max_backlog:
+            self.backlog.append(message)
+            return []
+        self.overflows += 1
+        return None
+
+    def stamp(self, message, now):
+        seq = self.next_seq
+        self.next_seq += 1
+        self.unacked[seq] = Pending(message, now, self.rtt.rto)
+        self.sent += 1
+        return seq, message
+
+    def base(self, seq):
+        """
+        The oldest sequence number still unacked, sent along with 'seq'.
+        """
+        return next(iter(self.unacked), seq)
+
+    def on_ack(self, ack, sack, latest, now, epoch):
+        """
+        Drop everything the peer has acknowledged in order. Returns the (seq,
+        message) pairs to put on the wire now: the first gap, if the peer
+        already holds messages sent after it, and backlogged messages that
+        fit the window. Acks of another epoch than ours are ignored.
+        """
+        if epoch != self.epoch:
+            return []
+        pending = self.unacked.get(latest)
+        if pending is not None and pending.retries == 0:
+            # Karn's algorithm: only messages sent once give a clean sample
+            self.rtt.sample(now - pending.sent_at)
+        while self.unacked:
+            seq = next(iter(self.unacked))
+            if seq > ack:
+                break
+            self.acked_bytes += self.unacked.pop(seq).size
+        for i in range(SACK_BITS):
+            if sack >> i & 1:
+                pending = self.unacked.get(ack + 2 + i)
+                if pending is not None and not pending.sacked:
+                    # Not resent before the gap has had time to fill
+                    pending.sacked = True
+                    pending.sent_at = now
+        send = []
+        pending = self.unacked.get(ack + 1)
+        if sack and pending is not None and not pending.sacked:
+            if now - pending.sent_at >= (self.rtt.srtt or self.rtt.rto):
+                pending.retries += 1
+                pending.sent_at = now
+                self.retransmits += 1
+                send.append((ack + 1, pending.message))
+        while self.backlog and len(self.unacked) < self.window:
+            send.append(self.stamp(self.backlog.popleft(), now))
+        return send
+
+    def on_receive(self, seq, message, epoch=None, base=None):
+        """
+        Take in a sequenced message of the peer's 'epoch', whose oldest
+        unacked message is 'base'. Returns the messages that can now be
+        delivered, in order.
+        """
+        if epoch != self.peer_epoch:
+            # The peer's channel is new to us: whatever came before is gone
+            # and nothing older than its base will be sent again
+            self.peer_epoch = epoch
+            self.expected = seq if base is None else base
+            self.buffer = {}
+        self.latest = seq
+        if seq < self.expected or seq in self.buffer:
+            self.duplicates += 1
+            return []
+        if seq - self.expected >= self.window:
+            return []
+        self.buffer[seq] = message
+        ready = []
+        while self.expected in self.buffer:
+            ready.append(self.buffer.pop(self.expected))
+            self.expected += 1
+        self.delivered += len(ready)
+        return ready
+
+    def ack_fields(self):
+        """
+        The fields of an ack describing what has been received so far.
+        """
+        sack = 0
+        for seq in self.buffer:
+            offset = seq - self.expected - 1
+            if 0 <= offset < SACK_BITS:
+                sack |= 1 << offset
+        return {'ack': self.expected - 1, 'sack': sack, 'latest': self.latest, 'epoch': self.peer_epoch}
+
+    def due(self, now):
+        """
+        Return the pending messages whose timeout has run out, backing off
+        their timeouts. Nothing is ever given up on, since the peer would
+        then wait for the gap forever; a peer that stops answering is dropped
+        along with its channel instead.
+        """
+        due = []
+        for seq, pending in self.unacked.items():
+            if now - pending.sent_at < pending.rto:
+                continue
+            pending.retries += 1
+            pending.sent_at = now
+            pending.rto = min(self.rtt.max_rto, pending.rto * 2)
+            self.retransmits += 1
+            due.append((seq, pending.message))
+        return due
@@ -0,0 +1,625 @@
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import random
+import signal
+import socket
+import struct
+import sys
+import time
+from twisted.internet import reactor
+from twisted.internet.protocol import DatagramProtocol
+
+from antientropy import AntiEntropy
+from batching import FEATURE as BATCHED_MOVES
+from clock import LoopingCall
+from crdt import FEATURE as DELTAS, node_id
+from game import Game, DIFFICULTIES, DEFAULT_DIFFICULTY
+from grader import FEATURE as GRADES
+from outbound import SEND_RATE
+from peerbase import PeerBase
+from pool import PuzzlePool
+from profiling import Profiler, CAPTURE_SECONDS
+import verify
+
+log = logging.getLogger(__name__)
+
+# Datagrams passed between workers: the client's address, then whether the
+# client is handed over along with its features and alias
+LINK = struct.Struct(">4sHB")
+LINK_DATAGRAM = 0
+LINK_HANDOFF = 1
+HANDOFF = struct.Struct(">H")
+# Frames telling the other workers that a room of the sending worker moved
+# from one seed to another, -1 for none
+LINK_SEED = 2
+SEED = struct.Struct(">Hqq")  # worker, old seed, new seed
+
+# Room ids are session ids, which go on the wire in 4 bytes
+MAX_ROOM_ID = 1 << 31
+
+
+class Room(object):
+    """
+    A game hosted by the server and the players in it. The id stays the
+    same for the life of the room, while the seed changes with every round.
+    Until the first round is generated the room is not ready, and the asks
+    for its game data wait in 'asks'.
+    """
+    def __init__(self, room_id, game):
+        self.id = room_id
+        self.game = game
+        self.members = set()
+        self.asks = []
+
+    @property
+    def ready(self):
+        return self.game.puzzle is not None
+
+    @property
+    def seed(self):
+        """
+        The seed players ask the game data of this round for, one below the
+        game's once it is generated, as generate_board bumps it first.
+        """
+        return self.game.seed - 1 if self.ready else self.game.seed
+
+
+class RoomRepair(AntiEntropy):
+    """
+    Answers the digests of the players with the board of their room. The
+    server never starts an exchange itself, as every player already sends it
+    a digest every few seconds.
+    """
+    def __init__(self, relay):
+        AntiEntropy.__init__(self, relay, None, None, interval=0, clock=relay.clock)
+
+    def game_for(self, addr):
+        room = self.peer.room_of.get(addr)
+        return room.game if room is not None else None
+
+    def changed(self, addr):
+        self.peer.room_changed(self.peer.room_of[addr])
+
+    def send(self, message, addr):
+        room = self.peer.room_of.get(addr)
+        if room is not None:
+            message['session'] = room.id
+        self.peer.send_message(message, addr)
+
+
+class Relay(PeerBase, DatagramProtocol):
+    """
+    A headless peer hosting many games at once. Players join it like any
+    other peer and are put in a room: the one of the session they ask from,
+    else the one playing the seed they ask the game data for, or else the
+    newest room with space left. The server holds the
+    authoritative game of every room, merges the moves it gets and passes
+    the ones that changed the board on to the other players in the room.
+    Players are never introduced to each other.
+
+    The server runs as 'workers' processes sharing the UDP port through
+    SO_REUSEPORT. The kernel spreads the players over them by address, but
+    a room lives on the worker with index room id % workers, so a worker
+    hands the players of rooms it does not own to the owner when they ask
+    for the game data and from then on forwards their datagrams to it over
+    a local link. Workers tell each other the seed every room plays, so a
+    player asking for the seed of a later round is handed to the room's
+    worker too. The owner handles them as if they had come straight in
+    and answers from its own socket on the shared port, so to a player the
+    server is one peer.
+
+    Players not heard from for 'idle_timeout' seconds are dropped, and a
+    room goes away with its last player.
+
+    With a 'pool', rooms take their puzzles from it and a new room's
+    puzzle is generated on the pool's thread, so opening a room does not
+    hold up the others; the room answers once it is ready. Without one it
+    is generated right away.
+
+    A room is a session whose id is the room id: the server stamps it on
+    the game messages it sends, but finds a player's room by its address
+    and ignores the sessions players send.
+    """
+    def __init__(self, index=0, workers=1, link_port=None, room_size=8, difficulty=DEFAULT_DIFFICULTY, clues=None,
+                 idle_timeout=30, pool=None, **kwargs):
+        PeerBase.__init__(self, clock=reactor, timer=time.monotonic, **kwargs)
+        self.features += [BATCHED_MOVES, DELTAS, GRADES]
+        self.handlers.update({
+            "move": self.handle_move,
+            "moves": self.handle_moves,
+            "ask_gamedata": self.handle_ask_for_gamedata,
+        })
+        self.repair = RoomRepair(self)
+        self.index = index
+        self.workers = workers
+        self.link_port = link_port
+        self.link = None
+        self.room_size = room_size
+        self.difficulty = difficulty
+        self.clues = clues
+        self.pool = pool
+        self.idle_timeout = idle_timeout
+        self.node = node_id((self.addr, self.port))
+        self.random = random.Random()
+        self.rooms = {}
+        self.room_of = {}
+        self.seeds = {}
+        self.seed_owners = {}
+        self.lobby = None
+        self.last_seen = {}
+        self.homes = {}
+        self.home_seen = {}
+        self.moves = 0
+        self.relayed = 0
+        self.forwarded = 0
+        self.lc_sweep = LoopingCall(self.sweep)
+        self.lc_sweep.clock = self.clock
+
+    def start(self):
+        """
+        Method to start the periodic tasks.
+        """
+        self.start_loops(now=True)
+        self.lc_sweep.start(self.idle_timeout / 2, now=False)
+
+    def find_handler(self, message):
+        """
+        Method to find the handler of a message; game messages go to the
+        player's room rather than through the sessions.
+        """
+        return self.handlers.get(message.msgtype)
+
+    def owner(self, room_id):
+        """
+        Method to find the worker a room lives on.
+        """
+        return room_id % self.workers
+
+    def home_of(self, seed, session=None):
+        """
+        Method to find the worker a player asking for the game of 'seed'
+        from 'session' belongs on: the one with a room playing the seed, else
+        the one that owns the session's room, if it is one, else the one a
+        new room for the seed goes on.
+        """
+        if seed in self.seeds:
+            return self.index
+        if seed in self.seed_owners:
+            return self.seed_owners[seed]
+        return self.owner(seed if session is None else session)
+
+    def datagramReceived(self, data, addr):
+        """
+        Method called when a datagram is received. Datagrams of players whose
+        room lives on another worker are forwarded to it undecoded.
+        """
+        owner = self.homes.get(addr)
+        if owner is None and self.workers > 1:
+            owner = self.route(data, addr)
+        if owner is not None and owner != self.index:
+            self.home_seen[addr] = self.clock.seconds()
+            self.forward(owner, addr, data)
+            return
+        self.last_seen[self.aliases.get(addr, addr)] = self.clock.seconds()
+        PeerBase.datagramReceived(self, data, addr)
+
+    def route(self, data, addr):
+        """
+        Method to find the worker a datagram from a player not yet in a room
+        here belongs to. A player asking for the game of a room another
+        worker owns is handed over to it, with the features and address it
+        said hello with. Returns None to handle the datagram here.
+        """
+        if self.aliases.get(addr, addr) in self.room_of:
+            return None
+        for message in self.decode_datagram(data, addr):
+            if message.msgtype != 'ask_gamedata' or 'seed' not in message:
+                continue
+            owner = self.home_of(message['seed'], message.get('session'))
+            if owner == self.index:
+                return None
+            sender = message.sender
+            handoff = json.dumps({'features': sorted(self.peer_features.get(sender, ())), 'sender': list(sender)}).encode('utf-8')
+            self.homes[addr] = owner
+            self.forward(owner, addr, HANDOFF.pack(len(handoff)) + handoff + data, LINK_HANDOFF)
+            # The owner answers from now on, so nothing about the player is kept here
+            PeerBase.forget(self, sender)
+            self.last_seen.pop(sender, None)
+            return owner
+        return None
+
+    def forward(self, owner, addr, data, kind=LINK_DATAGRAM):
+        """
+        Method to pass a player's datagram to another worker.
+        """
+        self.forwarded += 1
+        self.link.transport.write(LINK.pack(socket.inet_aton(addr[0]), addr[1], kind) + data, ("127.0.0.1", self.link_port + owner))
+
+    def receive_forwarded(self, frame):
+        """
+        Method to handle a datagram another worker forwarded.
+        """
+        try:
+            host, port, kind = LINK.unpack_from(frame)
+            addr = (socket.inet_ntoa(host), port)
+            data = frame[LINK.size:]
+            if kind == LINK_SEED:
+                self.seed_moved(*SEED.unpack_from(data))
+                return
+            if kind == LINK_HANDOFF:
+                size, = HANDOFF.unpack_from(data)
+                handoff = json.loads(data[HANDOFF.size:HANDOFF.size + size])
+                data = data[HANDOFF.size + size:]
+                sender = tuple(handoff['sender'])
+                self.alias(addr, sender)
+                self.peer_features[sender] = set(handoff['features'])
+                self.peers.add(sender)
+        except (struct.error, ValueError, KeyError, TypeError, OSError) as e:
+            log.warning("Dropping malformed forwarded datagram: %r", e)
+            return
+        self.last_seen[self.aliases.get(addr, addr)] = self.clock.seconds()
+        PeerBase.datagramReceived(self, data, addr)
+
+    def handle_hello(self, hello):
+        """
+        Method to handle a hello message from a player. The server answers
+        it, but neither introduces the player to anyone nor probes it.
+        """
+        peer = hello.sender
+        self.lost.pop(peer, None)
+        self.peer_features[peer] = set(hello.get('features', ()))
+        if peer not in self.peers:
+            self.peers.add(peer)
+            self.send_hello(peer)
+        self.greeted(peer)
+
+    def handle_ask_for_gamedata(self, ask):
+        """
+        Method to put a player in a room, if it is not in one yet, and send
+        it the room's game once the room is ready and the player's hello has
+        said what it understands. A player already playing the room's round
+        gets only the moves its version vector is missing.
+        """
+        room = self.room_of.get(ask.sender)
+        if room is None:
+            room = self.join_room(ask.sender, ask.get('session'), ask.get('seed'))
+        if not room.ready:
+            room.asks.append(ask)
+            return
+
+        def answer(addr):
+            if self.room_of.get(addr) is room:
+                same_round = ask.get('seed') == room.seed
+                self.send_gamedata(addr, room, ask.get('versions', {}) if same_round else {})
+        self.after_hello(ask.sender, answer)
+
+    def join_room(self, addr, room_id=None, seed=None):
+        """
+        Method to add a player to the room with the given id, to the one
+        playing the given seed, created if needed, or to the newest room with
+        space left.
+        """
+        if room_id in self.rooms:
+            room = self.rooms[room_id]
+        elif seed in self.seeds:
+            room = self.seeds[seed]
+        elif seed is not None:
+            room = self.create_room(self.new_room_id(), seed)
+        else:
+            if self.lobby is None or len(self.lobby.members) >= self.room_size:
+                self.lobby = self.create_room(self.new_room_id())
+            room = self.lobby
+        room.members.add(addr)
+        self.room_of[addr] = room
+        return room
+
+    def new_room_id(self):
+        """
+        Method to pick an unused room id that lives on this worker.
+        """
+        while True:
+            room_id = self.random.randrange(MAX_ROOM_ID // self.workers) * self.workers + self.index
+            if room_id not in self.rooms:
+                return room_id
+
+    def create_room(self, room_id, seed=None):
+        """
+        Method to create a room and have its game generated, of the given
+        seed, else of a puzzle the pool has ready, else of the room id.
+        """
+        if seed is None and self.pool is not None:
+            game = self.pool.new_game(self.difficulty, self.clues, node=self.node)
+        else:
+            game = Game(room_id if seed is None else seed, difficulty=self.difficulty, clues=self.clues, pool=self.pool, node=self.node)
+        room = self.rooms[room_id] = Room(room_id, game)
+        self.reseed(room, None)
+        if self.pool is None:
+            game.start()
+        else:
+            # generate_board takes the puzzle of the next seed
+            self.pool.when_ready(game.seed + 1, game.clues, lambda: reactor.callFromThread(self.room_ready, room))
+        return room
+
+    def room_ready(self, room):
+        """
+        Method to start the first round of a room once the pool has its
+        puzzle, and answer the players that asked for it meanwhile.
+        """
+        if self.rooms.get(room.id) is not room:
+            return
+        room.game.start()
+        asks, room.asks = room.asks, []
+        for ask in asks:
+            if ask.sender in room.members:
+                self.handle_ask_for_gamedata(ask)
+
+    def reseed(self, room, old):
+        """
+        Method to note that a room plays its current seed instead of 'old',
+        here and on the other workers. A room that is gone plays None.
+        """
+        new = room.seed if room.id in self.rooms else None
+        if old is not None and self.seeds.get(old) is room:
+            del self.seeds[old]
+        if new is not None:
+            self.seeds[new] = room
+        if self.link is not None:
+            frame = LINK.pack(bytes(4), 0, LINK_SEED) + SEED.pack(self.index, -1 if old is None else old, -1 if new is None else new)
+            for index in range(self.workers):
+                if index != self.index:
+                    self.link.transport.write(frame, ("127.0.0.1", self.link_port + index))
+
+    def seed_moved(self, owner, old, new):
+        """
+        Method to note that a room of another worker plays seed 'new' instead
+        of 'old'.
+        """
+        if old >= 0 and self.seed_owners.get(old) == owner:
+            del self.seed_owners[old]
+        if new >= 0:
+            self.seed_owners[new] = owner
+
+    def send_gamedata(self, addr, room, versions=None):
+        """
+        Method to send a room's game to a player, as GameSync does: the seed
+        and the missing cells to players that merge deltas, the whole puzzle
+        to others, and the grade to players that take it.
+        """
+        game = room.game
+        gamedata = {
+            'msgtype': 'gamedata',
+            'seed': room.seed,
+            'difficulty': game.difficulty,
+            'clues': game.clues,
+            'session': room.id,
+        }
+        features = self.peer_features.get(addr, ())
+        if DELTAS in features:
+            gamedata['cells'] = game.deltas(versions or {})
+        else:
+            gamedata['puzzle'] = game.puzzle
+        if GRADES in features:
+            gamedata['grade'] = game.grade
+        self.send_message(gamedata, addr, reliable=True)
+
+    def handle_move(self, move):
+        """
+        Method to handle a move from a player.
+        """
+        self.apply_moves(move.sender, [(move['row'], move['col'], move['number'], move.get('ts'))], move.get('node'))
+
+    def handle_moves(self, message):
+        """
+        Method to handle a batch of moves from a player.
+        """
+        self.apply_moves(message.sender, message['moves'], message.get('node'))
+
+    def apply_moves(self, sender, moves, node=None):
+        """
+        Method to merge a player's moves into the game of its room and pass
+        the ones that changed it on to the other players. Moves from players
+        not in a room are dropped; they have to ask for the game first.
+        """
+        room = self.room_of.get(sender)
+        if room is None or not room.ready:
+            return
+        node = node or node_id(sender)
+        game = room.game
+        changed = []
+        for move in moves:
+            row, col, number = move[:3]
+            ts = move[3] if len(move) > 3 else None
+            if ts is None:
+                ts = game.registers.clock + 1
+            if game.merge_cell(row, col, number, (ts, node)):
+                changed.append([row, col, number, ts])
+        self.moves += len(moves)
+        if changed:
+            self.relay_moves(room, sender, changed, node)
+            self.room_changed(room)
+
+    def relay_moves(self, room, sender, moves, node):
+        """
+        Method to send moves to every player in a room but the one that made
+        them, stamped with the node that did. Players that accept batches
+        get a single message, others one message per move.
+        """
+        peers = [peer for peer in room.members if peer != sender]
+        batched = [peer for peer in peers if BATCHED_MOVES in self.peer_features.get(peer, ())]
+        single = peers
+        if len(moves) > 1 and batched:
+            self.broadcast({'msgtype': 'moves', 'moves': moves, 'node': node, 'session': room.id}, reliable=True, peers=batched)
+            single = [peer for peer in peers if peer not in batched]
+        for row, col, number, ts in moves:
+            self.broadcast({'msgtype': 'move', 'row': row, 'col': col, 'number': number, 'ts': ts, 'node': node, 'session': room.id}, reliable=True, peers=single)
+        self.relayed += len(peers) * len(moves)
+
+    def room_changed(self, room):
+        """
+        Method to start the next round of a room whose puzzle is completed,
+        as its players do.
+        """
+        if room.game.check_win():
+            old = room.seed
+            room.game.puzzle = None
+            room.game.start()
+            self.reseed(room, old)
+
+    def forget(self, addr):
+        """
+        Method to drop a player, and its room if it was the last one in it.
+        """
+        room = self.room_of.pop(addr, None)
+        if room is not None:
+            room.members.discard(addr)
+            if not room.members:
+                del self.rooms[room.id]
+                self.reseed(room, room.seed)
+                if room is self.lobby:
+                    self.lobby = None
+        self.last_seen.pop(addr, None)
+        PeerBase.forget(self, addr)
+
+    def sweep(self):
+        """
+        Method to drop the players not heard from for a while, and forget
+        where the forwarded ones went.
+        """
+        deadline = self.clock.seconds() - self.idle_timeout
+        for addr, seen in list(self.last_seen.items()):
+            if seen < deadline:
+                log.info("No message from %s for %ss, dropping it.", addr, self.idle_timeout)
+                self.forget(addr)
+        for addr, seen in list(self.home_seen.items()):
+            if seen < deadline:
+                del self.home_seen[addr]
+                self.homes.pop(addr, None)
+
+    def stats(self):
+        """
+        Method to count the rooms and players here, the moves handled,
+        relayed and datagrams forwarded so far, the datagrams dropped or not
+        sent and, with numpy, the wrong cells on the boards of all rooms.
+        """
+        outbound = self.outbound_stats()
+        stats = {
+            'rooms': len(self.rooms),
+            'players': len(self.room_of),
+            'moves': self.moves,
+            'relayed': self.relayed,
+            'forwarded': self.forwarded,
+            'dropped': sum(outbound['dropped'].values()),
+            'send_errors': outbound['send_errors'],
+        }
+        if verify.available():
+            stats['wrong_cells'] = sum(self.audit().values())
+        return stats
+
+    def audit(self):
+        """
+        Method to check the boards of all rooms in one batch. Returns the
+        number of cells that clash or differ from the solution per room id,
+        for the rooms that have any. Needs numpy.
+        """
+        rooms = [room for room in self.rooms.values() if room.game.puzzle is not None]
+        if not rooms:
+            return {}
+        boards = verify.as_array([room.game.puzzle for room in rooms])
+        _, conflicts = verify.validate(boards)
+        _, wrong = verify.compare(boards, [room.game.solution for room in rooms])
+        counts = (conflicts | wrong).sum(axis=(1, 2)).tolist()
+        return {room.id: count for room, count in zip(rooms, counts) if count}
+
+
+class WorkerLink(DatagramProtocol):
+    """
+    The local socket a worker gets the datagrams other workers forward on.
+    """
+    def __init__(self, relay):
+        self.relay = relay
+
+    def datagramReceived(self, data, addr):
+        self.relay.receive_forwarded(data)
+
+
+def reuseport_socket(interface, port):
+    """
+    A UDP socket bound to the given port, shared with the other workers.
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((interface, port))
+    sock.setblocking(False)
+    return sock
+
+
+def serve(index, args):
+    """
+    Run one worker until it is stopped.
+    """
+    logging.basicConfig(level=args.log_level, format=f"%(asctime)s worker {index} %(name)s %(levelname)s %(message)s")
+    clues = args.clues if args.clues else DIFFICULTIES[args.difficulty]
+    pool = PuzzlePool(size=max(1, args.pool_size), levels=[clues])
+    reactor.addSystemEventTrigger('before', 'shutdown', pool.close)
+    relay = Relay(index, args.workers, link_port=args.link_port, room_size=args.room_size, difficulty=args.difficulty,
+                  clues=args.clues, idle_timeout=args.idle_timeout, pool=pool, reliable=not args.unreliable, send_rate=args.send_rate,
+                  addr=args.addr, port=args.port)
+    sock = reuseport_socket(args.interface, args.port)
+    reactor.adoptDatagramPort(sock.fileno(), socket.AF_INET, relay)
+    sock.close()
+    if args.workers > 1:
+        relay.link = WorkerLink(relay)
+        reactor.listenUDP(args.link_port + index, relay.link, interface="127.0.0.1")
+    reactor.callWhenRunning(relay.start)
+    if args.profile:
+        profiler = Profiler(reactor)
+        profiler.install(relay)
+        profiler.on_signals(args.profile, reactor.callFromThread, args.profile_seconds)
+        reactor.addSystemEventTrigger('before', 'shutdown', profiler.dump, os.path.join(args.profile, f"profile-{os.getpid()}.json"))
+    if args.stats_interval > 0:
+        stats = LoopingCall(lambda: log.info("%s", relay.stats()))
+        reactor.callWhenRunning(stats.start, args.stats_interval, now=False)
+    reactor.run()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="P2P Sudoku relay server")
+    parser.add_argument("--port", type=int, default=7777, help="UDP port players join on")
+    parser.add_argument("--interface", default="0.0.0.0", help="address to listen on")
+    parser.add_argument("--addr", help="address the server tells players it has, by default the first network interface's")
+    parser.add_argument("--workers", type=int, default=multiprocessing.cpu_count(), help="worker processes sharing the port, each owning a share of the rooms")
+    parser.add_argument("--link-port", type=int, default=17777, help="first of the local UDP ports the workers forward datagrams to each other on")
+    parser.add_argument("--room-size", type=int, default=8, help="players put in a room before a new one is opened, for players that do not ask for a seed")
+    parser.add_argument("--difficulty", choices=DIFFICULTIES, default=DEFAULT_DIFFICULTY, help="difficulty of new rooms")
+    parser.add_argument("--clues", type=int, help="carve new rooms' games down to this many clues, overrides --difficulty")
+    parser.add_argument("--pool-size", type=int, default=8, help="ready puzzles each worker keeps for new rooms, at least 1; the puzzles of rooms opened for a seed and of next rounds are generated on its thread too")
+    parser.add_argument("--idle-timeout", type=float, default=30, help="seconds without a message before a player is dropped")
+    parser.add_argument("--unreliable", action="store_true", help="send moves and game data without acks and retransmission")
+    parser.add_argument("--send-rate", type=float, default=SEND_RATE, help="datagrams per second sent to any one player, more wait with moves first")
+    parser.add_argument("--stats-interval", type=float, default=0, help="seconds between room, player and move counts logged at INFO, 0 turns them off")
+    parser.add_argument("--profile", metavar="DIR", help="time every message handler and periodic task and the reactor lag in each worker; SIGUSR1 to a worker captures a cProfile and SIGUSR2 a sampled profile into DIR, and the timings are written there on exit")
+    parser.add_argument("--profile-seconds", type=float, default=CAPTURE_SECONDS, help="seconds a profile captured on a signal runs for")
+    parser.add_argument("--log-level", default="WARNING", choices=["DEBUG", "INFO", "WARNING", "ERROR"])
+    args = parser.parse_args()
+
+    if args.workers <= 1:
+        args.workers = 1
+        serve(0, args)
+    else:
+        context = multiprocessing.get_context("spawn")
+        processes = [context.Process(target=serve, args=(index, args), name=f"worker-{index}") for index in range(args.workers)]
+        for process in processes:
+            process.start()
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        try:
+            for process in processes:
+                process.join()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            for process in processes:
+                process.terminate()
+                process.join()
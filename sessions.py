@@ -0,0 +1,136 @@
+import random
+
+# Feature peers advertise in their hello to say their game messages carry a
+# session id and that they list the sessions they are in
+FEATURE = "session/1"
+
+# Message types that belong to a game session; the others are about peers
+SCOPED = frozenset(("move", "moves", "ask_gamedata", "gamedata", "digest", "repair"))
+
+
+class Sessions(object):
+    """
+    The game sessions a peer takes part in and the peers in each of them,
+    so a process can play several games and send every game's messages only
+    to the peers playing it.
+
+    Every local session has one handler that takes its game messages. Peers
+    list the sessions they are in in their hellos; a peer that asks for a
+    session's game data joins it, and so does the peer answering. Peers
+    that do not speak sessions are counted in the default session, the
+    first one opened, which also gets the game messages that carry no
+    session id.
+
+    Game messages for a session that is not ours, or from a peer that is
+    not in the session, are dropped and counted before any handler runs.
+    Only asking for the game data gets an answer from outside a session.
+    """
+    def __init__(self, seed=None):
+        self.local = {}
+        self.default = None
+        self.members = {}
+        self.joined = {}
+        self.legacy = set()
+        self.told = {}
+        self.waiting = {}
+        self.rejected = 0
+        self.random = random.Random(seed)
+
+    def new_id(self):
+        """
+        An unused 32-bit session id.
+        """
+        while True:
+            session = self.random.getrandbits(32)
+            if session not in self.local:
+                return session
+
+    def add(self, session, handler):
+        """
+        Take part in a session, with 'handler' taking its game messages.
+        """
+        self.local[session] = handler
+        if self.default is None:
+            self.default = session
+
+    def remove(self, session):
+        """
+        Leave a session.
+        """
+        self.local.pop(session, None)
+        if self.default == session:
+            self.default = next(iter(self.local), None)
+
+    def add_member(self, session, peer):
+        self.members.setdefault(session, set()).add(peer)
+
+    def is_member(self, session, peer):
+        return peer in self.members.get(session, ()) or (session == self.default and peer in self.legacy)
+
+    def members_of(self, session):
+        """
+        The peers in a session.
+        """
+        members = self.members.get(session, set())
+        if session == self.default and self.legacy:
+            return members | self.legacy
+        return members
+
+    def update(self, peer, sessions):
+        """
+        Record the sessions a peer says it is in. Returns True if it now
+        shares a session with us that it did not before.
+        """
+        sessions = frozenset(sessions)
+        old = self.joined.get(peer, frozenset())
+        for session in old - sessions:
+            members = self.members.get(session)
+            if members is not None:
+                members.discard(peer)
+                if not members:
+                    del self.members[session]
+        for session in sessions - old:
+            self.add_member(session, peer)
+        self.joined[peer] = sessions
+        return any(session in self.local for session in sessions - old)
+
+    def stale(self, peer):
+        """
+        Whether a peer has not been told the sessions we are in now.
+        """
+        return self.told.get(peer) != frozenset(self.local)
+
+    def forget(self, peer):
+        for session in self.joined.pop(peer, ()):
+            members = self.members.get(session)
+            if members is not None:
+                members.discard(peer)
+                if not members:
+                    del self.members[session]
+        for session, members in list(self.members.items()):
+            if peer in members:
+                members.discard(peer)
+                if not members:
+                    del self.members[session]
+        self.legacy.discard(peer)
+        self.told.pop(peer, None)
+        self.waiting.pop(peer, None)
+
+    def route(self, message):
+        """
+        The handler for a game message, or None if it is to be dropped.
+        Messages without a session id are for the default session, and so
+        are asks for the game data of a session we are not in.
+        """
+        if message.msgtype == 'gamedata' and message.sender in self.waiting:
+            # The game we asked this peer for, whichever session it is in
+            return self.waiting.pop(message.sender)
+        session = message.get('session', self.default)
+        handler = self.local.get(session)
+        if message.msgtype == 'ask_gamedata':
+            # A peer joining us knows no session yet, or one of its own
+            return handler or self.local.get(self.default)
+        if handler is None or not self.is_member(session, message.sender):
+            self.rejected += 1
+            return None
+        return handler
@@ -0,0 +1,313 @@
+import heapq
+import itertools
+import json
+import random
+
+from twisted.internet.base import DelayedCall
+from twisted.internet.task import Clock
+
+import protocol
+from game import Game, DEFAULT_DIFFICULTY
+from peer import Peer
+from sync import GameSync
+
+
+class HeapClock(Clock):
+    """
+    A drop-in for twisted.internet.task.Clock for simulations with many
+    pending calls. task.Clock re-sorts its whole call list on every
+    callLater, which dominates the run time once thousands of timers are
+    pending; this one keeps the calls in a heap and skips cancelled or
+    rescheduled entries lazily.
+    """
+    def __init__(self):
+        Clock.__init__(self)
+        self.heap = []
+        self.counter = itertools.count()
+
+    def callLater(self, delay, callable, *args, **kw):
+        dc = DelayedCall(self.seconds() + delay, callable, args, kw, lambda call: None, self.push, self.seconds)
+        self.push(dc)
+        return dc
+
+    def push(self, dc):
+        heapq.heappush(self.heap, (dc.getTime(), next(self.counter), dc))
+
+    def getDelayedCalls(self):
+        return [dc for when, _, dc in self.heap if dc.active() and dc.getTime() == when]
+
+    def advance(self, amount):
+        self.rightNow += amount
+        heap = self.heap
+        while heap and heap[0][0] <= self.rightNow:
+            when, _, dc = heapq.heappop(heap)
+            if dc.cancelled or dc.called or dc.getTime() != when:
+                continue
+            dc.called = 1
+            dc.func(*dc.args, **dc.kw)
+
+    def run_until(self, when):
+        """
+        Run every call due up to 'when', each at its own time rather than at
+        the end of the step as advance does.
+        """
+        heap = self.heap
+        while heap and heap[0][0] <= when:
+            at, _, dc = heapq.heappop(heap)
+            if dc.cancelled or dc.called or dc.getTime() != at:
+                continue
+            self.rightNow = max(self.rightNow, at)
+            dc.called = 1
+            dc.func(*dc.args, **dc.kw)
+        self.rightNow = max(self.rightNow, when)
+
+
+class SimulatedNetwork(object):
+    """
+    Delivers datagrams between in-process peers on a simulated clock.
+
+    Every datagram takes 'latency' seconds plus up to 'jitter' more, is lost
+    with probability 'loss' and held back another 'reorder_delay' seconds
+    with probability 'reorder', so it arrives after datagrams sent later.
+    With 'bandwidth' set, in bytes per second, every sender's uplink puts
+    its datagrams on the wire one after the other. 'partition' cuts the
+    network into groups that lose everything sent between them until 'heal'.
+    Everything sent is counted, in total and per message type.
+    """
+    def __init__(self, clock=None, latency=0.005, jitter=0.0, loss=0.0, reorder=0.0, reorder_delay=0.02,
+                 bandwidth=None, mtu=1472, seed=0):
+        self.clock = clock if clock is not None else HeapClock()
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.reorder = reorder
+        self.reorder_delay = reorder_delay
+        self.bandwidth = bandwidth
+        self.mtu = mtu
+        self.random = random.Random(seed)
+        self.endpoints = {}
+        self.busy_until = {}
+        self.groups = {}
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.datagrams = 0
+        self.bytes = 0
+        self.delivered = 0
+        self.dropped = 0
+        self.largest = 0
+        self.oversized = 0
+        self.by_type = {}
+
+    def attach(self, peer):
+        """
+        Give a peer a transport on this network.
+        """
+        addr = (peer.addr, peer.port)
+        self.endpoints[addr] = peer
+        peer.transport = SimulatedTransport(self, addr)
+
+    def detach(self, addr):
+        """
+        Take a peer off the network; datagrams to it are lost.
+        """
+        self.endpoints.pop(addr, None)
+
+    def partition(self, *groups):
+        """
+        Split the network into groups of addresses; datagrams between
+        different groups, or to and from addresses in none, are lost.
+        """
+        self.groups = {addr: index for index, group in enumerate(groups) for addr in group}
+
+    def heal(self):
+        self.groups = {}
+
+    def msgtype(self, data):
+        if protocol.is_binary(data):
+            return protocol.MSGTYPES.get(data[1] & ~(protocol.SEQ_FLAG | protocol.SESSION_FLAG), ('unknown',))[0]
+        try:
+            return json.loads(data.decode('utf-8').splitlines()[0])['msgtype']
+        except (ValueError, KeyError, IndexError):
+            return 'unknown'
+
+    def send(self, data, src, dst):
+        size = len(data)
+        self.datagrams += 1
+        self.bytes += size
+        self.largest = max(self.largest, size)
+        self.oversized += size > self.mtu
+        counts = self.by_type.setdefault(self.msgtype(data), [0, 0])
+        counts[0] += 1
+        counts[1] += size
+        delay = self.latency
+        if self.bandwidth:
+            now = self.clock.seconds()
+            start = max(now, self.busy_until.get(src, now))
+            self.busy_until[src] = start + size / self.bandwidth
+            delay += self.busy_until[src] - now
+        if self.random.random() < self.loss or self.groups and self.groups.get(src, -1) != self.groups.get(dst, -2):
+            self.dropped += 1
+            return
+        if self.jitter:
+            delay += self.random.random() * self.jitter
+        if self.reorder and self.random.random() < self.reorder:
+            delay += self.reorder_delay
+        self.clock.callLater(delay, self.deliver, data, src, dst)
+
+    def deliver(self, data, src, dst):
+        peer = self.endpoints.get(dst)
+        if peer is None:
+            self.dropped += 1
+            return
+        self.delivered += 1
+        peer.datagramReceived(data, src)
+
+
+class SimulatedTransport(object):
+    """
+    The transport of a peer on a SimulatedNetwork.
+    """
+    def __init__(self, network, addr):
+        self.network = network
+        self.addr = addr
+
+    def write(self, data, addr):
+        self.network.send(data, self.addr, addr)
+
+    def stopListening(self):
+        self.network.detach(self.addr)
+
+
+class Swarm(object):
+    """
+    A game played by 'size' headless peers on a SimulatedNetwork: real Peers
+    and GameSync controllers, with no UI and no sockets. Peer 0 hosts the
+    game and the others join it.
+    """
+    def __init__(self, size, network=None, seed=0, reliable=True, flush_window=0.01, anti_entropy=5.0,
+                 difficulty=DEFAULT_DIFFICULTY, probe_interval=1.0):
+        self.network = network if network is not None else SimulatedNetwork(seed=seed)
+        self.clock = self.network.clock
+        self.random = random.Random(seed)
+        self.peers = []
+        self.syncs = []
+        for i in range(size):
+            peer = Peer(reliable=reliable, probe_interval=probe_interval, addr=f"10.0.{i // 250}.{i % 250 + 1}", port=50000, clock=self.clock)
+            self.network.attach(peer)
+            game = Game(self.random.randint(1, 2**31 - 2), difficulty=difficulty)
+            self.peers.append(peer)
+            self.syncs.append(GameSync(peer, game, flush_window, anti_entropy))
+        self.host = (self.peers[0].addr, self.peers[0].port)
+        self.syncs[0].game.start()
+        self.syncs[0].start()
+
+    def join(self, limit=60):
+        """
+        Join every peer to the host the way app.py does, through hello and
+        ask_gamedata. Returns the simulated seconds it took, or None if not
+        everyone had the game and a full view within 'limit', along with
+        the stragglers.
+        """
+        start = self.clock.seconds()
+        for peer, sync in zip(self.peers[1:], self.syncs[1:]):
+            peer.join(self.host, sync.ask_for_gamedata)
+        if self.run_until(lambda: self.has_game() and self.full_view(), limit):
+            return self.clock.seconds() - start, {}
+        return None, self.stragglers()
+
+    def connect(self, limit=60):
+        """
+        Make every peer know every other one right away, skipping the hellos,
+        then fetch the game from the host. Quicker than join for large swarms
+        when the join itself is not what is measured. Every peer is put in
+        the host's session too, as the hellos would have.
+        """
+        features = {}
+        for peer in self.peers:
+            features[(peer.addr, peer.port)] = set(peer.features)
+        session = frozenset((self.syncs[0].session,))
+        for peer in self.peers:
+            for addr, peer_features in features.items():
+                if addr != (peer.addr, peer.port):
+                    peer.peers.add(addr)
+                    peer.view.add(addr)
+                    peer.peer_features[addr] = set(peer_features)
+                    peer.membership.add(addr)
+                    peer.sessions.update(addr, session)
+                    peer.sessions.told[addr] = session
+            peer.membership.updates.clear()
+        for sync in self.syncs[1:]:
+            sync.ask_for_gamedata(self.host)
+        return self.run_until(self.has_game, limit)
+
+    def start_loops(self):
+        """
+        Start every peer's periodic tasks: probes, retransmissions and pings.
+        """
+        for peer in self.peers:
+            peer.start_loops()
+
+    def run(self, seconds):
+        self.clock.run_until(self.clock.seconds() + seconds)
+
+    def run_until(self, predicate, limit, step=0.01):
+        """
+        Run until 'predicate' holds, checking every 'step' simulated seconds.
+        Returns False if it still does not after 'limit' seconds.
+        """
+        end = self.clock.seconds() + limit
+        while not predicate():
+            if self.clock.seconds() >= end:
+                return False
+            self.run(step)
+        return True
+
+    def stragglers(self):
+        """
+        The peers that have not fully joined, each with what it lacks: the
+        game, the host's session or some of the other peers.
+        """
+        session = self.syncs[0].session
+        stragglers = {}
+        for peer, sync in zip(self.peers, self.syncs):
+            lacking = []
+            if sync.game.puzzle is None:
+                lacking.append("no game")
+            elif sync.session != session:
+                lacking.append("another session")
+            if len(peer.peers) < len(self.peers) - 1:
+                lacking.append(f"knows {len(peer.peers)} of {len(self.peers) - 1} peers")
+            if lacking:
+                stragglers[(peer.addr, peer.port)] = lacking
+        return stragglers
+
+    def has_game(self):
+        return all(sync.game.puzzle is not None for sync in self.syncs)
+
+    def full_view(self):
+        return all(len(peer.peers) == len(self.peers) - 1 for peer in self.peers)
+
+    def converged(self):
+        """
+        Whether every peer plays the same round with the same board.
+        """
+        first = self.syncs[0].game
+        return all(
+            sync.game.puzzle is not None and sync.game.seed == first.seed and sync.game.puzzle == first.puzzle
+            for sync in self.syncs
+        )
+
+    def play_random(self):
+        """
+        Have a random peer that has the game enter a random number into a
+        random empty cell. Returns False if no peer has the game yet.
+        """
+        syncs = [sync for sync in self.syncs if sync.game.puzzle is not None]
+        if not syncs:
+            return False
+        sync = self.random.choice(syncs)
+        game = sync.game
+        empty = [cell for cell in range(81) if game.board[cell // 9][cell % 9] == 0]
+        cell = self.random.choice(empty)
+        return sync.play(cell // 9, cell % 9, self.random.randint(0, 9))
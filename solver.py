@@ -0,0 +1,322 @@
+import random
+
+from board import Board
+
+ALL_DIGITS = 0x1FF  # bits 0-8 stand for the digits 1-9
+
+ROW_OF = [i // 9 for i in range(81)]
+COL_OF = [i % 9 for i in range(81)]
+BOX_OF = [(i // 27) * 3 + (i % 9) // 3 for i in range(81)]
+
+UNITS = (
+    [[r * 9 + c for c in range(9)] for r in range(9)]
+    + [[r * 9 + c for r in range(9)] for c in range(9)]
+    + [
+        [(b // 3 * 3 + i) * 9 + b % 3 * 3 + j for i in range(3) for j in range(3)]
+        for b in range(9)
+    ]
+)
+
+UNITS_OF = [(ROW_OF[i], 9 + COL_OF[i], 18 + BOX_OF[i]) for i in range(81)]
+PEERS = [
+    sorted(set(UNITS[u][k] for u in UNITS_OF[i] for k in range(9)) - {i})
+    for i in range(81)
+]
+
+BIT = [1 << d for d in range(9)]
+DIGIT_OF = {1 << d: d + 1 for d in range(9)}
+POPCOUNT = [bin(m).count("1") for m in range(ALL_DIGITS + 1)]
+
+
+def digits_of(mask):
+    """
+    List the digits (1-9) contained in a candidate mask.
+    """
+    return [d + 1 for d in range(9) if mask & BIT[d]]
+
+
+class BacktrackingSolver(object):
+    """
+    The original solver: plain recursive backtracking, scanning the board for
+    the next empty cell and validating every candidate against its row, column
+    and box.
+    """
+    def solve(self, board, rng=None):
+        """
+        Solve the Sudoku board, a Board or nine rows, in place. Returns True
+        if a solution was found.
+        """
+        if isinstance(board, Board):
+            rows = board.rows()
+            solved = self._solve(rows, rng or random)
+            board.cells[:] = bytes(number for row in rows for number in row)
+            return solved
+        return self._solve(board, rng or random)
+
+    def _solve(self, board, rng):
+        empty_cell = self.find_empty_cell(board)
+        if not empty_cell:
+            return True
+        row, col = empty_cell
+        numbers = list(range(1, 10))
+        rng.shuffle(numbers)
+        for num in numbers:
+            if self.is_valid_move(board, row, col, num):
+                board[row][col] = num
+                if self._solve(board, rng):
+                    return True
+                board[row][col] = 0
+        return False
+
+    def count_solutions(self, board, limit=2):
+        """
+        Count the solutions of the board, stopping once 'limit' is reached.
+        """
+        board = [list(row) for row in board]
+        return self._count(board, limit)
+
+    def _count(self, board, limit):
+        empty_cell = self.find_empty_cell(board)
+        if not empty_cell:
+            return 1
+        row, col = empty_cell
+        count = 0
+        for num in range(1, 10):
+            if self.is_valid_move(board, row, col, num):
+                board[row][col] = num
+                count += self._count(board, limit - count)
+                board[row][col] = 0
+                if count >= limit:
+                    break
+        return count
+
+    def find_empty_cell(self, board):
+        """
+        Find the next empty cell in the Sudoku board.
+        """
+        for i in range(9):
+            for j in range(9):
+                if board[i][j] == 0:
+                    return (i, j)
+        return None
+
+    def is_valid_move(self, board, row, col, num):
+        """
+        Check if placing 'num' at position (row, col) is a valid move.
+        """
+        return (
+            num not in board[row]
+            and num not in [board[i][col] for i in range(9)]
+            and num not in [
+                board[row - row % 3 + i][col - col % 3 + j]
+                for i in range(3) for j in range(3)
+            ]
+        )
+
+
+class BitmaskSolver(object):
+    """
+    Constraint-propagation solver. Every row, column and box keeps a bitmask
+    of the digits it already holds and every empty cell a bitmask of the
+    digits it may still take, so placing a digit is a couple of bitwise
+    operations on its 20 peers. Naked and hidden singles are placed until the
+    board stops changing, and only then does the search branch, on the cell
+    with the fewest candidates left.
+    """
+    def solve(self, board, rng=None):
+        """
+        Solve the Sudoku board, a Board or nine rows, in place. Returns True
+        if a solution was found.
+
+        When 'rng' is given the candidates of every branching cell are tried
+        in shuffled order, which is what makes generated boards depend on the
+        seed only.
+        """
+        state = self._load(board)
+        if state is None:
+            return False
+        solution = self._search(state, self._singles(state), rng)
+        if solution is None:
+            return False
+        cells = solution[0]
+        if isinstance(board, Board):
+            board.cells[:] = cells
+            return True
+        for i in range(81):
+            board[ROW_OF[i]][COL_OF[i]] = cells[i]
+        return True
+
+    def count_solutions(self, board, limit=2):
+        """
+        Count the solutions of the board, stopping once 'limit' is reached.
+        """
+        state = self._load(board)
+        if state is None:
+            return 0
+        return self._count(state, self._singles(state), limit)
+
+    def _singles(self, state):
+        candidates = state[1]
+        return [i for i in range(81) if POPCOUNT[candidates[i]] == 1]
+
+    def _load(self, board):
+        if isinstance(board, Board):
+            values = board.cells
+        else:
+            values = [board[ROW_OF[i]][COL_OF[i]] for i in range(81)]
+        cells = bytearray(81)
+        units = [0] * 27
+        for i in range(81):
+            value = values[i]
+            if value:
+                bit = BIT[value - 1]
+                for u in UNITS_OF[i]:
+                    if units[u] & bit:
+                        return None
+                    units[u] |= bit
+                cells[i] = value
+        candidates = [
+            0 if cells[i] else ALL_DIGITS & ~(
+                units[ROW_OF[i]] | units[9 + COL_OF[i]] | units[18 + BOX_OF[i]]
+            )
+            for i in range(81)
+        ]
+        return cells, candidates, units
+
+    def _place(self, state, cell, bit, singles):
+        """
+        Place a digit and strike it from the candidates of every peer.
+        Returns False if a peer is left without candidates.
+        """
+        cells, candidates, units = state
+        cells[cell] = DIGIT_OF[bit]
+        candidates[cell] = 0
+        for u in UNITS_OF[cell]:
+            units[u] |= bit
+        for p in PEERS[cell]:
+            mask = candidates[p]
+            if mask & bit:
+                mask ^= bit
+                if not mask:
+                    return False
+                candidates[p] = mask
+                if POPCOUNT[mask] == 1:
+                    singles.append(p)
+        return True
+
+    def _propagate(self, state, singles):
+        """
+        Place naked and hidden singles until nothing changes. Returns the
+        empty cell with the fewest candidates as (cell, mask), None if the
+        board is full, or False on a contradiction.
+
+        Hunting for hidden singles means scanning all 27 units, which costs
+        more than just branching on a cell with two candidates, so the scan
+        only runs when the cheapest branch is wider than that.
+        """
+        cells, candidates, units = state
+        while True:
+            while singles:
+                cell = singles.pop()
+                mask = candidates[cell]
+                if cells[cell]:
+                    continue
+                if not mask:
+                    return False
+                if not self._place(state, cell, mask, singles):
+                    return False
+            best, best_mask, best_count = None, 0, 10
+            for i in range(81):
+                mask = candidates[i]
+                if mask:
+                    count = POPCOUNT[mask]
+                    if count < best_count:
+                        best, best_mask, best_count = i, mask, count
+                        if count == 2:
+                            break
+            if best is None:
+                return None
+            if best_count == 2:
+                return best, best_mask
+            for u in range(27):
+                used = units[u]
+                if used == ALL_DIGITS:
+                    continue
+                once = twice = 0
+                for i in UNITS[u]:
+                    mask = candidates[i]
+                    twice |= once & mask
+                    once |= mask
+                if once | used != ALL_DIGITS:
+                    return False
+                hidden = once & ~twice & ~used
+                if not hidden:
+                    continue
+                for i in UNITS[u]:
+                    mask = candidates[i] & hidden
+                    if mask:
+                        if POPCOUNT[mask] > 1:
+                            return False
+                        candidates[i] = mask
+                        singles.append(i)
+                if singles:
+                    break
+            if not singles:
+                return best, best_mask
+
+    def _branches(self, state, cell, mask, rng):
+        digits = digits_of(mask)
+        if rng is not None:
+            rng.shuffle(digits)
+        cells, candidates, units = state
+        for digit in digits:
+            child = (cells[:], candidates[:], units[:])
+            singles = []
+            if self._place(child, cell, BIT[digit - 1], singles):
+                yield child, singles
+
+    def _search(self, state, singles, rng):
+        branch = self._propagate(state, singles)
+        if branch is False:
+            return None
+        if branch is None:
+            return state
+        for child, singles in self._branches(state, branch[0], branch[1], rng):
+            solution = self._search(child, singles, rng)
+            if solution is not None:
+                return solution
+        return None
+
+    def _count(self, state, singles, limit):
+        branch = self._propagate(state, singles)
+        if branch is False:
+            return 0
+        if branch is None:
+            return 1
+        count = 0
+        for child, singles in self._branches(state, branch[0], branch[1], None):
+            count += self._count(child, singles, limit - count)
+            if count >= limit:
+                break
+        return count
+
+
+SOLVERS = {
+    "backtracking": BacktrackingSolver,
+    "bitmask": BitmaskSolver,
+}
+
+DEFAULT_SOLVER = "bitmask"
+
+
+def get_solver(solver=None):
+    """
+    Resolve a solver name, class or instance into a solver instance.
+    """
+    if solver is None:
+        solver = DEFAULT_SOLVER
+    if isinstance(solver, str):
+        solver = SOLVERS[solver]
+    if isinstance(solver, type):
+        solver = solver()
+    return solver
@@ -0,0 +1,260 @@
+from game import Game, DEFAULT_DIFFICULTY
+from batching import MoveBatcher, FEATURE as BATCHED_MOVES
+from crdt import FEATURE as DELTAS, node_id
+from antientropy import AntiEntropy
+from grader import FEATURE as GRADES
+
+
+class GameSync(object):
+    """
+    Keeps a peer's game in sync with the other peers: sends the moves played
+    here, merges the moves and game data received, and repairs the board
+    through anti-entropy. It knows nothing about drawing, so the same code
+    runs behind the Tk UI and in headless simulations.
+
+    'on_change' is called after cells changed, 'on_game' after a game received
+    from a peer replaced the current one, and 'on_win' when the puzzle is
+    completed; without it a new round starts right away.
+
+    The game is played in a session of the peer's: a new one opened once
+    there is a game to host, or the one of the game data received. Moves
+    and digests only go to the peers in it, and the peer only hands this
+    controller messages from them, so one peer can run several games.
+    """
+    def __init__(self, peer, game, flush_window=0.01, anti_entropy=5.0, on_change=None, on_game=None, on_win=None):
+        self.peer = peer
+        for feature in (BATCHED_MOVES, DELTAS, GRADES):
+            if feature not in self.peer.features:
+                self.peer.features.append(feature)
+        self.node = node_id((peer.addr, peer.port))
+        self.game = game
+        self.game.registers.node = self.node
+        self.on_change = on_change
+        self.on_game = on_game
+        self.on_win = on_win
+        self.batcher = MoveBatcher(self.send_moves, flush_window, clock=peer.clock)
+        self.anti_entropy = AntiEntropy(peer, lambda: self.game, self.changed, anti_entropy, clock=peer.clock)
+        self.handlers = {
+            "move": self.handle_move,
+            "moves": self.handle_moves,
+            "ask_gamedata": self.handle_ask_for_gamedata,
+            "gamedata": self.handle_gamedata,
+            "digest": self.anti_entropy.handle_digest,
+            "repair": self.anti_entropy.handle_repair,
+        }
+        self.session = None
+
+    def start(self):
+        """
+        Start the periodic tasks, once there is a game to play, in a new
+        session unless the game came from one.
+        """
+        if self.session is None:
+            self.open_session()
+        self.anti_entropy.start()
+
+    def open_session(self, session=None):
+        """
+        Play in the given session, or a new one, leaving the current one,
+        and tell the peers we know.
+        """
+        sessions = self.peer.sessions
+        if self.session is not None:
+            sessions.remove(self.session)
+        self.session = session if session is not None else sessions.new_id()
+        sessions.add(self.session, self.handle)
+        self.anti_entropy.session = self.session
+        self.peer.announce_sessions()
+
+    def members(self):
+        """
+        The peers playing this game.
+        """
+        if self.session is None:
+            return set()
+        return self.peer.sessions.members_of(self.session)
+
+    def handle(self, message):
+        """
+        Method to handle a game message of this session.
+        """
+        self.handlers[message.msgtype](message)
+
+    def play(self, row, col, number):
+        """
+        Enter a number on this peer and send the move to the others. Returns
+        False if the cell holds a clue.
+        """
+        stamp = self.game.set_cell(row, col, number)
+        if stamp is None:
+            return False
+        self.send_move(row, col, number, stamp[0])
+        return True
+
+    def changed(self):
+        """
+        Report changed cells and check whether the puzzle is completed.
+        """
+        if self.on_change is not None:
+            self.on_change()
+        if self.game.check_win():
+            if self.on_win is not None:
+                self.on_win()
+            else:
+                self.next_round()
+
+    def next_round(self):
+        """
+        Start the next round with a new board.
+        """
+        self.game.puzzle = None
+        self.game.start()
+
+    def handle_move(self, move):
+        """
+        Method to handle a move received from a peer.
+        """
+        self.apply_moves(move.sender, [(move['row'], move['col'], move['number'], move.get('ts'))], move.get('node'))
+
+    def handle_moves(self, message):
+        """
+        Method to handle a batch of moves received from a peer.
+        """
+        self.apply_moves(message.sender, message['moves'], message.get('node'))
+
+    def apply_moves(self, sender, moves, node=None):
+        """
+        Method to merge moves received from a peer. Moves are stamped by the
+        node that made them, which is the sender unless said otherwise; moves
+        from peers that do not stamp them win over whatever the cell holds,
+        as they always did. The peer has already dropped moves from peers
+        outside the session.
+        """
+        node = node or node_id(sender)
+        changed = False
+        for move in moves:
+            row, col, number = move[:3]
+            ts = move[3] if len(move) > 3 else None
+            if ts is None:
+                ts = self.game.registers.clock + 1
+            changed |= self.game.merge_cell(row, col, number, (ts, node))
+        if changed:
+            self.changed()
+
+    def send_move(self, row, col, number, ts):
+        """
+        Method to queue a move for the next flush to the peers in the session.
+        """
+        self.batcher.add(row, col, number, ts)
+
+    def send_moves(self, moves):
+        """
+        Method to send a batch of moves to the peers in the session. Peers
+        that accept batches get a single message, others one message per
+        move. Returns the number of datagrams sent.
+        """
+        peers = list(self.members())
+        batched = [peer for peer in peers if BATCHED_MOVES in self.peer.peer_features.get(peer, ())]
+        single = peers
+        if len(moves) > 1 and batched:
+            self.peer.broadcast({'msgtype': 'moves', 'moves': moves, 'session': self.session}, reliable=True, peers=batched)
+            single = [peer for peer in peers if peer not in batched]
+        for row, col, number, ts in moves:
+            self.peer.broadcast({'msgtype': 'move', 'row': row, 'col': col, 'number': number, 'ts': ts, 'session': self.session}, reliable=True, peers=single)
+        return len(peers) - len(single) + len(single) * len(moves)
+
+    def ask_for_gamedata(self, addr):
+        """
+        Method to ask a peer for the game data. A peer already playing the
+        same round sends its version vector, so only the moves it is missing
+        come back. The answer is taken whatever session it is for.
+        """
+        ask = {'msgtype': 'ask_gamedata'}
+        if self.game.puzzle is not None:
+            ask['seed'] = self.game.seed - 1
+            ask['versions'] = self.game.versions()
+        if self.session is not None:
+            ask['session'] = self.session
+        self.peer.sessions.waiting[addr] = self.handle
+        self.peer.send_message(ask, addr, reliable=True)
+
+    def handle_ask_for_gamedata(self, ask):
+        """
+        Method to handle a peer asking for the game data, which makes it a
+        member of the session. The answer waits for the peer's hello, as
+        what goes in it, the session id included, depends on its features.
+        """
+        self.peer.sessions.add_member(self.session, ask.sender)
+
+        def answer(addr):
+            same_round = self.game.puzzle is not None and ask.get('seed') == self.game.seed - 1
+            self.send_gamedata(addr, ask.get('versions', {}) if same_round else {})
+        self.peer.after_hello(ask.sender, answer)
+
+    def send_gamedata(self, addr, versions=None):
+        """
+        Method to send the game data to a peer. Peers that merge deltas get
+        the seed and the entered cells the given version vector is missing,
+        as they generate the clues from the seed themselves; others get the
+        whole puzzle. Peers that take grades get the puzzle's, so they need
+        not grade it themselves.
+        """
+        gamedata = {
+            'msgtype': 'gamedata',
+            'seed': self.game.seed-1,
+            'difficulty': self.game.difficulty,
+            'clues': self.game.clues,
+            'session': self.session,
+        }
+        features = self.peer.peer_features.get(addr, ())
+        if DELTAS in features:
+            gamedata['cells'] = self.game.deltas(versions or {})
+        else:
+            gamedata['puzzle'] = self.game.puzzle
+        if GRADES in features:
+            gamedata['grade'] = self.game.grade
+        self.peer.send_message(gamedata, addr, reliable=True)
+
+    def handle_gamedata(self, gamedata):
+        """
+        Method to handle the game data received from a peer, joining its
+        session. Game data without one comes from a peer that does not know
+        about sessions, and is played in a session of our own, once its
+        hello has said so; otherwise the peer had not seen our hello yet,
+        and it is asked again once it has.
+        """
+        session = gamedata.get('session')
+        if session is None and gamedata.sender not in self.peer.sessions.legacy:
+            self.peer.send_hello(gamedata.sender)
+            self.peer.after_hello(gamedata.sender, self.ask_for_gamedata)
+            return
+        if (session is None and self.session is None) or (session is not None and session != self.session):
+            self.open_session(session)
+        self.peer.sessions.add_member(self.session, gamedata.sender)
+        difficulty = gamedata.get('difficulty', DEFAULT_DIFFICULTY)
+        same_round = (
+            self.game.puzzle is not None
+            and gamedata['seed'] == self.game.seed - 1
+            and difficulty == self.game.difficulty
+            and gamedata.get('clues', self.game.clues) == self.game.clues
+        )
+        if not same_round:
+            self.game = Game(gamedata['seed'], difficulty=difficulty, clues=gamedata.get('clues'), pool=self.game.pool, node=self.node,
+                             journal=self.game.journal)
+            if 'puzzle' in gamedata:
+                self.game.puzzle = gamedata['puzzle']
+            self.game.start()
+        elif 'puzzle' in gamedata:
+            self.game.puzzle = gamedata['puzzle']
+        if 'grade' in gamedata:
+            self.game.grade = gamedata['grade']
+        for cell, number, ts, node in gamedata.get('cells', ()):
+            self.game.merge_cell(cell // 9, cell % 9, number, (ts, node))
+        if same_round and self.anti_entropy.interval > 0:
+            # The version vector we asked with can hide writes we never got,
+            # so compare boards with the sender right away
+            self.anti_entropy.send_digest(gamedata.sender)
+        if not same_round and self.on_game is not None:
+            self.on_game()
+        self.start()
+        self.changed()
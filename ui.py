@@ -1,26 +1,63 @@
 from tkinter import Canvas, Frame, Label
-import json
-from twisted.internet.task import LoopingCall
+from twisted.internet import reactor
 from random import randint
-from game import Game
+import time
+from sync import GameSync
+from metrics import Histogram, IN, OUT
+from uiqueue import UIQueue
+
+# Repaints of the board are coalesced to at most one per frame
+FRAME_MS = 16
 
 class UI(Frame):
     """
     The Tkinter UI, responsible for drawing the board and accepting user input.
+
+    The board keeps one text item per cell. Changes only mark the board as
+    needing a repaint; the repaint runs at most once per frame and configures
+    just the cells whose number or color changed, so a burst of moves costs
+    one pass over 81 cached cells instead of recreating the items for every
+    move. How long each repaint took goes into 'frame_times'.
+
+    With 'threaded' set the reactor runs on a thread of its own: the game
+    and the peer's metrics are only touched there, moves typed here are
+    passed to it with callFromThread, and what is to be drawn comes back
+    through a UIQueue drained once per frame, so neither side waits for the
+    other: a snapshot of the board after every change and a summary of the
+    metrics every second. The Tk thread draws from these and never reads
+    the game. Without it everything runs on the Tk thread and the same
+    snapshots are simply taken there.
     """
-    def __init__(self, root, peer, game):
+    def __init__(self, root, peer, game, flush_window=0.01, anti_entropy=5.0, threaded=False):
         self.peer = peer
-        self.peer.add_handler("move", self.handle_move)
-        self.peer.add_handler("ask_gamedata", self.handle_ask_for_gamedata)
-        self.peer.add_handler("gamedata", self.handle_gamedata)
-        self.game = game
+        self.threaded = threaded
+        if threaded:
+            self.queue = UIQueue()
+            callbacks = dict(
+                on_change=self.board_changed,
+                on_game=self.game_arrived,
+                on_win=lambda: self.queue.put(self.draw_victory),
+            )
+        else:
+            self.queue = None
+            callbacks = dict(on_change=self.draw_puzzle, on_game=self.game_received, on_win=self.draw_victory)
+        self.sync = GameSync(peer, game, flush_window, anti_entropy, **callbacks)
         Frame.__init__(self, root)
         self.root = root
         self.row, self.col = -1, -1
         self.margin = 20
         self.side = 50
         self.width = self.height = self.margin * 2 + self.side * 9
-        self.lc_performance = LoopingCall(self.draw_performance)
+        self.performance_call = None
+        self.last_drawn = None
+        self.cell_items = []
+        self.cell_state = [None] * 81
+        self.shown = None
+        self.repaint_call = None
+        self.last_repaint = 0.0
+        self.frame_times = Histogram()
+        if threaded:
+            self.drain()
 
     def init_ui(self):
         """
@@ -35,33 +72,156 @@ class UI(Frame):
         self.canvas.tag_lower(self.peer_text)
 
         self.draw_grid()
-        self.draw_puzzle()
+        self.create_cells()
+        self.repaint()
 
         self.performance_canvas = Canvas(self, width=self.width, height=40)
         self.performance_canvas.pack()
-        self.draw_performance()
+        self.network(self.measure_performance)
 
         self.canvas.bind("<Button-1>", self.cell_clicked)
         self.canvas.bind("<Key>", self.key_pressed)
         self.canvas.focus_set()
-        self.lc_performance.start(1)
+        self.performance_call = self.after(1000, self.tick_performance)
+        self.network(self.start)
+
+    def start(self):
+        """
+        Start syncing the game and show its board. Runs where the game lives.
+        """
+        self.sync.start()
+        self.board_changed()
+
+    def network(self, callback, *args):
+        """
+        Run a call that touches the game or the peer where they live: on the
+        reactor thread when threaded, right away otherwise.
+        """
+        if self.threaded:
+            reactor.callFromThread(callback, *args)
+        else:
+            callback(*args)
+
+    def drain(self):
+        """
+        Handle what the reactor thread queued since the last frame.
+        """
+        self.queue.drain(self.show)
+        self.after(FRAME_MS, self.drain)
+
+    def board_changed(self):
+        """
+        Called where the game lives after cells changed: hands a snapshot of
+        the board to the Tk thread when threaded, repaints otherwise.
+        """
+        if self.threaded:
+            self.queue.changed(self.snapshot())
+        else:
+            self.draw_puzzle()
+
+    def game_arrived(self):
+        """
+        Called on the reactor thread, when threaded, after a game received
+        from a peer replaced the current one.
+        """
+        self.queue.put(self.game_received)
+        self.board_changed()
+
+    def snapshot(self):
+        """
+        What the board shows: the number and color of every cell, and
+        whether the round is over, or None before there is a game. Taken
+        where the game lives.
+        """
+        game = self.game
+        if game.puzzle is None or game.board is None:
+            return None
+        puzzle = game.puzzle.cells
+        board = game.board.cells
+        cells = []
+        for cell in range(81):
+            answer = puzzle[cell]
+            if answer == 0:
+                cells.append((0, ""))
+            elif answer == board[cell]:
+                cells.append((answer, "black"))
+            else:
+                cells.append((answer, "red" if game.conflicting(cell // 9, cell % 9) else "sea green"))
+        return tuple(cells), game.game_over
+
+    def show(self, snapshot):
+        """
+        Take the latest snapshot of the board from the reactor thread and
+        repaint it at the next frame.
+        """
+        self.shown = snapshot
+        self.draw_puzzle()
+
+    def tick_performance(self):
+        self.network(self.measure_performance)
+        self.performance_call = self.after(1000, self.tick_performance)
+
+    def measure_performance(self):
+        """
+        Sum up the peer's metrics for the performance bar and have it drawn.
+        Runs where the peer lives.
+        """
+        profiler = self.peer.profiler
+        if profiler is None:
+            summary = self.performance()
+        else:
+            summary = profiler.tick(self.performance)
+        if self.threaded:
+            self.queue.put(self.draw_performance, summary)
+        else:
+            self.draw_performance(summary)
+
+    def performance(self):
+        """
+        The round-trip times and the totals of messages and bytes in and
+        out, with the time they were taken at.
+        """
+        metrics = self.peer.metrics
+        return metrics.rtt.snapshot(), metrics.clock.seconds(), metrics.total(IN) + metrics.total(OUT)
+
+    @property
+    def game(self):
+        """
+        The game being played, which is replaced when one arrives from a peer.
+        """
+        return self.sync.game
+
+    def game_received(self):
+        """
+        Called when a game received from a peer replaced the current one.
+        """
+        if not hasattr(self, 'canvas'):
+            self.init_ui()
 
 
-    def draw_performance(self):
+    def draw_performance(self, summary):
         """
-        Draw the performance metrics to the canvas.
+        Draw a summary of the performance metrics to the canvas.
         """
         self.performance_canvas.delete("performance")
-        self.peer.get_performance()
-        if self.peer.latency > 0:
-            self.performance_canvas.create_text(self.width/2, 10, text=f"Latency: {self.peer.latency:.6f}s", tags="performance", fill="black")
+        rtt, now, totals = summary
+        if rtt['count']:
+            text = f"RTT p50 {rtt['p50'] * 1000:.1f}ms  p99 {rtt['p99'] * 1000:.1f}ms  p99.9 {rtt['p999'] * 1000:.1f}ms"
         else:
-            self.performance_canvas.create_text(self.width/2, 10, text="Latency: N/A", tags="performance", fill="black")
-        
-        if self.peer.throughput > 0:
-            self.performance_canvas.create_text(self.width/2, 25, text=f"Throughput: {self.peer.throughput:.2f} msg/s", tags="performance", fill="black")
+            text = "RTT: N/A"
+        self.performance_canvas.create_text(self.width/2, 10, text=text, tags="performance", fill="black")
+
+        # Rates since the last redraw, from counters that are never reset
+        elapsed = now - self.last_drawn[0] if self.last_drawn else 0
+        if elapsed > 0:
+            packets_in, bytes_in, packets_out, bytes_out = (
+                (new - old) / elapsed for new, old in zip(totals, self.last_drawn[1])
+            )
+            text = f"In {packets_in:.1f} msg/s {bytes_in / 1024:.1f} KiB/s  Out {packets_out:.1f} msg/s {bytes_out / 1024:.1f} KiB/s"
         else:
-            self.performance_canvas.create_text(self.width/2, 25, text="Throughput: N/A", tags="performance", fill="black")
+            text = "Throughput: N/A"
+        self.performance_canvas.create_text(self.width/2, 25, text=text, tags="performance", fill="black")
+        self.last_drawn = (now, totals)
 
     def draw_grid(self,):
         """
@@ -82,20 +242,46 @@ class UI(Frame):
             y1 = self.margin + i * self.side 
             self.canvas.create_line(x0, y0, x1, y1, fill=color)
 
-    def draw_puzzle(self):
+    def create_cells(self):
         """
-        Fill the grid with numbers from the puzzle
+        Create the text item of every cell, empty until the first repaint.
         """
-        self.canvas.delete("numbers")
+        self.cell_items = []
         for i in range(9):
             for j in range(9):
-                answer = self.game.puzzle[i][j]
-                if answer != 0:
-                    x = self.margin + j * self.side + self.side / 2 
-                    y = self.margin + i * self.side + self.side / 2
-                    original = self.game.board[i][j]
-                    color = "black" if answer == original else "sea green"
-                    self.canvas.create_text(x, y, text=answer, tags="numbers", fill=color)
+                x = self.margin + j * self.side + self.side / 2
+                y = self.margin + i * self.side + self.side / 2
+                self.cell_items.append(self.canvas.create_text(x, y, text="", tags="numbers"))
+        self.cell_state = [None] * 81
+
+    def draw_puzzle(self):
+        """
+        Fill the grid with numbers from the puzzle, at the next frame. Calls
+        within the same frame are coalesced into one repaint.
+        """
+        if self.repaint_call is not None or not self.cell_items:
+            return
+        delay = self.last_repaint + FRAME_MS / 1000 - time.perf_counter()
+        self.repaint_call = self.after(max(0, int(delay * 1000)), self.repaint)
+
+    def repaint(self):
+        """
+        Update the cells whose number or color changed since the last repaint.
+        """
+        self.repaint_call = None
+        start = time.perf_counter()
+        if not self.threaded:
+            self.shown = self.snapshot()
+        if self.shown is None:
+            return
+        cells, _ = self.shown
+        state = self.cell_state
+        for cell, drawn in enumerate(cells):
+            if drawn != state[cell]:
+                state[cell] = drawn
+                self.canvas.itemconfigure(self.cell_items[cell], text=drawn[0] or "", fill=drawn[1] or "black")
+        self.last_repaint = time.perf_counter()
+        self.frame_times.record(self.last_repaint - start)
 
     def draw_cursor(self):
         """
@@ -115,15 +301,35 @@ class UI(Frame):
         """
         x = y = self.margin + 4 * self.side + self.side / 2
         self.canvas.create_text(x, y, text="You win!", tags="victory", fill="white", font=("Arial", 32))
-        self.game.puzzle = None
-        self.game.start()
+        self.network(self.next_round)
         self.after(2000, self.clear_answers)
 
+    def next_round(self):
+        """
+        Start the next round and show its board. Runs where the game lives.
+        """
+        self.sync.next_round()
+        if self.threaded:
+            self.board_changed()
+
+    def over(self):
+        """
+        Whether there is no board to play on, or its round is over, as last
+        shown.
+        """
+        return self.shown is None or self.shown[1]
+
+    def is_clue(self, row, col):
+        """
+        Whether a cell holds a clue, as last shown.
+        """
+        return self.shown[0][row * 9 + col][1] == "black"
+
     def cell_clicked(self, event):
         """
         Called when the user clicks a cell.
         """
-        if self.game.game_over:
+        if self.over():
             return
         x, y = event.x, event.y
         if self.margin < x < self.width - self.margin and self.margin < y < self.height - self.margin:
@@ -137,27 +343,20 @@ class UI(Frame):
         """
         Called when the user presses a key.
         """
-        if self.game.game_over:
+        if self.over():
             return
         if self.row >= 0 and self.col >= 0 and event.char in "1234567890":
-            original_number = self.game.board[self.row][self.col]
-            if original_number == 0:
-                self.game.puzzle[self.row][self.col] = int(event.char)
-                self.send_move(self.row, self.col, int(event.char))
+            if not self.is_clue(self.row, self.col):
+                self.network(self.sync.play, self.row, self.col, int(event.char))
                 self.col, self.row = -1, -1
-                self.draw_puzzle()
                 self.draw_cursor()
-                if self.game.check_win():
-                    self.draw_victory()
-        elif event.keysym == "BackSpace":
-            original_number = self.game.board[self.row][self.col]
+                self.network(self.sync.changed)
+        elif event.keysym == "BackSpace" and self.row >= 0 and self.col >= 0:
             # dont update anything if the cell is an original number
-            if self.game.puzzle[self.row][self.col] != original_number:
-                if original_number == 0:
-                    self.game.puzzle[self.row][self.col] = 0
-                    self.send_move(self.row, self.col, 0)
-                    self.draw_puzzle()
-                    self.draw_cursor()
+            if not self.is_clue(self.row, self.col) and self.shown[0][self.row * 9 + self.col][0] != 0:
+                self.network(self.sync.play, self.row, self.col, 0)
+                self.network(self.sync.changed)
+                self.draw_cursor()
 
     def clear_answers(self):
         """
@@ -165,84 +364,4 @@ class UI(Frame):
         """
         self.canvas.delete("victory")
         self.draw_puzzle()
-    
-    def handle_move(self, line):
-        """
-        Method to handle a move received from a peer.
-        """
-        peer, port = json.loads(line)['addr'], int(json.loads(line)['port'])
-        if (peer, port) not in self.peer.peers:
-            self.peer.peers.add((peer, port))
-            self.send_gamedata((peer, port))
-            return  
-        self.peer.messages_count += 1
-        move = json.loads(line)
-        self.game.puzzle[move['row']][move['col']] = move['number']
-        self.draw_puzzle()
-        if self.game.check_win():
-            self.draw_victory()
-        
-    def send_move(self, row, col, number):
-        """
-        Method to send a move to all online peers.
-        """
-        move = json.dumps({'row': row, 'col': col, 'number': number, 'addr':f'{self.peer.addr}','port':f'{self.peer.port}','msgtype': 'move'})
-        move = move.encode('utf-8')
-        try:
-            for peer in self.peer.peers:
-                self.peer.transport.write(move, peer)
-        except:
-            pass
-
-    def ask_for_gamedata(self, addr):
-        """
-        Method to ask a peer for the game data.
-        """
-        ask = json.dumps({'addr': self.peer.addr, 'port': self.peer.port, 'msgtype': 'ask_gamedata'})
-        ask = ask.encode('utf-8')
-        try:
-            self.peer.transport.write(ask, addr)
-        except:
-            pass
-
-    def handle_ask_for_gamedata(self, line):
-        """
-        Method to handle the game data received from a peer.
-        """
-        self.peer.messages_count += 1
-        ask = json.loads(line)
-        peer = (ask['addr'], ask['port'])
-        self.send_gamedata(peer)
-
-    def send_gamedata(self, addr):
-        """
-        Method to send the game data to a peer.
-        """
-        gamedata = json.dumps({
-            'msgtype': 'gamedata',
-            'seed': self.game.seed-1,
-            'puzzle': self.game.puzzle,
-        })
-        
-        gamedata = gamedata.encode('utf-8')
-        try:
-            self.peer.transport.write(gamedata, addr)
-        except:
-            pass
-
-    def handle_gamedata(self, line):
-        """
-        Method to handle the game data received from a peer.
-        """
-        self.peer.messages_count += 1
-        gamedata = json.loads(line)
-        self.game = Game(gamedata['seed'])
-        self.game.puzzle = gamedata['puzzle']
-        self.game.start()
-        if not hasattr(self, 'canvas'):
-            self.init_ui()
-        self.draw_puzzle()
-        if self.game.check_win():
-            self.draw_victory()
-      
-        
\ No newline at end of file
+
@@ -0,0 +1,57 @@
+from collections import deque
+
+# GIL switch interval in seconds with the reactor on its own thread. The
+# default 5 ms is how long a busy UI thread can keep a datagram waiting.
+SWITCH_INTERVAL = 0.001
+
+
+class UIQueue(object):
+    """
+    Hands events from the network thread to the Tk thread without a lock.
+
+    The network thread only ever appends to deques and the Tk thread only
+    pops from them; both are single atomic operations in CPython, so
+    neither side blocks the other. Board changes are not queued events but
+    a snapshot of the whole board in a deque that holds one: a newer
+    snapshot replaces the one not drained yet, so any number of changes
+    between two frames need one repaint, and the Tk thread never reads the
+    game itself. Other events are queued up to 'size'; past that they are
+    dropped and counted, which only happens if the UI has stopped draining.
+    """
+    def __init__(self, size=256):
+        self.size = size
+        self.events = deque()
+        self.latest = deque(maxlen=1)
+        self.dropped = 0
+        self.drained = 0
+
+    def changed(self, snapshot):
+        """
+        Hand over a snapshot of the board after it changed. Called on the
+        network thread.
+        """
+        self.latest.append(snapshot)
+
+    def put(self, callback, *args):
+        """
+        Queue a call to run on the Tk thread. Called on the network thread.
+        """
+        if len(self.events) >= self.size:
+            self.dropped += 1
+            return False
+        self.events.append((callback, args))
+        return True
+
+    def drain(self, on_change):
+        """
+        Run the queued calls, then 'on_change' with the latest snapshot if the
+        board changed since the last drain. Called on the Tk thread, once per
+        frame.
+        """
+        events = self.events
+        while events:
+            callback, args = events.popleft()
+            self.drained += 1
+            callback(*args)
+        if self.latest:
+            on_change(self.latest.popleft())
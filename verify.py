@@ -0,0 +1,129 @@
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from board import Board
+from game import Game
+
+# Boards validated at once; bounds the temporaries to a few MB
+CHUNK = 4096
+
+if np is not None:
+    # Cell value -> a 1 in the 4-bit field of the number, nothing for empty
+    # cells and values above 9
+    FIELDS = np.zeros(256, dtype=np.uint64)
+    FIELDS[1:10] = [1 << 4 * (number - 1) for number in range(1, 10)]
+    # The bits of every field that are only set by counts of 2 and more
+    TWICE = np.uint64(0xEEEEEEEEE)
+
+
+def available():
+    """
+    Whether batch verification can run, i.e. numpy is installed.
+    """
+    return np is not None
+
+
+def require():
+    if np is None:
+        raise ImportError("Batch verification needs numpy: pip install numpy")
+
+
+def as_array(boards):
+    """
+    An (N, 9, 9) uint8 array of boards, from such an array, an (N, 81) one,
+    or a sequence of Boards or lists of nine rows. Arrays of other integer
+    types are checked to fit in a byte first.
+    """
+    require()
+    if isinstance(boards, np.ndarray):
+        if boards.dtype != np.uint8:
+            # astype wraps values that do not fit, 256 would pass as empty
+            if boards.dtype.kind not in 'biu':
+                raise ValueError(f"Boards must hold integers, not {boards.dtype}")
+            if boards.size and (boards.min() < 0 or boards.max() > 255):
+                raise ValueError(f"Cell values must be in 0..255, not {boards.min()}..{boards.max()}")
+            boards = boards.astype(np.uint8)
+        if boards.ndim == 2 and boards.shape[1] == 81:
+            boards = boards.reshape(-1, 9, 9)
+        if boards.ndim != 3 or boards.shape[1:] != (9, 9):
+            raise ValueError(f"Boards must be an (N, 9, 9) array, not {boards.shape}")
+        return boards
+    data = b"".join(bytes(board if isinstance(board, Board) else Board.from_rows(board)) for board in boards)
+    return np.frombuffer(data, dtype=np.uint8).reshape(-1, 9, 9)
+
+
+def validate(boards):
+    """
+    Check a batch of boards in one vectorized pass over all rows, columns and
+    boxes. Returns a bool array of the boards that are completed, every cell
+    filled and no number twice in a unit, and an (N, 9, 9) bool mask of the
+    cells whose number occurs again in their row, column or box, as
+    Game.conflicts lists them. Numbers above 9 count as conflicts too.
+    """
+    boards = as_array(boards)
+    valid = np.empty(len(boards), dtype=bool)
+    conflicts = np.empty(boards.shape, dtype=bool)
+    for start in range(0, len(boards), CHUNK):
+        chunk = boards[start:start + CHUNK]
+        valid[start:start + CHUNK], conflicts[start:start + CHUNK] = validate_chunk(chunk)
+    return valid, conflicts
+
+
+def validate_chunk(boards):
+    # Every cell as a 1 in the 4-bit field of its number, so summing a unit
+    # counts each number in its own field; 9 at most, so nothing carries over
+    fields = FIELDS[boards]
+    rows = fields.sum(axis=2)
+    cols = fields.sum(axis=1)
+    bands = fields[:, 0::3] + fields[:, 1::3] + fields[:, 2::3]
+    boxes = bands[:, :, 0::3] + bands[:, :, 1::3] + bands[:, :, 2::3]
+    # The fields of the numbers that occur twice in each cell's row, column or box
+    clashes = (rows & TWICE)[:, :, None] | (cols & TWICE)[:, None, :] | (boxes & TWICE).repeat(3, axis=1).repeat(3, axis=2)
+    conflicts = ((clashes & fields * np.uint64(0xF)) != 0) | (boards > 9)
+    valid = (boards != 0).all(axis=(1, 2)) & ~conflicts.any(axis=(1, 2))
+    return valid, conflicts
+
+
+def solutions(seeds, solver=None):
+    """
+    The solutions of the games of the given seeds, as sent with their game
+    data, in an (N, 9, 9) array: the boards Game(seed).start() carves its
+    puzzle from. Every distinct seed is solved once.
+    """
+    require()
+    seeds = np.asarray(seeds, dtype=np.int64)
+    unique, inverse = np.unique(seeds, return_inverse=True)
+    game = Game(0, solver=solver)
+    table = np.empty((len(unique), 9, 9), dtype=np.uint8)
+    for i, seed in enumerate(unique.tolist()):
+        table[i] = np.frombuffer(bytes(game.generate_solution(seed + 1)), dtype=np.uint8).reshape(9, 9)
+    return table[inverse.reshape(-1)]
+
+
+def compare(boards, solved):
+    """
+    Compare a batch of boards with their solutions. Returns a bool array of
+    the boards equal to their solution and an (N, 9, 9) bool mask of the
+    filled cells that differ from it; empty cells are not counted wrong.
+    """
+    boards = as_array(boards)
+    solved = as_array(solved)
+    if boards.shape != solved.shape:
+        raise ValueError(f"{len(boards)} boards but {len(solved)} solutions")
+    wrong = (boards != solved) & (boards != 0)
+    matches = (boards == solved).all(axis=(1, 2))
+    return matches, wrong
+
+
+def verify(boards, seeds, solver=None):
+    """
+    Validate a batch of boards and compare them with the solutions of their
+    seeds. Returns the boards that are completed and equal to their
+    solution, the conflict masks and the masks of wrong cells.
+    """
+    boards = as_array(boards)
+    valid, conflicts = validate(boards)
+    matches, wrong = compare(boards, solutions(seeds, solver))
+    return valid & matches, conflicts, wrong